@@ -1,11 +1,11 @@
-import os
-import json
-import tempfile
+import hashlib
 from datetime import datetime
 from fastapi import FastAPI, File, UploadFile, Form, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from .utils.image_hash import compute_combined_hash, is_duplicate
+from ecolearn_core.metrics import StageTimer
+from ecolearn_core.listing import ListingQueryError, etag_matches, list_student_page, listing_etag, parse_listing_query
+from ecolearn_core.serverless import DEDUP_SCOPE, DUPLICATE_SCORER, compute_hash, find_crop_match, get_store
 
 app = FastAPI()
 
@@ -18,56 +18,58 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Use /tmp directory for Vercel serverless functions
-TEMP_DIR = "/tmp"
-HASH_FILE = os.path.join(TEMP_DIR, "hashes.json")
-
-def ensure_hash_file():
-    """Ensure hash file exists"""
-    if not os.path.exists(HASH_FILE):
-        os.makedirs(os.path.dirname(HASH_FILE), exist_ok=True)
-        with open(HASH_FILE, 'w') as f:
-            json.dump({"students": {}}, f, indent=2)
-
-def load_hash_db():
-    """Load hash database"""
-    ensure_hash_file()
-    with open(HASH_FILE, 'r') as f:
-        return json.load(f)
-
-def save_hash_db(data):
-    """Save hash database"""
-    ensure_hash_file()
-    with open(HASH_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
+# The hash store lives in /tmp and is shared with the other api/ functions;
+# see ecolearn_core/serverless.py. PIL and NumPy load on the first upload.
 
 @app.get("/api/health")
 async def health():
     return {"status": "ok", "message": "Eco Learn API is running"}
 
+@app.middleware("http")
+async def log_upload_timings(request: Request, call_next):
+    """Log per-stage upload timings as one JSON line (see ecolearn_core/metrics.py)"""
+    if request.method != 'POST' or request.url.path != '/api/upload-challenge-proof':
+        return await call_next(request)
+    timer = request.state.timer = StageTimer()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        print(timer.log_line(handler="api/index.py", status=status), flush=True)
+
 @app.post("/api/upload-challenge-proof")
 async def upload_challenge_proof(
+    request: Request,
     student_id: str = Form(...),
     challenge_id: str = Form(...),
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
+    institution_id: str = Form(None)
 ):
     """Upload challenge proof image"""
+    timer = request.state.timer
+    timer.record('parse', timer.elapsed())
     if not file.content_type.startswith('image/'):
         return JSONResponse(status_code=400, content={"error": "Only image uploads are allowed"})
 
-    contents = await file.read()
+    with timer.stage('read'):
+        contents = await file.read()
+    # Exact resubmissions are rejected before any image decoding
+    with timer.stage('digest_lookup'):
+        digest = hashlib.sha256(contents).hexdigest()
+        match = get_store().find_by_digest(digest, DEDUP_SCOPE, student_id, challenge_id, institution_id)
+    if match:
+        return JSONResponse(status_code=409, content={"error": "Duplicate image detected", "match": match})
+
     try:
-        new_hash = compute_combined_hash(contents)
+        timings = {}
+        new_hash = compute_hash(contents, timings)
+        for name, seconds in timings.items():
+            timer.record(name, seconds)
     except Exception as e:
         return JSONResponse(status_code=400, content={"error": f"Invalid image file: {e}"})
 
-    db = load_hash_db()
-    student_entry = db.setdefault('students', {}).setdefault(student_id, {"images": []})
-    existing_hashes = [img['hash'] for img in student_entry['images']]
-
-    if is_duplicate(new_hash, existing_hashes, threshold=5):
-        return JSONResponse(status_code=409, content={"error": "Duplicate image detected"})
-
     # For Vercel, we'll store metadata only (not the actual file for this demo)
     timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S_%f')
     safe_name = file.filename.replace(' ', '_')
@@ -78,19 +80,34 @@ async def upload_challenge_proof(
         "filename": stored_filename,
         "uploaded_at": timestamp,
         "hash": new_hash,
-        "file_size": len(contents)
+        "file_size": len(contents),
+        "sha256": digest
     }
-    student_entry['images'].append(record)
-    save_hash_db(db)
+    if institution_id:
+        record["institution_id"] = institution_id
+    with timer.stage('dedup'):
+        match = find_crop_match(student_id, new_hash)
+    if match:
+        return JSONResponse(status_code=409, content={"error": "Duplicate image detected", "match": match})
+    with timer.stage('store_write'):
+        match, _ = get_store().add_image_if_unique(student_id, record, DUPLICATE_SCORER, DEDUP_SCOPE)
+    if match:
+        return JSONResponse(status_code=409, content={"error": "Duplicate image detected", "match": match})
 
     return {"success": True, "record": record}
 
 @app.get("/api/student/{student_id}/images")
-async def list_student_images(student_id: str):
-    """List stored image metadata for a student"""
-    db = load_hash_db()
-    images = db.get('students', {}).get(student_id, {}).get('images', [])
-    return {"images": images}
+async def list_student_images(student_id: str, request: Request):
+    """List stored image metadata for a student (paged; see ecolearn_core/listing.py)"""
+    try:
+        query = parse_listing_query(request.query_params)
+    except ListingQueryError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    etag = listing_etag(student_id, get_store().student_version(student_id), query)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=list_student_page(get_store(), student_id, query), headers=headers)
 
 # Handler for Vercel
 def handler(request):
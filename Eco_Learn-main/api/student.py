@@ -1,24 +1,16 @@
 from http.server import BaseHTTPRequestHandler
 import json
-import os
-import sys
-from urllib.parse import urlparse
+from urllib.parse import parse_qs, urlparse
 
-# Add the api directory to sys.path
-sys.path.append('/var/task/api')
-sys.path.append(os.path.dirname(__file__))
-
-try:
-    from storage import get_student_images
-except ImportError:
-    def get_student_images(student_id):
-        return []
+from ecolearn_core.listing import ListingQueryError, etag_matches, listing_etag, parse_listing_query
+from ecolearn_core.serverless import get_student_image_count, get_student_images_page, get_student_version
 
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
         try:
             # Parse the URL to get student_id
-            url_path = urlparse(self.path).path
+            url = urlparse(self.path)
+            url_path = url.path
             path_parts = url_path.strip('/').split('/')
             
             # Expected URL format: /api/student/{student_id}/images
@@ -28,15 +20,34 @@ class handler(BaseHTTPRequestHandler):
                 self.send_error_response(400, "Invalid URL format. Expected: /api/student/{student_id}/images")
                 return
 
+            # Paging, filters and projection: see ecolearn_core/listing.py
+            params = {name: values[0] for name, values in parse_qs(url.query).items()}
+            try:
+                query = parse_listing_query(params)
+            except ListingQueryError as e:
+                self.send_error_response(400, str(e))
+                return
+
+            etag = listing_etag(student_id, get_student_version(student_id), query)
+            if etag_matches(self.headers.get('If-None-Match'), etag):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', 'private, no-cache')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                return
+
             # Get student's images
-            images = get_student_images(student_id)
+            page = get_student_images_page(student_id, query)
 
             # Send response
             self.send_success_response({
-                "images": images,
+                "images": page["images"],
+                "next_cursor": page["next_cursor"],
                 "student_id": student_id,
-                "total_count": len(images)
-            })
+                "count": len(page["images"]),
+                "total_count": get_student_image_count(student_id)
+            }, etag=etag)
 
         except Exception as e:
             self.send_error_response(500, f"Server error: {str(e)}")
@@ -45,12 +56,15 @@ class handler(BaseHTTPRequestHandler):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, If-None-Match')
         self.end_headers()
 
-    def send_success_response(self, data):
+    def send_success_response(self, data, etag=None):
         self.send_response(200)
         self.send_header('Content-type', 'application/json')
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'private, no-cache')
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
@@ -1,38 +1,30 @@
 from http.server import BaseHTTPRequestHandler
 import json
 import os
-import sys
-import io
 from datetime import datetime
 
-# Add the api directory to sys.path to import our utilities
-sys.path.append('/var/task/api')
-sys.path.append(os.path.dirname(__file__))
-
-try:
-    from utils.image_hash import compute_combined_hash, is_duplicate
-    from storage import add_student_image, get_student_hashes
-except ImportError:
-    # Fallback if import fails
-    def compute_combined_hash(image_bytes):
-        return {"combined": f"fallback_hash_{len(image_bytes)}"}
-    
-    def is_duplicate(new_hash, existing_hashes, threshold=5):
-        return False
-    
-    def add_student_image(student_id, record):
-        return 1
-    
-    def get_student_hashes(student_id):
-        return []
+from ecolearn_core.metrics import StageTimer
+from ecolearn_core.multipart_stream import (
+    MultipartError, UploadTooLarge, boundary_from_content_type, parse_multipart,
+)
+from ecolearn_core.serverless import add_student_image_if_unique, compute_hash, find_crop_match, find_image_by_digest
+
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', str(20 * 1024 * 1024)))
+# Allowance for the form fields and part headers around the file
+MULTIPART_OVERHEAD = 64 * 1024
 
 class handler(BaseHTTPRequestHandler):
+    timer = None
+
     def do_POST(self):
+        # Stage timings are logged as one JSON line when the response is sent
+        self.timer = StageTimer()
         try:
-            # Parse the multipart form data
-            content_type = self.headers.get('Content-Type', '')
-            if not content_type.startswith('multipart/form-data'):
-                self.send_error_response(400, "Only multipart/form-data supported")
+            # Stream the multipart form data into a spooled file
+            try:
+                boundary = boundary_from_content_type(self.headers.get('Content-Type', ''))
+            except MultipartError as e:
+                self.send_error_response(400, str(e))
                 return
 
             # Get the content length
@@ -40,82 +32,100 @@ class handler(BaseHTTPRequestHandler):
             if content_length == 0:
                 self.send_error_response(400, "No data received")
                 return
-
-            # Read the form data
-            form_data = self.rfile.read(content_length)
-            
-            # Parse multipart data manually
-            boundary = content_type.split('boundary=')[1].encode()
-            parts = form_data.split(b'--' + boundary)
-            
-            student_id = None
-            challenge_id = None
-            file_data = None
-            filename = None
-            
-            for part in parts:
-                if b'Content-Disposition: form-data' in part:
-                    if b'name="student_id"' in part:
-                        student_id = part.split(b'\r\n\r\n')[1].split(b'\r\n')[0].decode()
-                    elif b'name="challenge_id"' in part:
-                        challenge_id = part.split(b'\r\n\r\n')[1].split(b'\r\n')[0].decode()
-                    elif b'name="file"' in part and b'filename=' in part:
-                        header_section = part.split(b'\r\n\r\n')[0]
-                        filename_start = header_section.find(b'filename="') + 10
-                        filename_end = header_section.find(b'"', filename_start)
-                        filename = header_section[filename_start:filename_end].decode()
-                        
-                        # Extract file data (everything after the double CRLF)
-                        data_start = part.find(b'\r\n\r\n') + 4
-                        file_data = part[data_start:part.rfind(b'\r\n')]
-
-            if not all([student_id, challenge_id, file_data]):
-                self.send_error_response(400, "Missing required fields: student_id, challenge_id, or file")
-                return
-
-            # Check if it's an image
-            if not filename or not any(filename.lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp']):
-                self.send_error_response(400, "Only image files are allowed")
+            if content_length > MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD:
+                self.send_error_response(413, f"File exceeds {MAX_UPLOAD_BYTES} bytes")
                 return
 
-            # Compute hash for duplicate detection
+            # Reading and parsing are interleaved, so both count as 'parse'
             try:
-                new_hash = compute_combined_hash(file_data)
-            except Exception as e:
-                self.send_error_response(400, f"Invalid image file: {str(e)}")
+                with self.timer.stage('parse'):
+                    fields, upload = parse_multipart(self.rfile, content_length, boundary,
+                                                     max_file_bytes=MAX_UPLOAD_BYTES)
+            except UploadTooLarge:
+                self.close_connection = True  # the rest of the body was not read
+                self.send_error_response(413, f"File exceeds {MAX_UPLOAD_BYTES} bytes")
                 return
-
-            # Check for duplicates
-            existing_hashes = get_student_hashes(student_id)
-            if is_duplicate(new_hash, existing_hashes, threshold=5):
-                self.send_error_response(409, "Duplicate image detected")
+            except MultipartError as e:
+                self.close_connection = True
+                self.send_error_response(400, str(e))
                 return
 
-            # Store the new hash
-            timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S_%f')
-            safe_filename = filename.replace(' ', '_')
-            stored_filename = f"{timestamp}_{safe_filename}"
-
-            record = {
-                "challenge_id": challenge_id,
-                "filename": stored_filename,
-                "uploaded_at": timestamp,
-                "hash": new_hash,
-                "file_size": len(file_data)
-            }
-            
-            total_files = add_student_image(student_id, record)
-
-            # Send success response
-            self.send_success_response({
-                "success": True, 
-                "record": record,
-                "message": f"File uploaded successfully. Total files for student: {total_files}"
-            })
+            try:
+                self.handle_upload(fields, upload)
+            finally:
+                if upload is not None:
+                    upload.close()
 
         except Exception as e:
             self.send_error_response(500, f"Server error: {str(e)}")
 
+    def handle_upload(self, fields, upload):
+        student_id = fields.get('student_id')
+        challenge_id = fields.get('challenge_id')
+        institution_id = fields.get('institution_id') or None
+        if not all([student_id, challenge_id, upload and upload.size]):
+            self.send_error_response(400, "Missing required fields: student_id, challenge_id, or file")
+            return
+        filename = upload.filename
+
+        # Check if it's an image
+        if not filename or not any(filename.lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp']):
+            self.send_error_response(400, "Only image files are allowed")
+            return
+
+        # Exact resubmissions are rejected before any image decoding
+        with self.timer.stage('digest_lookup'):
+            digest = upload.sha256
+            match = find_image_by_digest(student_id, challenge_id, digest, institution_id)
+        if match:
+            self.send_error_response(409, "Duplicate image detected", match=match)
+            return
+
+        # Compute hash for duplicate detection
+        try:
+            timings = {}
+            new_hash = compute_hash(upload.file, timings)
+            for name, seconds in timings.items():
+                self.timer.record(name, seconds)
+        except Exception as e:
+            self.send_error_response(400, f"Invalid image file: {str(e)}")
+            return
+
+        # Store the new hash unless it duplicates an earlier upload
+        timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S_%f')
+        safe_filename = filename.replace(' ', '_')
+        stored_filename = f"{timestamp}_{safe_filename}"
+
+        record = {
+            "challenge_id": challenge_id,
+            "filename": stored_filename,
+            "uploaded_at": timestamp,
+            "hash": new_hash,
+            "file_size": upload.size,
+            "sha256": digest
+        }
+        if institution_id:
+            record["institution_id"] = institution_id
+
+        with self.timer.stage('dedup'):
+            match = find_crop_match(student_id, new_hash)
+        if match:
+            self.send_error_response(409, "Duplicate image detected", match=match)
+            return
+
+        with self.timer.stage('store_write'):
+            match, total_files = add_student_image_if_unique(student_id, record)
+        if match:
+            self.send_error_response(409, "Duplicate image detected", match=match)
+            return
+
+        # Send success response
+        self.send_success_response({
+            "success": True, 
+            "record": record,
+            "message": f"File uploaded successfully. Total files for student: {total_files}"
+        })
+
     def do_OPTIONS(self):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
@@ -123,7 +133,13 @@ class handler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         self.end_headers()
 
+    def log_timings(self, status_code):
+        if self.timer is not None:
+            print(self.timer.log_line(handler="api/upload-challenge-proof.py", status=status_code), flush=True)
+            self.timer = None
+
     def send_success_response(self, data):
+        self.log_timings(200)
         self.send_response(200)
         self.send_header('Content-type', 'application/json')
         self.send_header('Access-Control-Allow-Origin', '*')
@@ -132,12 +148,13 @@ class handler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(json.dumps(data).encode())
 
-    def send_error_response(self, status_code, message):
+    def send_error_response(self, status_code, message, **extra):
+        self.log_timings(status_code)
         self.send_response(status_code)
         self.send_header('Content-type', 'application/json')
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         self.end_headers()
-        error_data = {"error": message}
+        error_data = {"error": message, **extra}
         self.wfile.write(json.dumps(error_data).encode())
\ No newline at end of file
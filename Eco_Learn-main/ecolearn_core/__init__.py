@@ -0,0 +1,6 @@
+"""Image hashing, near-duplicate index and hash storage shared by the
+FastAPI server (server/app.py) and the Vercel functions (api/).
+
+Submodules are imported explicitly; this package imports nothing on its own
+so entry points only pay for what they use.
+"""
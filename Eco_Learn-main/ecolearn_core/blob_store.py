@@ -0,0 +1,282 @@
+import argparse
+import hashlib
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Content-addressed storage for uploaded originals. Each distinct file is
+# stored once, as <root>/<digest[0:2]>/<digest[2:4]>/<sha256 hex>, however
+# many records point at it: the same proof accepted for two students, or
+# under two challenges, takes the space of one. The two 256-way fan-out
+# levels keep directories small (about 15 files per leaf at a million blobs).
+#
+# An index (a SQLite file, blobs.sqlite3 in the storage directory) maps each
+# record's relative_path, the path of its public /uploads URL, to a digest,
+# and counts the paths referencing each blob. URLs therefore never change,
+# and uploads written before this store stay in the uploads tree, served
+# from there until `migrate` moves them in.
+#
+# Writes go to a temporary name in the blob's directory and are renamed
+# into place, inside a BEGIN IMMEDIATE transaction on the index, so readers
+# never see a partial file and concurrent workers agree on whether a blob
+# exists. A blob is deleted with its last reference. gc drops mappings no
+# record refers to (a crash between storing the file and committing the
+# record) and can sweep files the index does not know about.
+#
+#     python -m ecolearn_core.blob_store migrate   # move the uploads tree in
+#     python -m ecolearn_core.blob_store gc [--sweep]
+#     python -m ecolearn_core.blob_store stats
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    refs INTEGER NOT NULL  -- paths mapped to this blob
+);
+CREATE TABLE IF NOT EXISTS paths (
+    relative_path TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+DIGEST = re.compile(r'^[0-9a-f]{64}$')
+READ_CHUNK = 1024 * 1024
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """Blobs under root, indexed in the SQLite file index_path."""
+
+    def __init__(self, root: str, index_path: str):
+        self.root = root
+        self.index_path = index_path
+        os.makedirs(root, exist_ok=True)
+        self._conn = sqlite3.connect(index_path, isolation_level=None, check_same_thread=False, timeout=30)
+        self._lock = threading.RLock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def blob_path(self, digest: str) -> str:
+        if not DIGEST.match(digest):
+            raise ValueError(f"Not a SHA-256 hex digest: {digest!r}")
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, across threads and
+        # worker processes alike
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _release(self, conn, relative_path: str) -> int:
+        """Unmap relative_path, deleting its blob if nothing else refers to
+        it. Returns the bytes freed, or None if the path was not mapped."""
+        row = conn.execute("SELECT digest FROM paths WHERE relative_path = ?", (relative_path,)).fetchone()
+        if row is None:
+            return None
+        digest = row[0]
+        conn.execute("DELETE FROM paths WHERE relative_path = ?", (relative_path,))
+        conn.execute("UPDATE blobs SET refs = refs - 1 WHERE digest = ?", (digest,))
+        refs, size = conn.execute("SELECT refs, size FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        if refs > 0:
+            return 0
+        conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+        try:
+            os.remove(self.blob_path(digest))
+        except FileNotFoundError:
+            pass
+        return size
+
+    def add(self, source_path: str, relative_path: str, digest: str) -> bool:
+        """Store the file at source_path (its SHA-256 is digest) and map
+        relative_path to it. The source is moved, or deleted when the blob
+        already exists. Returns True if a new blob was written."""
+        final = self.blob_path(digest)
+        with self._transaction() as conn:
+            self._release(conn, relative_path)
+            exists = (conn.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone() is not None
+                      and os.path.exists(final))
+            if exists:
+                os.remove(source_path)
+            else:
+                os.makedirs(os.path.dirname(final), exist_ok=True)
+                tmp_path = f"{final}.{uuid.uuid4().hex}.tmp"
+                shutil.move(source_path, tmp_path)  # a rename on the same filesystem
+                os.replace(tmp_path, final)
+            conn.execute("INSERT INTO paths (relative_path, digest, created_at) VALUES (?, ?, ?)",
+                         (relative_path, digest, time.time()))
+            conn.execute("INSERT INTO blobs (digest, size, refs) VALUES (?, ?, 1) "
+                         "ON CONFLICT (digest) DO UPDATE SET refs = refs + 1, size = excluded.size",
+                         (digest, os.path.getsize(final)))
+        return not exists
+
+    def remove(self, relative_path: str) -> bool:
+        """Unmap relative_path; its blob is deleted with its last reference.
+        Returns whether the path was mapped."""
+        with self._transaction() as conn:
+            return self._release(conn, relative_path) is not None
+
+    def resolve(self, relative_path: str):
+        """Blob file holding relative_path, or None if it is not mapped."""
+        with self._lock:
+            row = self._conn.execute("SELECT digest FROM paths WHERE relative_path = ?",
+                                     (relative_path,)).fetchone()
+        return self.blob_path(row[0]) if row else None
+
+    def paths(self) -> list:
+        """[(relative_path, blob file)] for every mapped path."""
+        with self._lock:
+            rows = self._conn.execute("SELECT relative_path, digest FROM paths ORDER BY relative_path").fetchall()
+        return [(relative_path, self.blob_path(digest)) for relative_path, digest in rows]
+
+    def stats(self) -> dict:
+        """Blobs, mapped paths, bytes on disk and bytes the paths would take
+        as separate files."""
+        with self._lock:
+            blobs, stored = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+            paths, logical = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM paths JOIN blobs USING (digest)").fetchone()
+        return {"blobs": blobs, "paths": paths, "stored_bytes": stored, "logical_bytes": logical}
+
+    def gc(self, referenced: set, grace: float = 3600, sweep: bool = False) -> dict:
+        """Unmap paths no record refers to (referenced: the relative paths of
+        every record), deleting blobs left without references. Mappings
+        younger than grace seconds are kept, as their upload may still be
+        committing its record. With sweep, also delete files under root the
+        index does not know (left by a crash), once grace seconds old."""
+        cutoff = time.time() - grace
+        counts = {"unmapped": 0, "freed_bytes": 0, "swept": 0}
+        with self._lock:
+            stale = [path for path, created_at in self._conn.execute("SELECT relative_path, created_at FROM paths")
+                     if path not in referenced and created_at < cutoff]
+        with self._transaction() as conn:
+            for path in stale:
+                freed = self._release(conn, path)
+                if freed is not None:
+                    counts['unmapped'] += 1
+                    counts['freed_bytes'] += freed
+        if sweep:
+            counts['swept'] = self._sweep(cutoff)
+        return counts
+
+    def _sweep(self, cutoff: float) -> int:
+        """Delete files older than cutoff that are not indexed blobs, one
+        leaf directory (one digest prefix) per transaction."""
+        swept = 0
+        for level1 in sorted(os.listdir(self.root)):
+            if not re.match(r'^[0-9a-f]{2}$', level1) or not os.path.isdir(os.path.join(self.root, level1)):
+                continue
+            for level2 in sorted(os.listdir(os.path.join(self.root, level1))):
+                directory = os.path.join(self.root, level1, level2)
+                prefix = level1 + level2
+                if not re.match(r'^[0-9a-f]{4}$', prefix) or not os.path.isdir(directory):
+                    continue
+                with self._transaction() as conn:
+                    known = {row[0] for row in conn.execute(
+                        "SELECT digest FROM blobs WHERE digest >= ? AND digest < ?",
+                        (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)))}
+                    for name in os.listdir(directory):
+                        path = os.path.join(directory, name)
+                        if name not in known and os.path.getmtime(path) < cutoff:
+                            os.remove(path)
+                            swept += 1
+        return swept
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def blob_index_path(storage_dir: str) -> str:
+    return os.path.join(storage_dir, 'blobs.sqlite3')
+
+
+def migrate(blob_store: BlobStore, uploads: str) -> dict:
+    """Move every file of the uploads tree into blob_store under its
+    relative path; a re-run continues where an interrupted one stopped."""
+    from .reindex import scan_uploads
+
+    counts = {"files": 0, "new_blobs": 0, "bytes": 0}
+    for _, _, relative_path in scan_uploads(uploads):
+        path = os.path.join(uploads, *relative_path.split('/'))
+        size = os.path.getsize(path)
+        counts['new_blobs'] += blob_store.add(path, relative_path, file_digest(path))
+        counts['files'] += 1
+        counts['bytes'] += size
+    return counts
+
+
+def referenced_paths(store) -> set:
+    """relative_path of every record in a hash store."""
+    return {record.get('relative_path') or f"{student_id}/challenge_{record['challenge_id']}/{record['filename']}"
+            for student_id in store.student_ids() for record in store.list_images(student_id)}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m ecolearn_core.blob_store',
+                                     description="Maintain the content-addressed upload store.")
+    parser.add_argument('command', choices=('migrate', 'gc', 'stats'))
+    parser.add_argument('--blobs', default=os.environ.get('BLOB_ROOT', 'blobs'),
+                        help='blob root (default: $BLOB_ROOT or ./blobs)')
+    parser.add_argument('--storage', default=os.environ.get('STORAGE_DIR', 'storage'),
+                        help='storage directory holding blobs.sqlite3 and the hash store (default: $STORAGE_DIR)')
+    parser.add_argument('--uploads', default=os.environ.get('UPLOAD_ROOT', 'uploads'),
+                        help='uploads tree to migrate (default: $UPLOAD_ROOT or ./uploads)')
+    parser.add_argument('--store', default=os.environ.get('HASH_STORE', 'sqlite'),
+                        choices=('sqlite', 'log', 'json', 'redis'), help='hash store kind, for gc (default: $HASH_STORE)')
+    parser.add_argument('--path', help='store file or Redis URL (default: derived from --store and --storage)')
+    parser.add_argument('--grace', type=float, default=3600,
+                        help='gc: age in seconds before a mapping without a record, or a stray file, is removed')
+    parser.add_argument('--sweep', action='store_true', help='gc: also delete files the index does not know')
+    args = parser.parse_args(argv)
+
+    blob_store = BlobStore(args.blobs, blob_index_path(args.storage))
+    try:
+        if args.command == 'migrate':
+            if not os.path.isdir(args.uploads):
+                parser.error(f"uploads root {args.uploads!r} does not exist")
+            counts = migrate(blob_store, args.uploads)
+            print(f"Moved {counts['files']} files ({counts['bytes']} bytes) into {args.blobs}: "
+                  f"{counts['new_blobs']} distinct.")
+        elif args.command == 'gc':
+            from .hash_store import open_hash_store, store_path
+
+            path = args.path or (os.environ.get('REDIS_URL', 'redis://localhost:6379/0') if args.store == 'redis'
+                                 else store_path(args.store, args.storage))
+            store = open_hash_store(args.store, path)
+            referenced = referenced_paths(store)
+            store.close()
+            counts = blob_store.gc(referenced, grace=args.grace, sweep=args.sweep)
+            print(f"Dropped {counts['unmapped']} mappings without a record ({counts['freed_bytes']} bytes freed), "
+                  f"swept {counts['swept']} stray files.")
+        stats = blob_store.stats()
+        saved = stats['logical_bytes'] - stats['stored_bytes']
+        print(f"{stats['paths']} paths -> {stats['blobs']} blobs, {stats['stored_bytes']} bytes stored "
+              f"({saved} saved by deduplication).")
+    finally:
+        blob_store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
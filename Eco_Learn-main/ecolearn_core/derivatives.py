@@ -0,0 +1,94 @@
+import math
+import os
+import time
+
+from PIL import Image, ImageOps
+
+from .image_hash import open_image
+
+# Display-sized derivatives (thumbnails) of uploaded proofs. The dashboard
+# leaderboard and feed show dozens of proofs per page, so they fetch these
+# instead of full-resolution originals. The server renders them in a
+# background job once an upload is accepted (see job_queue.py), so the
+# upload response does not wait for them.
+
+DEFAULT_WIDTHS = (320, 640)
+# format name -> (file extension, PIL save options)
+FORMATS = {
+    'webp': ('webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+DEFAULT_FORMATS = ('webp', 'jpeg')
+
+
+def parse_widths(value: str) -> tuple:
+    """Parse a comma separated width list such as "320,640"; "" disables."""
+    widths = sorted({int(part) for part in value.split(',') if part.strip()})
+    if any(width <= 0 for width in widths):
+        raise ValueError(f"Derivative widths must be positive, got {value!r}")
+    return tuple(widths)
+
+
+def variant_name(stem: str, width: int, fmt: str) -> str:
+    return f"{stem}_w{width}.{FORMATS[fmt][0]}"
+
+
+def _render(image: Image.Image, dest_path: str, width: int, fmt: str) -> None:
+    # Never upscale: narrow originals are re-encoded at their own width
+    if image.width > width:
+        height = max(1, round(image.height * width / image.width))
+        image = image.resize((width, height), Image.Resampling.LANCZOS)
+    if fmt == 'jpeg' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    extension, options = FORMATS[fmt]
+    tmp_path = f"{dest_path}.tmp"
+    image.save(tmp_path, format=fmt.upper(), **options)
+    os.replace(tmp_path, dest_path)
+
+
+def render_derivatives(source_path: str, dest_stem: str, widths: tuple = DEFAULT_WIDTHS,
+                       formats: tuple = DEFAULT_FORMATS) -> tuple:
+    """Write the derivatives of source_path as "<dest_stem>_w<width>.<ext>".
+    Returns (variants, timings): variants maps str(width) -> {format: path},
+    timings holds seconds for decode and derivatives. Files already written
+    are removed if a later one fails. Runs in a HashPool worker, so it only
+    takes picklable arguments.
+    """
+    timings = {}
+    start = time.perf_counter()
+    with open_image(source_path) as image:
+        # JPEG: decode at the smallest DCT scale still >= the widest derivative
+        largest = max(widths)
+        if image.width > largest:
+            image.draft('RGB', (largest, math.ceil(image.height * largest / image.width)))
+        image.load()
+        timings['decode'] = time.perf_counter() - start
+        start = time.perf_counter()
+
+        # Display copies honour the EXIF orientation
+        display = ImageOps.exif_transpose(image)
+        if display.mode not in ('RGB', 'RGBA'):
+            display = display.convert('RGBA' if 'A' in display.getbands() or 'transparency' in display.info
+                                      else 'RGB')
+
+        os.makedirs(os.path.dirname(dest_stem), exist_ok=True)
+        variants = {}
+        try:
+            for width in widths:
+                for fmt in formats:
+                    dest_path = variant_name(dest_stem, width, fmt)
+                    _render(display, dest_path, width, fmt)
+                    variants.setdefault(str(width), {})[fmt] = dest_path
+        except Exception:
+            discard_variants(variants)
+            raise
+    timings['derivatives'] = time.perf_counter() - start
+    return variants, timings
+
+
+def discard_variants(variants: dict) -> None:
+    """Delete derivative files listed in a variants mapping, if present."""
+    for paths in variants.values():
+        for path in paths.values():
+            if os.path.exists(path):
+                os.remove(path)
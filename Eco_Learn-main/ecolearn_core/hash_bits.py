@@ -0,0 +1,52 @@
+# Integer side of the hashes: hex to int conversion, the combined value
+# compared for duplicates, and popcount Hamming distance. Kept free of PIL
+# and NumPy so the storage, index and listing modules import quickly.
+
+# Combined hashes (aHash + dHash + pHash) are 3 x 64 bits
+HASH_WORDS = 3
+
+if hasattr(int, 'bit_count'):
+    popcount = int.bit_count
+else:  # Python < 3.10
+    def popcount(value: int) -> int:
+        return bin(value).count('1')
+
+
+def hex_to_int(hash_hex: str) -> int:
+    """Parse a stored hex hash into its integer form."""
+    return int(hash_hex, 16)
+
+
+def combined_hex(hash_dict: dict) -> str:
+    """Hex string compared for duplicates: 'combined', else aHash + dHash."""
+    return hash_dict.get('combined') or (hash_dict.get('aHash') + hash_dict.get('dHash', ''))
+
+
+def combined_int(hash_dict: dict) -> int:
+    return hex_to_int(combined_hex(hash_dict))
+
+
+def hamming_distance(hash1, hash2) -> int:
+    """Compute Hamming distance between two hashes (hex strings or ints).
+    Shorter hex strings compare as if left-padded with zeros, i.e. the
+    distance is popcount(int(h1) ^ int(h2)).
+    """
+    if isinstance(hash1, str):
+        hash1 = hex_to_int(hash1)
+    if isinstance(hash2, str):
+        hash2 = hex_to_int(hash2)
+    return popcount(hash1 ^ hash2)
+
+
+def crop_distance(hash1: dict, hash2: dict):
+    """Smallest of full-vs-full, full-vs-crop and crop-vs-full distances
+    between two robust-mode hash dicts (see image_hash.canonical_hash), or
+    None when either lacks a "crop" hash. A lightly cropped copy of a photo
+    resembles the original's center crop, so one of the three stays small.
+    """
+    if not hash1.get('crop') or not hash2.get('crop'):
+        return None
+    full1, full2 = combined_int(hash1), combined_int(hash2)
+    return min(popcount(full1 ^ full2),
+               popcount(full1 ^ hex_to_int(hash2['crop'])),
+               popcount(hex_to_int(hash1['crop']) ^ full2))
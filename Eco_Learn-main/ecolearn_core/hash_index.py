@@ -0,0 +1,171 @@
+import json
+import os
+from array import array
+
+from .hash_bits import HASH_WORDS, combined_int, popcount
+from .scoring import HashScorer, has_phash, split_components
+
+# Near-duplicate index over combined hashes using multi-index hashing (MIH).
+# Each hash is split into fixed-width bands; by the pigeonhole principle two
+# hashes within Hamming distance r < number_of_bands share at least one band
+# exactly. A radius query therefore only verifies hashes that collide with the
+# query in some band bucket instead of scanning every stored hash.
+
+DEFAULT_BAND_BITS = 16
+# Deleted rows stay in the parallel arrays as tombstones until there are at
+# least this many and they outnumber the live rows; then the index is rebuilt.
+COMPACT_MIN_DELETED = 1024
+
+
+def band_values(value: int, bands: int, band_bits: int = DEFAULT_BAND_BITS) -> list:
+    """Split value into `bands` integers of band_bits each, lowest band first."""
+    mask = (1 << band_bits) - 1
+    return [(value >> (band * band_bits)) & mask for band in range(bands)]
+
+
+class HashIndex:
+    """In-memory MIH index mapping record keys to combined hash integers.
+
+    bits: width covered by the bands (192 = aHash + dHash + pHash).
+    band_bits: width of each band; 16 gives 12 bands, so any radius <= 11 is
+    answered exactly from the band tables. Larger radii fall back to a scan.
+    """
+
+    def __init__(self, bits: int = HASH_WORDS * 64, band_bits: int = DEFAULT_BAND_BITS):
+        if bits % band_bits:
+            raise ValueError("bits must be a multiple of band_bits")
+        self.bits = bits
+        self.band_bits = band_bits
+        self.bands = bits // band_bits
+        # One dict per band: band value -> array of row ids
+        self._tables = [{} for _ in range(self.bands)]
+        self._keys = []    # row id -> key (None once deleted)
+        self._values = []  # row id -> combined hash int
+        self._phash = []   # row id -> whether the hash has a pHash (has_phash)
+        self._rows = {}    # key -> row id
+        self._deleted = 0  # tombstoned rows in _keys/_values
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def _band_values(self, value: int):
+        return band_values(value, self.bands, self.band_bits)
+
+    @staticmethod
+    def _as_int(value) -> int:
+        if isinstance(value, int):
+            return value
+        if isinstance(value, str):
+            return int(value, 16)
+        return combined_int(value)
+
+    def get(self, key):
+        row = self._rows.get(key)
+        return None if row is None else self._values[row]
+
+    def insert(self, key, value, phash: bool = None) -> None:
+        """Add or replace key. value: combined int, hex string or hash dict.
+        phash: whether it has a pHash, when value is an int (see has_phash)."""
+        if key in self._rows:
+            self.delete(key)
+        self._phash.append(has_phash(value) if phash is None else phash)
+        value = self._as_int(value)
+        row = len(self._keys)
+        self._keys.append(key)
+        self._values.append(value)
+        self._rows[key] = row
+        for table, band_value in zip(self._tables, self._band_values(value)):
+            bucket = table.get(band_value)
+            if bucket is None:
+                table[band_value] = array('q', (row,))
+            else:
+                bucket.append(row)
+
+    def delete(self, key) -> bool:
+        row = self._rows.pop(key, None)
+        if row is None:
+            return False
+        for table, band_value in zip(self._tables, self._band_values(self._values[row])):
+            bucket = table[band_value]
+            bucket.remove(row)
+            if not bucket:
+                del table[band_value]
+        self._keys[row] = None
+        self._values[row] = 0
+        self._deleted += 1
+        if self._deleted >= COMPACT_MIN_DELETED and self._deleted > len(self._rows):
+            self._compact()
+        return True
+
+    def _compact(self) -> None:
+        """Drop deleted rows and renumber the live ones, keeping insertion order."""
+        live = [(key, self._values[row], self._phash[row]) for key, row in self._rows.items()]
+        self._tables = [{} for _ in range(self.bands)]
+        self._keys, self._values, self._phash, self._rows, self._deleted = [], [], [], {}, 0
+        for key, value, phash in live:
+            self.insert(key, value, phash)
+
+    def _candidate_rows(self, value: int, radius: int):
+        if radius >= self.bands:
+            return (row for row, key in enumerate(self._keys) if key is not None)
+        rows = set()
+        for table, band_value in zip(self._tables, self._band_values(value)):
+            bucket = table.get(band_value)
+            if bucket is not None:
+                rows.update(bucket)
+        return rows
+
+    def query(self, value, radius, limit: int = None) -> list:
+        """Return [(key, distance)] for stored hashes within radius, nearest first.
+        radius may also be a scoring.HashScorer (192-bit combined hashes only),
+        which then decides per component which hashes are duplicates.
+        """
+        matches = []
+        if isinstance(radius, HashScorer):
+            scorer = radius
+            target = split_components(value)
+            value = self._as_int(value)
+            for row in self._candidate_rows(value, 0 if scorer.probes_bands(target) else self.bands):
+                distance = scorer.score(target, split_components(self._values[row], self._phash[row]))
+                if distance is not None:
+                    matches.append((self._keys[row], distance))
+            matches.sort(key=lambda match: match[1])
+            return matches[:limit] if limit is not None else matches
+        value = self._as_int(value)
+        for row in self._candidate_rows(value, radius):
+            distance = popcount(value ^ self._values[row])
+            if distance <= radius:
+                matches.append((self._keys[row], distance))
+        matches.sort(key=lambda match: match[1])
+        return matches[:limit] if limit is not None else matches
+
+    def items(self):
+        for key, row in self._rows.items():
+            yield key, self._values[row]
+
+    def save(self, path: str) -> None:
+        """Persist keys and hashes as JSON; band tables are rebuilt on load,
+        so deleted rows are not carried over. Hashes are written at full
+        width (48 or 32 hex digits), which keeps has_phash right on load."""
+        payload = {
+            "bits": self.bits,
+            "band_bits": self.band_bits,
+            "entries": [[key, f"{self._values[row]:0{48 if self._phash[row] else 32}x}"]
+                        for key, row in self._rows.items()],
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "HashIndex":
+        with open(path, 'r', encoding='utf-8') as f:
+            payload = json.load(f)
+        index = cls(bits=payload["bits"], band_bits=payload["band_bits"])
+        for key, hex_value in payload["entries"]:
+            index.insert(key, hex_value)
+        return index
@@ -0,0 +1,94 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+# Runs CPU-bound hashing off the asyncio event loop so one large upload cannot
+# stall /health and every other request.
+#   process - ProcessPoolExecutor (default); sidesteps the GIL entirely
+#   thread  - ThreadPoolExecutor; Pillow releases the GIL while decoding and
+#             resizing, so this is cheaper to start and often fast enough
+#   inline  - run on the event loop (old behaviour; useful for comparisons)
+
+EXECUTOR_KINDS = ('process', 'thread', 'inline')
+
+
+class HashPoolSaturated(Exception):
+    """Raised when max_pending jobs are already queued or running."""
+
+
+class HashPool:
+    def __init__(self, kind: str = 'process', workers: int = None, max_pending: int = None):
+        if kind not in EXECUTOR_KINDS:
+            raise ValueError(f"Executor kind must be one of {EXECUTOR_KINDS}, got {kind!r}")
+        self.kind = kind
+        self.workers = workers or os.cpu_count() or 1
+        # Bounded queue depth: beyond this, callers get HashPoolSaturated (503)
+        self.max_pending = max_pending or self.workers * 4
+        self._pending = 0
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == 'process':
+                # spawn: workers never inherit the server's sockets or DB handles
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='hash')
+        return self._executor
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def _execute(self, fn, *args):
+        if self.kind == 'inline':
+            return fn(*args)
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        try:
+            return await loop.run_in_executor(executor, partial(fn, *args))
+        except BrokenExecutor:
+            # A worker died (e.g. OOM on a huge image); start a fresh pool next time
+            if self._executor is executor:
+                self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    async def run(self, fn, *args):
+        """Run fn(*args) in the pool; raises HashPoolSaturated when full."""
+        if self._pending >= self.max_pending:
+            raise HashPoolSaturated()
+        self._pending += 1
+        try:
+            return await self._execute(fn, *args)
+        finally:
+            self._pending -= 1
+
+    async def run_many(self, fn, arg_list: list) -> list:
+        """Run fn(arg) for every arg, using whatever queue capacity is free.
+        Returns results in order, with exceptions in place of failed items.
+        Raises HashPoolSaturated only when no capacity is free at all.
+        """
+        free = self.max_pending - self._pending
+        if arg_list and free <= 0:
+            raise HashPoolSaturated()
+        slots = min(free, len(arg_list))
+        self._pending += slots
+        try:
+            semaphore = asyncio.Semaphore(max(slots, 1))
+
+            async def run_one(arg):
+                async with semaphore:
+                    return await self._execute(fn, arg)
+
+            return await asyncio.gather(*(run_one(arg) for arg in arg_list), return_exceptions=True)
+        finally:
+            self._pending -= slots
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
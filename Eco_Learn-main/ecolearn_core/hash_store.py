@@ -0,0 +1,807 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: cross-process locking is unavailable
+    fcntl = None
+
+from .hash_index import DEFAULT_BAND_BITS, HashIndex, band_values
+from .hash_bits import HASH_WORDS, combined_int, crop_distance
+from .scoring import as_scorer, component_hex, pack_components
+
+# Storage backends for uploaded image records and their hashes.
+# Both the local FastAPI server and the Vercel functions go through this
+# interface, so duplicate checks, listings and inserts behave the same.
+#
+#   SqliteHashStore - default. WAL-mode SQLite with indexed hash bands and
+#                     transactional insert-if-not-duplicate.
+#   LogHashStore    - append-only JSONL log with periodic snapshot compaction.
+#   JsonHashStore   - legacy hashes.json file, rewritten on every insert.
+#   RedisHashStore  - Redis-protocol server shared by every instance; see
+#                     redis_store.py (needs the redis package).
+
+# Which prior uploads a new proof is compared against:
+#   student     - the same student's images (any challenge)
+#   challenge   - every student's images for the same challenge
+#   institution - every image from the same institution_id
+#   global      - every stored image
+DEDUP_SCOPES = ('student', 'challenge', 'institution', 'global')
+
+_BANDS = HASH_WORDS * 64 // DEFAULT_BAND_BITS
+
+
+def in_scope(scope: str, candidate_student: str, candidate: dict,
+             student_id: str, challenge_id: str, institution_id: str = None) -> bool:
+    if scope == 'global':
+        return True
+    if scope == 'challenge':
+        return candidate.get('challenge_id') == challenge_id
+    if scope == 'institution' and institution_id:
+        return candidate.get('institution_id') == institution_id
+    # 'student', and 'institution' uploads that carry no institution_id
+    return candidate_student == student_id
+
+
+def scope_key(scope: str, student_id: str, challenge_id: str, institution_id: str = None) -> tuple:
+    """The set of records an upload is deduplicated against, as a hashable
+    key: two uploads with the same key can conflict, different keys cannot.
+    """
+    if scope == 'global':
+        return ('global',)
+    if scope == 'challenge':
+        return ('challenge', challenge_id)
+    if scope == 'institution' and institution_id:
+        return ('institution', institution_id)
+    return ('student', student_id)
+
+
+def match_payload(candidate_student: str, candidate: dict, distance: int, scope: str) -> dict:
+    """Shape of the `match` returned to clients for a rejected duplicate."""
+    return {
+        "student_id": candidate_student,
+        "challenge_id": candidate.get('challenge_id'),
+        "filename": candidate.get('filename'),
+        "url": candidate.get('url'),
+        "uploaded_at": candidate.get('uploaded_at'),
+        "distance": distance,
+        "scope": scope,
+    }
+
+
+def find_crop_duplicate(new_hash: dict, candidates: list, threshold: int, scope: str):
+    """Closest of candidates [(student_id, record)] within threshold by
+    crop_distance, as a match payload, or None. Records without a robust
+    mode "crop" hash are skipped. Not indexed: callers pass a bounded set,
+    such as the uploading student's own records.
+    """
+    best = None
+    for candidate_student, candidate in candidates:
+        distance = crop_distance(new_hash, candidate.get('hash', {}))
+        if distance is not None and distance <= threshold and (best is None or distance < best[0]):
+            best = (distance, candidate_student, candidate)
+    if best is None:
+        return None
+    distance, candidate_student, candidate = best
+    return match_payload(candidate_student, candidate, distance, scope)
+
+
+class HashStore:
+    """Interface shared by the storage backends."""
+
+    def list_images(self, student_id: str) -> list:
+        raise NotImplementedError
+
+    def count_images(self, student_id: str = None) -> int:
+        raise NotImplementedError
+
+    def list_images_page(self, student_id: str, cursor: str = None, limit: int = None,
+                         challenge_id: str = None, since: str = None, until: str = None):
+        """One page of a student's records in upload order.
+        cursor: opaque value from a previous page's next_cursor. since/until
+        bound uploaded_at (stored timestamp format; since inclusive, until
+        exclusive). Returns (records, next_cursor), next_cursor None on the
+        last page.
+        """
+        raise NotImplementedError
+
+    def student_version(self, student_id: str) -> int:
+        """Counter bumped on every insert for the student (0 if unknown);
+        cheap to read, for ETags on listings."""
+        raise NotImplementedError
+
+    def find_duplicate(self, new_hash: dict, threshold: int, scope: str, student_id: str,
+                       challenge_id: str, institution_id: str = None):
+        """Return the nearest in-scope prior upload as a match dict, or None.
+        threshold: bits on the combined hash, or a scoring.HashScorer (as for
+        the add_*_if_unique methods).
+        """
+        raise NotImplementedError
+
+    def find_by_digest(self, digest: str, scope: str, student_id: str,
+                       challenge_id: str, institution_id: str = None):
+        """Return an in-scope prior upload with identical bytes (sha256), or None.
+        Cheap enough to run before the image is decoded at all.
+        """
+        raise NotImplementedError
+
+    def add_image(self, student_id: str, record: dict) -> int:
+        """Store record unconditionally; returns the student's image count."""
+        raise NotImplementedError
+
+    def add_image_if_unique(self, student_id: str, record: dict, threshold: int, scope: str):
+        """Atomically check for an in-scope duplicate and insert if none.
+        Returns (match, None) when rejected, else (None, student image count).
+        """
+        raise NotImplementedError
+
+    def add_images_if_unique(self, items: list, threshold: int, scope: str) -> list:
+        """add_image_if_unique for many (student_id, record) pairs in one
+        transaction. Returns a match dict (rejected) or None (stored) per item.
+        """
+        raise NotImplementedError
+
+    def student_ids(self) -> list:
+        """Every student with at least one stored image, sorted."""
+        raise NotImplementedError
+
+    def replace_contents(self, items: list) -> None:
+        """Swap every stored record for items [(student_id, record)] at once,
+        e.g. after re-hashing (see reindex.py). Readers see either the old or
+        the new records. Counter-based versions (SQLite, Redis) move on for
+        every student; the file stores' count-based ones may repeat.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteHashStore(HashStore):
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS students (
+        id TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS images (
+        id INTEGER PRIMARY KEY,
+        student_id TEXT NOT NULL REFERENCES students(id),
+        challenge_id TEXT NOT NULL,
+        institution_id TEXT,
+        filename TEXT NOT NULL,
+        uploaded_at TEXT NOT NULL,
+        combined TEXT NOT NULL,
+        sha256 TEXT,
+        record TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS images_student ON images(student_id, id);
+    CREATE INDEX IF NOT EXISTS images_challenge ON images(challenge_id);
+    CREATE INDEX IF NOT EXISTS images_institution ON images(institution_id);
+    CREATE TABLE IF NOT EXISTS hash_bands (
+        band INTEGER NOT NULL,
+        value INTEGER NOT NULL,
+        image_id INTEGER NOT NULL REFERENCES images(id) ON DELETE CASCADE,
+        PRIMARY KEY (band, value, image_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS hash_bands_image ON hash_bands(image_id);
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Autocommit mode; transactions are opened explicitly with BEGIN.
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=30)
+        self._lock = threading.RLock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(self.SCHEMA)
+        self._migrate()
+
+    # PRAGMA user_version of the current layout. 1: images.combined holds
+    # component_hex (fixed width, so pHash presence shows in its length)
+    LAYOUT_VERSION = 1
+
+    def _migrate(self) -> None:
+        """Bring databases created by older versions up to the current schema."""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(images)")}
+        if 'sha256' not in columns:
+            self._conn.execute("ALTER TABLE images ADD COLUMN sha256 TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS images_sha256 ON images(sha256)")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(students)")}
+        if 'version' not in columns:
+            self._conn.execute("ALTER TABLE students ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            self._conn.execute(
+                "UPDATE students SET version = (SELECT COUNT(*) FROM images WHERE student_id = students.id)")
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] < self.LAYOUT_VERSION:
+            # Older versions stored combined without leading zeros
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute("SELECT id, record FROM images").fetchall()
+                self._conn.executemany("UPDATE images SET combined = ? WHERE id = ?",
+                                       [(component_hex(json.loads(record)['hash']), image_id)
+                                        for image_id, record in rows])
+                self._conn.execute(f"PRAGMA user_version = {self.LAYOUT_VERSION}")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def list_images(self, student_id: str) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT record FROM images WHERE student_id = ? ORDER BY id", (student_id,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def count_images(self, student_id: str = None) -> int:
+        with self._lock:
+            if student_id is None:
+                return self._conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM images WHERE student_id = ?", (student_id,)
+            ).fetchone()[0]
+
+    def list_images_page(self, student_id, cursor=None, limit=None, challenge_id=None, since=None, until=None):
+        # The cursor is the last returned images.id; (student_id, id) is indexed
+        sql = "SELECT id, record FROM images WHERE student_id = ? AND id > ?"
+        params = [student_id, int(cursor or 0)]
+        if challenge_id is not None:
+            sql += " AND challenge_id = ?"
+            params.append(challenge_id)
+        if since is not None:
+            sql += " AND uploaded_at >= ?"
+            params.append(since)
+        if until is not None:
+            sql += " AND uploaded_at < ?"
+            params.append(until)
+        sql += " ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit + 1)  # one extra row tells whether a next page exists
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = str(rows[-1][0])
+        return [json.loads(row[1]) for row in rows], next_cursor
+
+    def student_version(self, student_id: str) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT version FROM students WHERE id = ?", (student_id,)).fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def _scope_clause(scope: str, student_id: str, challenge_id: str, institution_id: str = None):
+        if scope == 'global':
+            return "", ()
+        if scope == 'challenge':
+            return " AND i.challenge_id = ?", (challenge_id,)
+        if scope == 'institution' and institution_id:
+            return " AND i.institution_id = ?", (institution_id,)
+        return " AND i.student_id = ?", (student_id,)
+
+    def _find_duplicate(self, new_hash, threshold, scope, student_id, challenge_id, institution_id):
+        scorer = as_scorer(threshold)
+        clause, params = self._scope_clause(scope, student_id, challenge_id, institution_id)
+        if scorer.probes_bands(new_hash):
+            bands = band_values(combined_int(new_hash), _BANDS)
+            # One primary-key probe per band; only colliding images are verified
+            probes = " UNION ".join("SELECT image_id FROM hash_bands WHERE band = ? AND value = ?" for _ in bands)
+            sql = f"SELECT i.id, i.combined FROM images i WHERE i.id IN ({probes}){clause}"
+            params = tuple(x for pair in enumerate(bands) for x in pair) + params
+        else:
+            sql = f"SELECT i.id, i.combined FROM images i WHERE 1 = 1{clause}"
+        # Only the hashes are read and scored, in one vectorized pass; the
+        # record JSON is loaded for the match alone
+        rows = self._conn.execute(sql, params).fetchall()
+        best = scorer.scan(new_hash, pack_components([combined for _, combined in rows])) if rows else None
+        if best is None:
+            return None
+        row, distance = best
+        candidate_student, record_json = self._conn.execute(
+            "SELECT student_id, record FROM images WHERE id = ?", (rows[row][0],)).fetchone()
+        return match_payload(candidate_student, json.loads(record_json), distance, scope)
+
+    def find_duplicate(self, new_hash, threshold, scope, student_id, challenge_id, institution_id=None):
+        with self._lock:
+            return self._find_duplicate(new_hash, threshold, scope, student_id, challenge_id, institution_id)
+
+    def find_by_digest(self, digest, scope, student_id, challenge_id, institution_id=None):
+        clause, params = self._scope_clause(scope, student_id, challenge_id, institution_id)
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT i.student_id, i.record FROM images i WHERE i.sha256 = ?{clause} LIMIT 1",
+                (digest,) + params,
+            ).fetchone()
+        if row is None:
+            return None
+        return match_payload(row[0], json.loads(row[1]), 0, scope)
+
+    def _insert(self, student_id: str, record: dict) -> None:
+        combined = combined_int(record['hash'])
+        self._conn.execute(
+            "INSERT INTO students (id, version) VALUES (?, 1) "
+            "ON CONFLICT(id) DO UPDATE SET version = version + 1", (student_id,))
+        image_id = self._conn.execute(
+            "INSERT INTO images (student_id, challenge_id, institution_id, filename, uploaded_at, combined, sha256, record) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (student_id, record['challenge_id'], record.get('institution_id'), record['filename'],
+             record['uploaded_at'], component_hex(record['hash']), record.get('sha256'), json.dumps(record)),
+        ).lastrowid
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO hash_bands (band, value, image_id) VALUES (?, ?, ?)",
+            [(band, value, image_id) for band, value in enumerate(band_values(combined, _BANDS))],
+        )
+
+    def _transaction(self, fn):
+        # BEGIN IMMEDIATE takes the write lock up front, so the duplicate check
+        # and the insert are atomic across threads, workers and processes.
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn()
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def add_image(self, student_id: str, record: dict) -> int:
+        def work():
+            self._insert(student_id, record)
+            return self.count_images(student_id)
+        return self._transaction(work)
+
+    def add_images(self, items: list) -> None:
+        """Insert many (student_id, record) pairs in one transaction."""
+        def work():
+            for student_id, record in items:
+                self._insert(student_id, record)
+        self._transaction(work)
+
+    def student_ids(self) -> list:
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT student_id FROM images ORDER BY student_id").fetchall()
+        return [row[0] for row in rows]
+
+    def replace_contents(self, items: list) -> None:
+        def work():
+            self._conn.execute("DELETE FROM hash_bands")
+            self._conn.execute("DELETE FROM images")
+            # Inserts bump versions further; every student moves on at least once
+            self._conn.execute("UPDATE students SET version = version + 1")
+            for student_id, record in items:
+                self._insert(student_id, record)
+        self._transaction(work)
+
+    def add_image_if_unique(self, student_id: str, record: dict, threshold: int, scope: str):
+        def work():
+            match = self._find_duplicate(record['hash'], threshold, scope, student_id,
+                                         record['challenge_id'], record.get('institution_id'))
+            if match:
+                return match, None
+            self._insert(student_id, record)
+            return None, self.count_images(student_id)
+        return self._transaction(work)
+
+    def add_images_if_unique(self, items: list, threshold: int, scope: str) -> list:
+        def work():
+            results = []
+            for student_id, record in items:
+                # Rows inserted earlier in this transaction are visible here
+                match = self._find_duplicate(record['hash'], threshold, scope, student_id,
+                                             record['challenge_id'], record.get('institution_id'))
+                if match is None:
+                    self._insert(student_id, record)
+                results.append(match)
+            return results
+        return self._transaction(work)
+
+
+class _IndexedStore(HashStore):
+    """Shared logic for file backends that keep every record in memory.
+    A HashIndex over all records serves duplicate lookups; subclasses load
+    their files in _refresh() and persist new records in _persist().
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self._lock = threading.RLock()
+        self._lock_file = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self._index = HashIndex()
+        self._records = {}   # record key -> (student_id, record)
+        self._students = {}  # student_id -> [record, ...] in upload order
+        self._digests = {}   # sha256 -> [record key, ...]
+
+    @staticmethod
+    def record_key(student_id: str, record: dict) -> str:
+        return f"{student_id}/{record['filename']}"
+
+    def _index_record(self, student_id: str, record: dict) -> None:
+        key = self.record_key(student_id, record)
+        self._index.insert(key, record['hash'])
+        self._records[key] = (student_id, record)
+        self._students.setdefault(student_id, []).append(record)
+        if record.get('sha256'):
+            self._digests.setdefault(record['sha256'], []).append(key)
+
+    def _refresh(self) -> None:
+        raise NotImplementedError
+
+    def _persist(self, items: list) -> None:
+        raise NotImplementedError
+
+    @contextmanager
+    def _exclusive(self):
+        # Serialise writers across processes as well as threads, so several
+        # server workers can share one file. flock is per open file, so
+        # nested calls (compaction inside an append) reuse it.
+        with self._lock:
+            if self._lock_file is not None:
+                yield
+                return
+            with open(self.lock_path, 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._lock_file = lock_file
+                try:
+                    yield
+                finally:
+                    self._lock_file = None
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def list_images(self, student_id: str) -> list:
+        with self._lock:
+            self._refresh()
+            return list(self._students.get(student_id, []))
+
+    def count_images(self, student_id: str = None) -> int:
+        with self._lock:
+            self._refresh()
+            if student_id is None:
+                return len(self._records)
+            return len(self._students.get(student_id, []))
+
+    def list_images_page(self, student_id, cursor=None, limit=None, challenge_id=None, since=None, until=None):
+        # Records are only ever appended, so the cursor is a list position
+        with self._lock:
+            self._refresh()
+            records = self._students.get(student_id, [])
+            position, page = int(cursor or 0), []
+            while position < len(records) and (limit is None or len(page) < limit):
+                record = records[position]
+                position += 1
+                if challenge_id is not None and record.get('challenge_id') != challenge_id:
+                    continue
+                uploaded_at = record.get('uploaded_at', '')
+                if (since is not None and uploaded_at < since) or (until is not None and uploaded_at >= until):
+                    continue
+                page.append(record)
+            return page, (str(position) if position < len(records) else None)
+
+    def student_version(self, student_id: str) -> int:
+        # Append-only, so the record count is a version every process agrees on
+        return self.count_images(student_id)
+
+    def _find_duplicate(self, new_hash, threshold, scope, student_id, challenge_id, institution_id):
+        self._refresh()
+        for key, distance in self._index.query(new_hash, as_scorer(threshold)):
+            candidate_student, candidate = self._records[key]
+            if in_scope(scope, candidate_student, candidate, student_id, challenge_id, institution_id):
+                return match_payload(candidate_student, candidate, distance, scope)
+        return None
+
+    def find_duplicate(self, new_hash, threshold, scope, student_id, challenge_id, institution_id=None):
+        with self._lock:
+            return self._find_duplicate(new_hash, threshold, scope, student_id, challenge_id, institution_id)
+
+    def find_by_digest(self, digest, scope, student_id, challenge_id, institution_id=None):
+        with self._lock:
+            self._refresh()
+            for key in self._digests.get(digest, ()):
+                candidate_student, candidate = self._records[key]
+                if in_scope(scope, candidate_student, candidate, student_id, challenge_id, institution_id):
+                    return match_payload(candidate_student, candidate, 0, scope)
+        return None
+
+    def _append(self, items: list) -> None:
+        self._persist(items)
+        for student_id, record in items:
+            self._index_record(student_id, record)
+
+    def add_image(self, student_id: str, record: dict) -> int:
+        with self._exclusive():
+            self._refresh()
+            self._append([(student_id, record)])
+            return self.count_images(student_id)
+
+    def add_images(self, items: list) -> None:
+        with self._exclusive():
+            self._refresh()
+            self._append(items)
+
+    def add_image_if_unique(self, student_id: str, record: dict, threshold: int, scope: str):
+        with self._exclusive():
+            match = self._find_duplicate(record['hash'], threshold, scope, student_id,
+                                         record['challenge_id'], record.get('institution_id'))
+            if match:
+                return match, None
+            self._append([(student_id, record)])
+            return None, self.count_images(student_id)
+
+    def student_ids(self) -> list:
+        with self._lock:
+            self._refresh()
+            return sorted(student_id for student_id, records in self._students.items() if records)
+
+    def add_images_if_unique(self, items: list, threshold: int, scope: str) -> list:
+        scorer = as_scorer(threshold)
+        with self._exclusive():
+            results, accepted = [], []
+            batch_index = HashIndex()  # items accepted so far in this call
+            for student_id, record in items:
+                challenge_id, institution_id = record['challenge_id'], record.get('institution_id')
+                match = self._find_duplicate(record['hash'], scorer, scope, student_id,
+                                             challenge_id, institution_id)
+                for row, distance in ([] if match else batch_index.query(record['hash'], scorer)):
+                    other_student, other = accepted[row]
+                    if in_scope(scope, other_student, other, student_id, challenge_id, institution_id):
+                        match = match_payload(other_student, other, distance, scope)
+                        break
+                if match is None:
+                    batch_index.insert(len(accepted), record['hash'])
+                    accepted.append((student_id, record))
+                results.append(match)
+            if accepted:
+                self._append(accepted)
+            return results
+
+
+class JsonHashStore(_IndexedStore):
+    """Legacy backend: the whole hashes.json is rewritten on every insert.
+    The in-memory index is rebuilt whenever another process rewrote the file.
+    Rewrites go through a temp file and rename, so readers in other
+    processes never see a half-written file.
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._stamp = None
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with self._exclusive():
+                if not os.path.exists(path):  # another worker may have won
+                    self._save({"students": {}})
+
+    def _load(self) -> dict:
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _stat_stamp(self) -> tuple:
+        # Each save renames a new file into place, so the inode changes even
+        # when two saves land within the filesystem's mtime resolution
+        st = os.stat(self.path)
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _save(self, data: dict) -> None:
+        _atomic_write(self.path, json.dumps(data, indent=2).encode('utf-8'))
+        self._stamp = self._stat_stamp()
+
+    def _refresh(self) -> None:
+        stamp = self._stat_stamp()
+        if stamp == self._stamp:
+            return
+        self._reset()
+        for student_id, entry in self._load().get('students', {}).items():
+            for record in entry.get('images', []):
+                self._index_record(student_id, record)
+        self._stamp = stamp
+
+    def _persist(self, items: list) -> None:
+        db = self._load()
+        for student_id, record in items:
+            db.setdefault('students', {}).setdefault(student_id, {"images": []})['images'].append(record)
+        self._save(db)
+
+    def replace_contents(self, items: list) -> None:
+        # Versions are record counts here, so they can repeat after a swap;
+        # see reindex.py on stopping the servers first
+        with self._exclusive():
+            self._save({"students": _students_layout(items)})
+            self._reset()
+            self._stamp = None
+
+
+class LogHashStore(_IndexedStore):
+    """Append-only JSONL log of inserts plus periodic snapshots.
+    Each insert appends one {"seq", "student_id", "record"} line to `path`, so
+    bytes written per upload do not grow with the database. Every
+    compact_every appends the full state is checkpointed to <path>.snapshot
+    (the hashes.json layout plus the last applied seq) and the log is
+    replaced by an empty one. Startup loads the snapshot and replays only the
+    log tail; entries at or below the snapshot seq are skipped, so a crash
+    between the two renames is harmless.
+    """
+
+    def __init__(self, path: str, compact_every: int = 1000, fsync: bool = False):
+        super().__init__(path)
+        self.snapshot_path = f"{path}.snapshot"
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self._seq = 0          # last applied sequence number
+        self._log_id = None    # (st_dev, st_ino) of the log being tailed
+        self._log_pos = 0      # bytes of that log already applied
+        self._snapshot_seq = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if not os.path.exists(path):
+            open(path, 'ab').close()
+
+    def _load_snapshot(self) -> None:
+        self._reset()
+        self._seq = self._snapshot_seq = 0
+        if not os.path.exists(self.snapshot_path):
+            return
+        with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+        for student_id, entry in snapshot.get('students', {}).items():
+            for record in entry.get('images', []):
+                self._index_record(student_id, record)
+        self._seq = self._snapshot_seq = snapshot.get('seq', 0)
+
+    def _refresh(self) -> None:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        log_id = (st.st_dev, st.st_ino)
+        if log_id != self._log_id or st.st_size < self._log_pos:
+            # First load, or another process compacted: start from the snapshot
+            self._load_snapshot()
+            self._log_id, self._log_pos = log_id, 0
+        if st.st_size == self._log_pos:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self._log_pos)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # torn write at the tail; retried on next refresh
+                self._log_pos += len(line)
+                entry = json.loads(line)
+                if entry['seq'] > self._seq:
+                    self._index_record(entry['student_id'], entry['record'])
+                    self._seq = entry['seq']
+
+    def _persist(self, items: list) -> None:
+        lines = []
+        for student_id, record in items:
+            self._seq += 1
+            lines.append(json.dumps({"seq": self._seq, "student_id": student_id, "record": record}))
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        with open(self.path, 'ab') as f:
+            f.write(data)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        self._log_pos += len(data)
+
+    def _append(self, items: list) -> None:
+        super()._append(items)
+        if self._seq - self._snapshot_seq >= self.compact_every:
+            self.compact()
+
+    def compact(self) -> None:
+        """Checkpoint the current state into the snapshot and start a new log."""
+        with self._exclusive():
+            self._refresh()
+            snapshot = {"seq": self._seq, "students": {
+                student_id: {"images": records} for student_id, records in self._students.items()
+            }}
+            _atomic_write(self.snapshot_path, json.dumps(snapshot).encode('utf-8'))
+            _atomic_write(self.path, b'')
+            st = os.stat(self.path)
+            self._log_id, self._log_pos = (st.st_dev, st.st_ino), 0
+            self._snapshot_seq = self._seq
+
+    def replace_contents(self, items: list) -> None:
+        """Write items as a new snapshot, then start a new log. The snapshot's
+        seq is past every entry of the old log, so a process that loads it
+        before the log is swapped skips the old entries, and processes
+        tailing the old log reload when its inode changes.
+        """
+        with self._exclusive():
+            self._refresh()
+            seq = self._seq + 1
+            _atomic_write(self.snapshot_path,
+                          json.dumps({"seq": seq, "students": _students_layout(items)}).encode('utf-8'))
+            _atomic_write(self.path, b'')
+            self._log_id = None  # reload from the new snapshot on next use
+            self._refresh()
+
+
+def _students_layout(items: list) -> dict:
+    """(student_id, record) pairs in the hashes.json "students" layout."""
+    students = {}
+    for student_id, record in items:
+        students.setdefault(student_id, {"images": []})['images'].append(record)
+    return students
+
+
+def _atomic_write(path: str, data: bytes) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def migrate_json(json_path: str, store: HashStore) -> int:
+    """One-shot import of a legacy hashes.json into store; returns records copied."""
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    items = [
+        (student_id, record)
+        for student_id, entry in data.get('students', {}).items()
+        for record in entry.get('images', [])
+    ]
+    store.add_images(items)
+    return len(items)
+
+
+# Default file name of each backend inside a storage directory
+STORE_FILENAMES = {'sqlite': 'hashes.sqlite3', 'log': 'hashes.log', 'json': 'hashes.json'}
+
+
+def store_path(kind: str, directory: str) -> str:
+    if kind not in STORE_FILENAMES:
+        raise ValueError(f"Unknown hash store: {kind}")
+    return os.path.join(directory, STORE_FILENAMES[kind])
+
+
+def open_hash_store(kind: str, path: str, legacy_json: str = None) -> HashStore:
+    """Open the configured backend ('sqlite', 'log', 'json' or 'redis').
+    For 'redis', path is the server URL (redis:// or rediss://).
+    A brand-new sqlite/log store is seeded from legacy_json when that file exists.
+    """
+    if kind == 'redis':
+        from .redis_store import RedisHashStore
+        return RedisHashStore(path)
+    if kind == 'json':
+        return JsonHashStore(path)
+    is_new = not os.path.exists(path)
+    if kind == 'sqlite':
+        store = SqliteHashStore(path)
+    elif kind == 'log':
+        is_new = is_new and not os.path.exists(f"{path}.snapshot")
+        store = LogHashStore(path, compact_every=int(os.environ.get('HASH_LOG_COMPACT_EVERY', 1000)))
+    else:
+        raise ValueError(f"Unknown hash store: {kind}")
+    if is_new and legacy_json and os.path.exists(legacy_json):
+        migrate_json(legacy_json, store)
+    return store
+
+
+if __name__ == "__main__":
+    # python -m ecolearn_core.hash_store <hashes.json> <hashes.sqlite3>
+    import sys
+
+    if len(sys.argv) != 3:
+        sys.exit("usage: python -m ecolearn_core.hash_store <hashes.json> <hashes.sqlite3>")
+    target = SqliteHashStore(sys.argv[2])
+    copied = migrate_json(sys.argv[1], target)
+    target.close()
+    print(f"Migrated {copied} image records into {sys.argv[2]}")
@@ -0,0 +1,332 @@
+from PIL import Image
+from functools import lru_cache
+import io
+import math
+import time
+
+try:  # NumPy is optional: it only speeds up the pHash DCT.
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised on minimal installs
+    np = None
+
+# Integer helpers live in hash_bits so storage code can use them without
+# importing PIL or NumPy; they are re-exported here for existing callers.
+from .hash_bits import (  # noqa: F401
+    HASH_WORDS, combined_hex, combined_int, crop_distance, hamming_distance, hex_to_int,
+)
+from .scoring import as_scorer, pack_components
+
+# Perceptual hashing utilities (aHash and dHash) plus Hamming distance.
+# Designed to work offline and be easy to explain during demos.
+
+# DCT backend used by perceptual_hash: 'numpy' (matrix multiply with cached
+# cosine basis) when NumPy is installed, else the pure Python loops.
+DCT_BACKEND = 'numpy' if np is not None else 'python'
+# A coefficient sets its pHash bit only when it exceeds the median by more
+# than this; see perceptual_hash.
+_DCT_TOLERANCE = 1e-6
+# Side of the single grayscale thumbnail all three hashes are derived from.
+# Must be >= hash_size * highfreq_factor (32) so pHash never upsamples.
+THUMBNAIL_SIZE = 64
+
+# Version of the hashing pipeline, stored in every hash dict as "schema".
+# Hashes are only comparable within one schema: bump it whenever the
+# thumbnail, hash sizes or how they are combined change, then re-hash the
+# stored records with python -m ecolearn_core.reindex. Records without a
+# schema predate the shared thumbnail (each hash resized the full frame).
+HASH_SCHEMA = 'v2'
+ROBUST_HASH_SCHEMA = 'v2-d4'
+LEGACY_HASH_SCHEMA = 'v1'
+
+# Robust mode (compute_robust_hash): the eight rotations and mirror images
+# of a square (the dihedral group D4), in tie-break order.
+D4_TRANSFORMS = (
+    ('identity', None),
+    ('rotate90', Image.Transpose.ROTATE_90),
+    ('rotate180', Image.Transpose.ROTATE_180),
+    ('rotate270', Image.Transpose.ROTATE_270),
+    ('flip_horizontal', Image.Transpose.FLIP_LEFT_RIGHT),
+    ('flip_vertical', Image.Transpose.FLIP_TOP_BOTTOM),
+    ('transpose', Image.Transpose.TRANSPOSE),
+    ('transverse', Image.Transpose.TRANSVERSE),
+)
+# Side fraction of the thumbnail kept for the center-crop hash
+CENTER_CROP = 0.85
+# EXIF Orientation tag value -> transpose that shows the frame upright
+EXIF_ORIENTATION = 0x0112
+EXIF_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def average_hash(image: Image.Image, hash_size: int = 8) -> str:
+    """Compute the average hash (aHash) of the given PIL Image.
+    Steps:
+      1. Convert to grayscale
+      2. Resize to hash_size x hash_size
+      3. Compute mean pixel value
+      4. Each pixel > mean becomes 1 else 0 -> build bit string hex
+    Returns a hex string.
+    """
+    img = image.convert('L').resize((hash_size, hash_size), Image.Resampling.LANCZOS)
+    pixels = list(img.getdata())
+    avg = sum(pixels) / len(pixels)
+    bits = ''.join('1' if p > avg else '0' for p in pixels)
+    # Convert bit string to hex
+    return f"{int(bits, 2):0{hash_size * hash_size // 4}x}"
+
+
+def difference_hash(image: Image.Image, hash_size: int = 8) -> str:
+    """Compute the difference hash (dHash) of the given PIL Image.
+    Steps:
+      1. Convert to grayscale
+      2. Resize to (hash_size + 1) x hash_size
+      3. For each row, compare adjacent pixels left-to-right
+      4. If left < right -> 1 else 0
+    Returns hex string.
+    """
+    img = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = list(img.getdata())
+    # Build difference bits
+    bits = []
+    for row in range(hash_size):
+        row_start = row * (hash_size + 1)
+        for col in range(hash_size):
+            left_pix = pixels[row_start + col]
+            right_pix = pixels[row_start + col + 1]
+            bits.append('1' if left_pix < right_pix else '0')
+    bit_string = ''.join(bits)
+    return f"{int(bit_string, 2):0{hash_size * hash_size // 4}x}"
+
+
+@lru_cache(maxsize=8)
+def _dct_basis(size: int):
+    """Orthonormal DCT-II basis matrix for vectors of length `size`.
+    Row k holds sqrt(2/N) * c_k * cos((2n + 1) * k * pi / 2N), the same terms
+    the pure Python dct_1d sums. Cached per size and read-only.
+    """
+    factor = math.pi / (2 * size)
+    sqrt_2_N = math.sqrt(2 / size)
+    basis = np.empty((size, size), dtype=np.float64)
+    for k in range(size):
+        coeff = 0.5 if k == 0 else 1.0
+        for n in range(size):
+            basis[k, n] = sqrt_2_N * coeff * math.cos((2 * n + 1) * k * factor)
+    basis.setflags(write=False)
+    return basis
+
+
+def _dct_2d_python(matrix: list) -> list:
+    """2D DCT over a square list-of-lists using pure Python loops."""
+
+    def dct_1d(vector):
+        N = len(vector)
+        result = [0.0] * N
+        factor = math.pi / (2 * N)
+        sqrt_2_N = math.sqrt(2 / N)
+        for k in range(N):
+            coeff = 0.5 if k == 0 else 1.0
+            acc = 0.0
+            for n, val in enumerate(vector):
+                acc += val * math.cos((2 * n + 1) * k * factor)
+            result[k] = sqrt_2_N * coeff * acc
+        return result
+
+    # DCT rows
+    dct_rows = [dct_1d(row) for row in matrix]
+    # Transpose and DCT columns
+    transposed = list(zip(*dct_rows))
+    dct_cols = [dct_1d(list(col)) for col in transposed]
+    # Transpose back
+    return [list(row) for row in zip(*dct_cols)]
+
+
+def _low_freq_python(pixels: list, size: int, hash_size: int) -> list:
+    matrix = [pixels[r * size:(r + 1) * size] for r in range(size)]
+    dct_coeffs = _dct_2d_python(matrix)
+    low_freq = [row[:hash_size] for row in dct_coeffs[:hash_size]]
+    return [c for row in low_freq for c in row]
+
+
+def _low_freq_numpy(pixels: list, size: int, hash_size: int) -> list:
+    # Only the top-left hash_size x hash_size block is kept, so slice the
+    # basis first: B[:h] @ X @ B[:h].T instead of the full size x size DCT.
+    basis = _dct_basis(size)[:hash_size]
+    matrix = np.asarray(pixels, dtype=np.float64).reshape(size, size)
+    return (basis @ matrix @ basis.T).ravel().tolist()
+
+
+def perceptual_hash(image: Image.Image, hash_size: int = 8, highfreq_factor: int = 4,
+                    backend: str = None) -> str:
+    """Compute pHash (perceptual hash) from the low-frequency DCT block.
+    backend: 'numpy' or 'python'; defaults to DCT_BACKEND. The pure Python DCT
+    stays available so demo environments without NumPy still work.
+    """
+    backend = backend or DCT_BACKEND
+    size = hash_size * highfreq_factor
+    img = image.convert('L').resize((size, size), Image.Resampling.LANCZOS)
+    pixels = list(img.getdata())
+    if backend == 'numpy':
+        if np is None:
+            raise RuntimeError("NumPy DCT backend requested but numpy is not installed")
+        flat = _low_freq_numpy(pixels, size, hash_size)
+    elif backend == 'python':
+        flat = _low_freq_python(pixels, size, hash_size)
+    else:
+        raise ValueError(f"Unknown DCT backend: {backend}")
+    # The backends differ by float noise (~1e-13). Coefficients within the
+    # tolerance of the median count as equal to it, so a bit can only differ
+    # if a coefficient lies within that noise of median + tolerance, rather
+    # than of any rounding boundary. server/tests/test_dct_parity.py checks it.
+    median = sorted(flat[1:])[len(flat[1:]) // 2] if len(flat) > 1 else flat[0]
+    bits = ''.join('1' if c - median > _DCT_TOLERANCE else '0' for c in flat)
+    return f"{int(bits, 2):0{hash_size * hash_size // 4}x}"
+
+
+def open_image(source) -> Image.Image:
+    """Open raw bytes, a file path or a binary file object with PIL (lazily)."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    return Image.open(source)
+
+
+def load_grayscale_thumbnail(source, size: int = THUMBNAIL_SIZE, exif_transpose: bool = False) -> Image.Image:
+    """Decode an image once into a size x size grayscale thumbnail.
+    source: raw bytes, a file path or a binary file object. Paths are read
+    straight from disk, so callers need not hold the upload in memory.
+    For JPEGs, draft() lets libjpeg decode straight to grayscale at 1/2, 1/4
+    or 1/8 scale, so a 12 MP photo never materialises at full resolution.
+    Other formats decode normally and are reduced by the single resize.
+    exif_transpose applies the EXIF Orientation tag, as viewers do.
+    """
+    with open_image(source) as image:
+        image.draft('L', (size, size))
+        thumbnail = image.convert('L').resize((size, size), Image.Resampling.LANCZOS)
+        return exif_orient(thumbnail, image) if exif_transpose else thumbnail
+
+
+def exif_orient(thumbnail: Image.Image, image: Image.Image) -> Image.Image:
+    """Turn a thumbnail of image upright per image's EXIF Orientation tag.
+    Rotating the 64x64 thumbnail gives the same pixels as rotating the full
+    frame first, without copying the full frame.
+    """
+    method = EXIF_TRANSPOSE.get(image.getexif().get(EXIF_ORIENTATION))
+    return thumbnail if method is None else thumbnail.transpose(method)
+
+
+def compute_combined_hash(image_bytes, timings: dict = None) -> dict:
+    """Compute aHash, dHash, and pHash, returning combined string for duplicate detection.
+    Backward compatible: combined = aHash + dHash + pHash
+    All three hashes come from one shared grayscale thumbnail. Compared with
+    resizing the full-resolution frame once per hash, each 64-bit component
+    drifts by under 1 bit on average (90th percentile <= 2, worst seen 5), so
+    records hashed before this pipeline may need re-hashing to stay within
+    the duplicate threshold of 5 on the combined hash.
+    image_bytes may also be a file path or binary file object.
+    timings, if given, receives seconds spent per stage (decode, aHash, dHash, pHash).
+    """
+    start = time.perf_counter()
+    thumbnail = load_grayscale_thumbnail(image_bytes)
+    if timings is not None:
+        timings['decode'] = time.perf_counter() - start
+    return hash_thumbnail(thumbnail, timings)
+
+
+def hash_thumbnail(thumbnail: Image.Image, timings: dict = None) -> dict:
+    """Hash a grayscale thumbnail from load_grayscale_thumbnail (or one made
+    the same way from an image the caller already decoded)."""
+    start = time.perf_counter()
+    ah = average_hash(thumbnail)
+    after_ah = time.perf_counter()
+    dh = difference_hash(thumbnail)
+    after_dh = time.perf_counter()
+    try:
+        ph = perceptual_hash(thumbnail)
+    except Exception:
+        ph = ''  # Fallback if pHash fails
+    if timings is not None:
+        timings['aHash'] = after_ah - start
+        timings['dHash'] = after_dh - after_ah
+        timings['pHash'] = time.perf_counter() - after_dh
+    combined = ah + dh + ph
+    return {"aHash": ah, "dHash": dh, "pHash": ph, "combined": combined, "schema": HASH_SCHEMA}
+
+
+def compute_robust_hash(image_bytes, timings: dict = None) -> dict:
+    """Rotation-, mirror- and EXIF-orientation-independent variant of
+    compute_combined_hash (see canonical_hash); same arguments. The decode
+    honours the EXIF Orientation tag, so "transform" is relative to the
+    photo as displayed.
+    """
+    start = time.perf_counter()
+    thumbnail = load_grayscale_thumbnail(image_bytes, exif_transpose=True)
+    if timings is not None:
+        timings['decode'] = time.perf_counter() - start
+    return canonical_hash(thumbnail, timings)
+
+
+def canonical_hash(thumbnail: Image.Image, timings: dict = None) -> dict:
+    """Hash a square grayscale thumbnail in its canonical orientation.
+    Of the thumbnail's eight D4 orientations, the one with the smallest
+    combined hash wins, so a rotated or mirrored copy of a photo
+    gets the same hash as the original. Only that one hash is indexed: robust
+    mode costs a few extra hashes of a 64x64 image, not seven extra lookups.
+    Adds "transform" (the winning orientation) and "crop", the combined hash
+    of the canonical thumbnail's central CENTER_CROP square, which
+    crop_distance compares to catch lightly cropped copies.
+    timings gets aHash, dHash and pHash for the first orientation, as from
+    hash_thumbnail, plus "robust" for the rest of the work.
+    """
+    first = hash_thumbnail(thumbnail, timings)
+    start = time.perf_counter()
+    # aHash is the leading 64 bits of the combined value, so only the
+    # orientations tied on the smallest aHash need dHash and pHash as well
+    oriented = [(name, thumbnail if method is None else thumbnail.transpose(method))
+                for name, method in D4_TRANSFORMS]
+    ahashes = [first['aHash']] + [average_hash(image) for _, image in oriented[1:]]
+    lowest = min(ahashes, key=hex_to_int)
+    best = None
+    for (name, image), ahash in zip(oriented, ahashes):
+        if hex_to_int(ahash) != hex_to_int(lowest):
+            continue
+        result = first if name == 'identity' else hash_thumbnail(image)
+        value = combined_int(result)
+        if best is None or value < best[0]:
+            best = (value, name, image, result)
+    _, name, image, result = best
+    side = image.width
+    keep = round(side * CENTER_CROP)
+    offset = (side - keep) // 2
+    crop = hash_thumbnail(image.crop((offset, offset, offset + keep, offset + keep)))
+    if timings is not None:
+        timings['robust'] = time.perf_counter() - start
+    return {**result, "transform": name, "crop": crop['combined'], "schema": ROBUST_HASH_SCHEMA}
+
+
+def hash_upload(source_path: str, robust: bool = False) -> tuple:
+    """HashPool job: (hash dict, timings) of a stored file, from
+    compute_robust_hash if robust else compute_combined_hash."""
+    timings = {}
+    compute = compute_robust_hash if robust else compute_combined_hash
+    return compute(source_path, timings), timings
+
+
+def is_duplicate(new_hash: dict, existing_hashes, threshold=5) -> bool:
+    """Check if new_hash is a duplicate against any existing hashes using Hamming distance.
+    existing_hashes: list of stored dicts with 'aHash' or 'dHash' or 'combined',
+    or the output of scoring.pack_components() when the caller keeps a packed
+    set around. threshold: bits on the combined hash, or a scoring.HashScorer
+    for per-component rules. Components missing on either side (a failed
+    pHash) are left out of the comparison rather than padded.
+    """
+    if len(existing_hashes) == 0:
+        return False
+    if isinstance(existing_hashes, list) and not isinstance(existing_hashes[0], tuple):
+        existing_hashes = pack_components(existing_hashes)
+    return as_scorer(threshold).scan(new_hash, existing_hashes, first=True) is not None
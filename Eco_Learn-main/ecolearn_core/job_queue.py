@@ -0,0 +1,369 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from .metrics import REGISTRY
+
+# Background jobs for work that can follow an accepted upload (rendering
+# derivatives, and whatever else need not hold up the response). A job is
+# a registered kind plus a JSON payload; worker tasks on the event loop run
+# its async handler. Statuses go queued -> running -> succeeded, or back to
+# queued after a failed attempt (exponential backoff) until max_attempts is
+# reached and it is marked failed.
+#
+# Two stores:
+#   MemoryJobStore  jobs live in this worker process and are lost if it dies
+#   SqliteJobStore  jobs are committed before enqueue() returns and shared by
+#                   every worker process on the machine; a worker claims a job
+#                   with BEGIN IMMEDIATE and holds a lease on it, so a job
+#                   whose process died is run again once its lease expires
+#
+# Handlers must be idempotent: a job may run more than once (retries, expired
+# leases). Per-kind concurrency limits apply within one process.
+
+PUBLIC_FIELDS = ('id', 'kind', 'status', 'attempts', 'max_attempts', 'error', 'result',
+                 'created_at', 'updated_at')
+FINISHED = ('succeeded', 'failed')
+
+JOB_RESULTS = REGISTRY.counter(
+    'eco_jobs_total', 'Background job attempts by outcome (succeeded, retried, failed)', ('kind', 'result'))
+JOB_SECONDS = REGISTRY.histogram('eco_job_seconds', 'Run time of background job attempts', ('kind',))
+
+
+class RetryLater(Exception):
+    """Raised by a handler to run its job again after delay seconds without
+    using up an attempt, e.g. when the worker pool it needs is saturated."""
+
+    def __init__(self, delay: float = 1.0):
+        super().__init__(f"retry in {delay} s")
+        self.delay = delay
+
+
+class MemoryJobStore:
+    """Jobs of this process in dicts; keeps the last `history` finished ones."""
+
+    durable = False
+
+    def __init__(self, history: int = 1000):
+        self._jobs = OrderedDict()
+        self._queued = OrderedDict()  # job id -> None, in enqueue order
+        self._finished = OrderedDict()
+        self._history = history
+
+    def add(self, job: dict) -> None:
+        self._jobs[job['id']] = job
+        self._queued[job['id']] = None
+
+    def claim(self, kinds, now: float, lease: float):
+        for job_id in self._queued:
+            job = self._jobs[job_id]
+            if job['kind'] in kinds and job['not_before'] <= now:
+                del self._queued[job_id]
+                job.update(status='running', attempts=job['attempts'] + 1, updated_at=now)
+                return dict(job)
+        return None
+
+    def update(self, job_id: str, **fields) -> None:
+        job = self._jobs[job_id]
+        job.update(fields)
+        if fields.get('status') == 'queued':
+            self._queued[job_id] = None
+        elif fields.get('status') in FINISHED:
+            self._finished[job_id] = None
+            while len(self._finished) > self._history:
+                old_id, _ = self._finished.popitem(last=False)
+                del self._jobs[old_id]
+
+    def get(self, job_id: str):
+        job = self._jobs.get(job_id)
+        return dict(job) if job else None
+
+    def next_due(self):
+        """Earliest not_before of the queued jobs, or None."""
+        return min((self._jobs[job_id]['not_before'] for job_id in self._queued), default=None)
+
+    def pending(self) -> int:
+        return len(self._jobs) - len(self._finished)
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteJobStore:
+    """Jobs in a SQLite file shared by the worker processes of one machine."""
+
+    durable = True
+
+    def __init__(self, path: str, history: int = 1000):
+        self.path = path
+        self._history = history
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=30)
+        self._lock = threading.RLock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                not_before REAL NOT NULL,
+                lease_until REAL,
+                error TEXT,
+                result TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, not_before);
+        """)
+
+    def _row(self, row) -> dict:
+        keys = ('id', 'kind', 'payload', 'status', 'attempts', 'max_attempts', 'not_before',
+                'lease_until', 'error', 'result', 'created_at', 'updated_at')
+        job = dict(zip(keys, row))
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        return job
+
+    def add(self, job: dict) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, payload, status, attempts, max_attempts, not_before, "
+                "created_at, updated_at) VALUES (?, ?, ?, 'queued', 0, ?, ?, ?, ?)",
+                (job['id'], job['kind'], json.dumps(job['payload']), job['max_attempts'],
+                 job['not_before'], job['created_at'], job['updated_at']))
+
+    def claim(self, kinds, now: float, lease: float):
+        """Take the oldest due job of kinds: queued, or running under an
+        expired lease (its process died). Counts as an attempt."""
+        kinds = list(kinds)
+        marks = ','.join('?' * len(kinds))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    f"SELECT * FROM jobs WHERE kind IN ({marks}) AND "
+                    f"((status = 'queued' AND not_before <= ?) OR (status = 'running' AND lease_until < ?)) "
+                    f"ORDER BY not_before LIMIT 1", (*kinds, now, now)).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                job = self._row(row)
+                job.update(status='running', attempts=job['attempts'] + 1, lease_until=now + lease, updated_at=now)
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = ?, lease_until = ?, updated_at = ? WHERE id = ?",
+                    (job['attempts'], job['lease_until'], now, job['id']))
+                self._conn.execute("COMMIT")
+                return job
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def update(self, job_id: str, **fields) -> None:
+        if 'result' in fields:
+            fields['result'] = json.dumps(fields['result'])
+        if fields.get('status') != 'running':
+            fields['lease_until'] = None
+        columns = ', '.join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+            if fields.get('status') in FINISHED:
+                self._conn.execute(
+                    "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND id NOT IN "
+                    "(SELECT id FROM jobs WHERE status IN ('succeeded', 'failed') "
+                    "ORDER BY updated_at DESC LIMIT ?)", (self._history,))
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def next_due(self):
+        # Other processes enqueue too, so workers poll instead
+        return None
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class JobQueue:
+    """Async job queue: register(kind, handler), enqueue(kind, payload), get(id).
+
+    workers: worker tasks per process, shared by every kind.
+    max_attempts / backoff: a failed attempt is retried after
+    backoff * 2 ** (attempts - 1) seconds until max_attempts are used.
+    lease: seconds a claimed job is reserved for its SQLite worker.
+    poll: longest idle wait between store checks (jobs of other processes,
+    retries coming due).
+    Workers start with the first enqueue() or start() on a running loop;
+    drain() finishes outstanding work at shutdown. SqliteJobStore calls made
+    by the queue run in a thread, off the event loop; get() and pending()
+    block, so async callers run them with asyncio.to_thread.
+    """
+
+    def __init__(self, store=None, workers: int = 4, max_attempts: int = 3, backoff: float = 1.0,
+                 lease: float = 300.0, poll: float = 1.0):
+        self.store = store or MemoryJobStore()
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lease = lease
+        self.poll = poll
+        self._handlers = {}  # kind -> (handler, concurrency limit or None)
+        self._running = {}  # kind -> attempts running in this process
+        self._tasks = []
+        self._loop = None
+        self._wake = None
+        self._claiming = None
+        self._draining = False
+
+    def register(self, kind: str, handler, concurrency: int = None) -> None:
+        """handler: async function of the job payload; what it returns (JSON)
+        is stored as the job result. concurrency caps its running jobs."""
+        self._handlers[kind] = (handler, concurrency)
+        self._running.setdefault(kind, 0)
+
+    async def enqueue(self, kind: str, payload: dict, max_attempts: int = None) -> str:
+        """Store a job and return its id; with SqliteJobStore it is committed."""
+        if kind not in self._handlers:
+            raise KeyError(f"No handler registered for job kind {kind!r}")
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        await self._store_call(self.store.add, {
+            "id": job_id, "kind": kind, "payload": payload, "status": 'queued', "attempts": 0,
+            "max_attempts": max_attempts or self.max_attempts, "not_before": now,
+            "lease_until": None, "error": None, "result": None,
+            "created_at": now, "updated_at": now})
+        self.start()
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id: str):
+        """Public view of a job (no payload), or None if unknown or expired."""
+        job = self.store.get(job_id)
+        return {name: job[name] for name in PUBLIC_FIELDS} if job else None
+
+    def pending(self) -> int:
+        """Queued and running jobs (of every process, for SqliteJobStore)."""
+        return self.store.pending()
+
+    def start(self) -> None:
+        """Start the worker tasks on the running loop (again, if the loop
+        changed, as between test clients)."""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._tasks and not self._draining:
+            return
+        self._loop, self._draining = loop, False
+        self._wake = asyncio.Event()
+        self._claiming = asyncio.Lock()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def drain(self, timeout: float = 30.0) -> int:
+        """Stop the workers once their work is done: all queued jobs with
+        MemoryJobStore (they would be lost), only running ones with
+        SqliteJobStore (queued ones wait in the file for the next start).
+        After timeout seconds the rest is cancelled; durable jobs cut short
+        go back to queued. Returns the jobs of this process left unfinished.
+        """
+        if not self._tasks:
+            return 0 if self.store.durable else self.store.pending()
+        self._draining = True
+        self._wake.set()
+        tasks, self._tasks = self._tasks, []
+        done, cancelled = await asyncio.wait(tasks, timeout=timeout)
+        for task in cancelled:
+            task.cancel()
+        if cancelled:
+            await asyncio.gather(*cancelled, return_exceptions=True)
+        return sum(self._running.values()) + (0 if self.store.durable else self.store.pending())
+
+    async def _store_call(self, method, *args, **fields):
+        # SQLite reads and commits wait on disk and on other processes, so they
+        # go to a thread; the memory store is cheap and only used from the loop
+        if self.store.durable:
+            return await asyncio.to_thread(method, *args, **fields)
+        return method(*args, **fields)
+
+    def _free_kinds(self) -> list:
+        return [kind for kind, (_, limit) in self._handlers.items()
+                if limit is None or self._running[kind] < limit]
+
+    async def _worker(self) -> None:
+        while True:
+            self._wake.clear()
+            # One claim at a time, counted as running before the next worker
+            # checks the concurrency limits
+            async with self._claiming:
+                # Durable queued jobs are left for the next start once draining
+                kinds = [] if self._draining and self.store.durable else self._free_kinds()
+                job = await self._store_call(self.store.claim, kinds, time.time(), self.lease) if kinds else None
+                if job is not None:
+                    self._running[job['kind']] += 1
+            if job is None:
+                if self._draining and (self.store.durable or not self.store.pending()):
+                    return
+                timeout = self.poll
+                due = self.store.next_due()
+                if due is not None:
+                    timeout = min(timeout, max(0.0, due - time.time()))
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _run(self, job: dict) -> None:
+        kind = job['kind']
+        handler, _ = self._handlers[kind]
+        start = time.perf_counter()
+        try:
+            result = await handler(job['payload'])
+        except RetryLater as e:
+            await self._store_call(self.store.update, job['id'], status='queued', attempts=job['attempts'] - 1,
+                                   not_before=time.time() + e.delay, updated_at=time.time())
+        except asyncio.CancelledError:
+            # Cut short by drain(): run it again later, without using an attempt.
+            # Written in place: a thread's write could be lost with the task
+            self.store.update(job['id'], status='queued', attempts=job['attempts'] - 1, updated_at=time.time())
+            raise
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if job['attempts'] < job['max_attempts']:
+                JOB_RESULTS.inc(kind=kind, result='retried')
+                delay = self.backoff * 2 ** (job['attempts'] - 1)
+                await self._store_call(self.store.update, job['id'], status='queued', error=error,
+                                       not_before=time.time() + delay, updated_at=time.time())
+            else:
+                JOB_RESULTS.inc(kind=kind, result='failed')
+                await self._store_call(self.store.update, job['id'], status='failed', error=error,
+                                       updated_at=time.time())
+        else:
+            JOB_RESULTS.inc(kind=kind, result='succeeded')
+            await self._store_call(self.store.update, job['id'], status='succeeded', error=None, result=result,
+                                   updated_at=time.time())
+        finally:
+            self._running[kind] -= 1
+            JOB_SECONDS.observe(time.perf_counter() - start, kind=kind)
+            self._wake.set()
+
+
+def open_job_queue(kind: str, path: str = None, **options) -> JobQueue:
+    """JobQueue over a 'memory' or 'sqlite' (at path) store."""
+    if kind == 'memory':
+        return JobQueue(MemoryJobStore(), **options)
+    if kind == 'sqlite':
+        return JobQueue(SqliteJobStore(path), **options)
+    raise ValueError(f"Unknown job store {kind!r}; expected 'memory' or 'sqlite'")
@@ -0,0 +1,33 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+# asyncio locks handed out by key, so coroutines in one worker that touch
+# the same student (or dedup scope) queue behind each other while everything
+# else keeps running. Only serialises within one event loop; across workers
+# the hash store's own transactions and file locks do that job.
+
+
+class KeyedLocks:
+    """One asyncio.Lock per key, created on first use and dropped once no
+    coroutine holds or waits for it, so idle keys cost nothing.
+    """
+
+    def __init__(self):
+        self._locks = {}  # key -> [lock, holders + waiters]
+
+    def __len__(self):
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
@@ -0,0 +1,87 @@
+import hashlib
+from datetime import datetime, timezone
+
+# Query handling for the student image listing, shared by the FastAPI server
+# and the Vercel handlers:
+#   cursor       - next_cursor from the previous page
+#   limit        - page size (1..MAX_PAGE_SIZE); omitted = every matching record
+#   challenge_id - only this challenge's proofs
+#   since, until - ISO 8601 dates/times (UTC) bounding uploaded_at; since is
+#                  inclusive, until exclusive
+#   fields       - comma separated record keys to return, e.g.
+#                  "filename,url,uploaded_at" to leave out the hash dicts
+# Responses carry an ETag built from the student's version counter and the
+# query, so an unchanged listing is answered with 304 without reading it.
+
+MAX_PAGE_SIZE = 200
+# Format of record['uploaded_at']; sorts chronologically as a string
+TIMESTAMP_FORMAT = '%Y%m%d_%H%M%S_%f'
+
+
+class ListingQueryError(ValueError):
+    """Raised for malformed listing parameters (reported as 400)."""
+
+
+def _to_timestamp(name: str, value: str) -> str:
+    try:
+        moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ListingQueryError(f"{name} must be an ISO 8601 date or datetime, got {value!r}")
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment.strftime(TIMESTAMP_FORMAT)
+
+
+def parse_listing_query(params) -> dict:
+    """Validate raw query parameters (a mapping of str -> str) into keyword
+    arguments for HashStore.list_images_page plus 'fields'."""
+    query = {"cursor": None, "limit": None, "challenge_id": None, "since": None, "until": None, "fields": None}
+    cursor = params.get('cursor')
+    if cursor:
+        if not cursor.isdigit():
+            raise ListingQueryError("Invalid cursor")
+        query["cursor"] = cursor
+    limit = params.get('limit')
+    if limit:
+        if not limit.isdigit() or not 1 <= int(limit) <= MAX_PAGE_SIZE:
+            raise ListingQueryError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        query["limit"] = int(limit)
+    if params.get('challenge_id'):
+        query["challenge_id"] = params['challenge_id']
+    for name in ('since', 'until'):
+        if params.get(name):
+            query[name] = _to_timestamp(name, params[name])
+    fields = params.get('fields')
+    if fields:
+        query["fields"] = tuple(sorted({field.strip() for field in fields.split(',') if field.strip()}))
+    return query
+
+
+def project(records: list, fields: tuple) -> list:
+    if not fields:
+        return records
+    return [{field: record[field] for field in fields if field in record} for record in records]
+
+
+def listing_etag(student_id: str, version: int, query: dict) -> str:
+    """Weak ETag for one listing page: changes whenever the student's
+    version does, and differs between pages and filters."""
+    key = repr((student_id, sorted(query.items())))
+    return f'W/"{version}-{hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # Weak comparison: ignore W/ prefixes
+    candidates = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return etag.removeprefix('W/') in candidates
+
+
+def list_student_page(store, student_id: str, query: dict) -> dict:
+    """Run a parsed query against store; returns the response body."""
+    page_args = {name: value for name, value in query.items() if name != 'fields'}
+    records, next_cursor = store.list_images_page(student_id, **page_args)
+    return {"images": project(records, query["fields"]), "next_cursor": next_cursor}
@@ -0,0 +1,145 @@
+import hashlib
+import tempfile
+
+try:
+    from python_multipart.multipart import (
+        MultipartParseError, MultipartParser, MultipartState, parse_options_header)
+except ImportError:  # python-multipart < 0.0.13 only ships the `multipart` name
+    from multipart.multipart import MultipartParseError, MultipartParser, MultipartState, parse_options_header
+
+from .upload_stream import UploadTooLarge  # noqa: F401  (re-exported for the handlers)
+
+# Streaming multipart/form-data parsing for the BaseHTTPRequestHandler
+# functions. The body is read from rfile in CHUNK_SIZE pieces and pushed
+# through python-multipart's parser. Field values are kept in memory; the file
+# part is written straight into a SpooledTemporaryFile, which stays in memory
+# up to SPOOL_MEMORY_BYTES and moves to a temp file beyond that, with its
+# SHA-256 computed on the way. Peak memory is therefore at most one copy of
+# the file (less for large files) instead of the several copies the old
+# split()-based parsing made.
+
+CHUNK_SIZE = 64 * 1024
+SPOOL_MEMORY_BYTES = 4 * 1024 * 1024
+MAX_FIELD_BYTES = 64 * 1024
+
+
+class MultipartError(ValueError):
+    """Raised for malformed or truncated multipart bodies."""
+
+
+class SpooledUpload:
+    """The file part of a form: filename, content type, size, sha256 and a
+    readable file object positioned at 0. Call close() when done."""
+
+    def __init__(self, filename: str, content_type: str):
+        self.filename = filename
+        self.content_type = content_type
+        self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+        self.size = 0
+        self._digest = hashlib.sha256()
+
+    @property
+    def sha256(self) -> str:
+        return self._digest.hexdigest()
+
+    def write(self, data) -> None:
+        self._digest.update(data)
+        self.file.write(data)
+        self.size += len(data)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def boundary_from_content_type(content_type: str) -> bytes:
+    kind, options = parse_options_header(content_type)
+    if kind != b'multipart/form-data' or not options.get(b'boundary'):
+        raise MultipartError("Only multipart/form-data supported")
+    return options[b'boundary']
+
+
+def parse_multipart(rfile, content_length: int, boundary: bytes, file_field: str = 'file',
+                    max_file_bytes: int = None):
+    """Stream content_length bytes of rfile through the parser.
+    Returns (fields, upload): fields maps name -> str for ordinary fields and
+    upload is a SpooledUpload for file_field (None if absent). Raises
+    UploadTooLarge or MultipartError; the spool is closed on error.
+    """
+    fields = {}
+    state = {"name": None, "headers": {}, "header_field": b'', "header_value": b'', "value": None}
+    holder = {"upload": None}
+
+    def on_part_begin():
+        state["headers"], state["name"], state["value"] = {}, None, None
+
+    def on_header_field(data, start, end):
+        state["header_field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["header_value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["header_field"].lower()] = state["header_value"]
+        state["header_field"], state["header_value"] = b'', b''
+
+    def on_headers_finished():
+        _, options = parse_options_header(state["headers"].get(b'content-disposition', b''))
+        name = options.get(b'name', b'').decode('utf-8', 'replace')
+        state["name"] = name
+        if name == file_field and b'filename' in options:
+            if holder["upload"] is not None:
+                raise MultipartError(f"More than one '{file_field}' part")
+            holder["upload"] = SpooledUpload(
+                options[b'filename'].decode('utf-8', 'replace'),
+                state["headers"].get(b'content-type', b'application/octet-stream').decode('latin-1'))
+        else:
+            state["value"] = bytearray()
+
+    def on_part_data(data, start, end):
+        if state["value"] is None:
+            upload = holder["upload"]
+            if max_file_bytes is not None and upload.size + (end - start) > max_file_bytes:
+                raise UploadTooLarge()
+            upload.write(memoryview(data)[start:end])
+        else:
+            state["value"] += data[start:end]
+            if len(state["value"]) > MAX_FIELD_BYTES:
+                raise MultipartError(f"Field '{state['name']}' is too large")
+
+    def on_part_end():
+        if state["value"] is not None:
+            fields[state["name"]] = state["value"].decode('utf-8', 'replace')
+
+    parser = MultipartParser(boundary, {
+        'on_part_begin': on_part_begin,
+        'on_header_field': on_header_field,
+        'on_header_value': on_header_value,
+        'on_header_end': on_header_end,
+        'on_headers_finished': on_headers_finished,
+        'on_part_data': on_part_data,
+        'on_part_end': on_part_end,
+    })
+    try:
+        remaining = content_length
+        while remaining > 0:
+            chunk = rfile.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise MultipartError("Request body ended early")
+            remaining -= len(chunk)
+            parser.write(chunk)
+        parser.finalize()
+        if parser.state != MultipartState.END:
+            raise MultipartError("Multipart body is missing its closing boundary")
+    except MultipartParseError as e:
+        if holder["upload"] is not None:
+            holder["upload"].close()
+        raise MultipartError(f"Malformed multipart body: {e}")
+    except BaseException:
+        if holder["upload"] is not None:
+            holder["upload"].close()
+        raise
+
+    upload = holder["upload"]
+    if upload is not None:
+        upload.file.seek(0)
+    return fields, upload
@@ -0,0 +1,370 @@
+import json
+import threading
+
+from .hash_bits import HASH_WORDS, combined_int
+from .hash_index import DEFAULT_BAND_BITS, band_values
+from .hash_store import HashStore, in_scope, match_payload, scope_key
+from .scoring import as_scorer, component_hex, pack_components
+
+# HashStore on a Redis-protocol server (Redis, Valkey, Vercel KV / Upstash),
+# for deployments whose local disk does not outlive an instance. The Vercel
+# functions keep their store in /tmp, so every cold start and every extra
+# instance would otherwise begin with no hashes at all.
+#
+# Keys, all under a prefix (default "eco:"):
+#   next_id                  - INCR counter handing out image ids
+#   records                  - HASH image id -> JSON [student_id, record]
+#   s:<student>:ids          - LIST of the student's image ids, upload order
+#   h:student:<id>, h:challenge:<id>, h:institution:<id>, h:global
+#                            - STRING per dedup scope: the scope's image ids
+#                              and combined hashes, appended as fixed-width
+#                              hex entries, so a scan is one GET
+#   h_format                 - layout of the h:* entries (_PACKED_FORMAT)
+#   band:<n>:<value>         - SET of image ids per 16-bit hash band, as the
+#                              SQLite hash_bands table
+#   digest:<sha256>          - SET of image ids with those exact bytes
+#   v:student:<id>, v:challenge:<id>, v:institution:<id>, v:global
+#                            - insert counters per dedup scope; v:student is
+#                              also HashStore.student_version
+#
+# Student-scoped duplicate checks, and any check the scorer cannot answer
+# from band probes (see HashScorer.probes_bands), GET the scope's packed
+# hashes and score them with HashScorer.scan. Other scopes probe all band
+# sets in one pipelined round trip. Record JSON is only read for band probe
+# candidates and for the match.
+# Check-and-insert is optimistic: the scope's insert counter is WATCHed, the
+# duplicate check runs, and the insert is queued in MULTI/EXEC. If another
+# instance inserted into the same scope in between, EXEC fails and the whole
+# check is retried, so concurrent instances cannot both accept a duplicate.
+# redis-py is imported on first use, and connections come from one pool per
+# URL and process, so a warm serverless instance reuses its sockets.
+
+_BANDS = HASH_WORDS * 64 // DEFAULT_BAND_BITS
+# Optimistic transaction attempts before giving up on a contended scope
+MAX_ATTEMPTS = 20
+# Image ids fetched per LRANGE when paging through a student's list
+PAGE_CHUNK = 256
+# h:* entries: 16 hex digits of image id, then 48 of combined hash. A hash
+# without a pHash has 32 digits and is padded with '-', not '0', so a full
+# hash whose aHash is 0 stays distinguishable (see scoring.has_phash)
+_ID_DIGITS = 16
+_ENTRY = _ID_DIGITS + HASH_WORDS * 16
+# Bumped when the entry layout changes; other values are rebuilt. 2: '-' padding
+_PACKED_FORMAT = '2'
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def connection_pool(url: str, max_connections: int = 16):
+    """Process-wide redis-py ConnectionPool for url, created on first use."""
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError("HASH_STORE=redis needs the redis package: pip install redis")
+    with _pools_lock:
+        pool = _pools.get(url)
+        if pool is None:
+            pool = _pools[url] = redis.ConnectionPool.from_url(
+                url, max_connections=max_connections, decode_responses=True,
+                socket_timeout=5, socket_connect_timeout=5, health_check_interval=30)
+        return pool
+
+
+def _packed_entry(image_id: int, hash_dict: dict) -> str:
+    return f"{image_id:0{_ID_DIGITS}x}{component_hex(hash_dict).rjust(HASH_WORDS * 16, '-')}"
+
+
+class StoreContention(RuntimeError):
+    """Raised when a check-and-insert lost MAX_ATTEMPTS races in a row."""
+
+
+class RedisHashStore(HashStore):
+    """HashStore backed by a Redis-protocol server at url."""
+
+    def __init__(self, url: str, prefix: str = 'eco:', max_connections: int = 16):
+        import redis
+
+        self.url = url
+        self.prefix = prefix
+        self._redis = redis.Redis(connection_pool=connection_pool(url, max_connections))
+        self._watch_error = redis.WatchError
+        self._packed_checked = False
+
+    # Key names
+    def _key(self, *parts) -> str:
+        return self.prefix + ':'.join(str(part) for part in parts)
+
+    def _scope_key(self, scope: str, student_id: str, challenge_id: str, institution_id: str = None) -> str:
+        return self._key('v', *scope_key(scope, student_id, challenge_id, institution_id))
+
+    def _packed_key(self, scope: str, student_id: str, challenge_id: str, institution_id: str = None) -> str:
+        return self._key('h', *scope_key(scope, student_id, challenge_id, institution_id))
+
+    def _packed_keys(self, student_id: str, record: dict) -> list:
+        """The h:* string of every dedup scope the record belongs to."""
+        keys = [self._key('h', 'student', student_id), self._key('h', 'challenge', record['challenge_id']),
+                self._key('h', 'global')]
+        if record.get('institution_id'):
+            keys.append(self._key('h', 'institution', record['institution_id']))
+        return keys
+
+    def _version_keys(self, student_id: str, record: dict) -> list:
+        keys = [self._key('v', 'student', student_id), self._key('v', 'challenge', record['challenge_id']),
+                self._key('v', 'global')]
+        if record.get('institution_id'):
+            keys.append(self._key('v', 'institution', record['institution_id']))
+        return keys
+
+    # Reads
+    def _load_records(self, client, image_ids: list) -> list:
+        """[(student_id, record)] for image_ids, in order; one HMGET."""
+        if not image_ids:
+            return []
+        return [tuple(json.loads(raw)) for raw in client.hmget(self._key('records'), image_ids)]
+
+    def list_images(self, student_id: str) -> list:
+        ids = self._redis.lrange(self._key('s', student_id, 'ids'), 0, -1)
+        return [record for _, record in self._load_records(self._redis, ids)]
+
+    def count_images(self, student_id: str = None) -> int:
+        if student_id is None:
+            return self._redis.hlen(self._key('records'))
+        return self._redis.llen(self._key('s', student_id, 'ids'))
+
+    def list_images_page(self, student_id, cursor=None, limit=None, challenge_id=None, since=None, until=None):
+        # Lists are append-only, so the cursor is a list position
+        ids_key = self._key('s', student_id, 'ids')
+        position, page = int(cursor or 0), []
+        while limit is None or len(page) < limit:
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.lrange(ids_key, position, position + PAGE_CHUNK - 1)
+            pipe.llen(ids_key)
+            ids, total = pipe.execute()
+            if not ids:
+                break
+            for _, record in self._load_records(self._redis, ids):
+                if limit is not None and len(page) >= limit:
+                    break
+                position += 1
+                if challenge_id is not None and record.get('challenge_id') != challenge_id:
+                    continue
+                uploaded_at = record.get('uploaded_at', '')
+                if (since is not None and uploaded_at < since) or (until is not None and uploaded_at >= until):
+                    continue
+                page.append(record)
+            if position >= total:
+                break
+        total = self._redis.llen(ids_key)
+        return page, (str(position) if position < total else None)
+
+    def student_version(self, student_id: str) -> int:
+        return int(self._redis.get(self._key('v', 'student', student_id)) or 0)
+
+    def _fill_packed(self) -> None:
+        """Build the h:* strings from the records when they are missing
+        entries or use an older layout (records stored by a version without
+        them). Checked once per store object; inserts append to them in the
+        record's own MULTI."""
+        if self._packed_checked:
+            return
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.hlen(self._key('records'))
+        pipe.strlen(self._key('h', 'global'))
+        pipe.get(self._key('h_format'))
+        stored, packed, packed_format = pipe.execute()
+        if stored != packed // _ENTRY or (stored and packed_format != _PACKED_FORMAT):
+
+            def work(pipe):
+                strings = {}
+                for image_id, raw in sorted(pipe.hgetall(self._key('records')).items(), key=lambda kv: int(kv[0])):
+                    student_id, record = json.loads(raw)
+                    entry = _packed_entry(int(image_id), record['hash'])
+                    for key in self._packed_keys(student_id, record):
+                        strings.setdefault(key, []).append(entry)
+                stale = list(pipe.scan_iter(match=self._key('h', '*'), count=1000))
+                pipe.multi()
+                if stale:
+                    pipe.delete(*stale)
+                for key, entries in strings.items():
+                    pipe.set(key, ''.join(entries))
+                pipe.set(self._key('h_format'), _PACKED_FORMAT)
+                return None, True
+
+            # Rebuilt from a consistent view: an insert in between retries
+            self._optimistic([self._key('records')], work)
+        self._packed_checked = True
+
+    def _find_duplicate(self, client, new_hash, threshold, scope, student_id, challenge_id, institution_id):
+        scorer = as_scorer(threshold)
+        student_scoped = scope == 'student' or (scope == 'institution' and not institution_id)
+        loaded = {}
+        if student_scoped or not scorer.probes_bands(new_hash):
+            self._fill_packed()
+            # The scope's ids and hashes in one round trip; sorted, the
+            # fixed-width entries are in id order, as SQLite scans them
+            packed = client.get(self._packed_key(scope, student_id, challenge_id, institution_id)) or ''
+            entries = sorted(packed[i:i + _ENTRY] for i in range(0, len(packed), _ENTRY))
+            ids = [entry[:_ID_DIGITS] for entry in entries]  # hex; only the match's is parsed
+            values = [entry[_ID_DIGITS:].lstrip('-') for entry in entries]
+        else:
+            pipe = client.pipeline(transaction=False)
+            for band, value in enumerate(band_values(combined_int(new_hash), _BANDS)):
+                pipe.smembers(self._key('band', band, value))
+            probed = sorted({int(image_id) for members in pipe.execute() for image_id in members})
+            for image_id, (candidate_student, record) in zip(probed, self._load_records(client, probed)):
+                if in_scope(scope, candidate_student, record, student_id, challenge_id, institution_id):
+                    loaded[image_id] = (candidate_student, record)
+            ids = list(loaded)
+            values = [record['hash'] for _, record in loaded.values()]
+        best = scorer.scan(new_hash, pack_components(values)) if values else None
+        if best is None:
+            return None
+        row, distance = best
+        if loaded:
+            candidate_student, record = loaded[ids[row]]
+        else:
+            (candidate_student, record), = self._load_records(client, [int(ids[row], 16)])
+        return match_payload(candidate_student, record, distance, scope)
+
+    def find_duplicate(self, new_hash, threshold, scope, student_id, challenge_id, institution_id=None):
+        return self._find_duplicate(self._redis, new_hash, threshold, scope, student_id, challenge_id,
+                                    institution_id)
+
+    def find_by_digest(self, digest, scope, student_id, challenge_id, institution_id=None):
+        ids = sorted(self._redis.smembers(self._key('digest', digest)), key=int)
+        for candidate_student, record in self._load_records(self._redis, ids):
+            if in_scope(scope, candidate_student, record, student_id, challenge_id, institution_id):
+                return match_payload(candidate_student, record, 0, scope)
+        return None
+
+    # Writes
+    def _queue_insert(self, pipe, image_id: int, student_id: str, record: dict) -> None:
+        combined = combined_int(record['hash'])
+        pipe.hset(self._key('records'), image_id, json.dumps([student_id, record]))
+        pipe.rpush(self._key('s', student_id, 'ids'), image_id)
+        entry = _packed_entry(image_id, record['hash'])
+        for key in self._packed_keys(student_id, record):
+            pipe.append(key, entry)
+        for band, value in enumerate(band_values(combined, _BANDS)):
+            pipe.sadd(self._key('band', band, value), image_id)
+        if record.get('sha256'):
+            pipe.sadd(self._key('digest', record['sha256']), image_id)
+        for key in self._version_keys(student_id, record):
+            pipe.incr(key)
+
+    def _new_ids(self, count: int) -> range:
+        last = self._redis.incrby(self._key('next_id'), count)
+        return range(last - count + 1, last + 1)
+
+    def add_image(self, student_id: str, record: dict) -> int:
+        image_id, = self._new_ids(1)
+        pipe = self._redis.pipeline(transaction=True)
+        self._queue_insert(pipe, image_id, student_id, record)
+        pipe.llen(self._key('s', student_id, 'ids'))
+        return pipe.execute()[-1]
+
+    def add_images(self, items: list) -> None:
+        """Insert many (student_id, record) pairs in one MULTI/EXEC."""
+        if not items:
+            return
+        pipe = self._redis.pipeline(transaction=True)
+        for image_id, (student_id, record) in zip(self._new_ids(len(items)), items):
+            self._queue_insert(pipe, image_id, student_id, record)
+        pipe.execute()
+
+    def _optimistic(self, watch_keys: list, work):
+        """Run work(pipe) with watch_keys WATCHed until EXEC succeeds.
+        work reads through pipe (immediate mode), calls pipe.multi() and
+        queues its writes; it returns (result, wrote) and result is returned.
+        """
+        for _ in range(MAX_ATTEMPTS):
+            with self._redis.pipeline(transaction=True) as pipe:
+                try:
+                    pipe.watch(*watch_keys)
+                    result, wrote = work(pipe)
+                    if wrote:
+                        responses = pipe.execute()
+                        return result(responses) if callable(result) else result
+                    pipe.unwatch()
+                    return result
+                except self._watch_error:
+                    continue
+        raise StoreContention(f"Gave up after {MAX_ATTEMPTS} conflicting inserts on {watch_keys}")
+
+    def add_image_if_unique(self, student_id: str, record: dict, threshold: int, scope: str):
+        challenge_id, institution_id = record['challenge_id'], record.get('institution_id')
+        image_id, = self._new_ids(1)
+
+        def work(pipe):
+            match = self._find_duplicate(pipe, record['hash'], threshold, scope, student_id,
+                                         challenge_id, institution_id)
+            if match:
+                return (match, None), False
+            pipe.multi()
+            self._queue_insert(pipe, image_id, student_id, record)
+            pipe.llen(self._key('s', student_id, 'ids'))
+            return (lambda responses: (None, responses[-1])), True
+
+        return self._optimistic([self._scope_key(scope, student_id, challenge_id, institution_id)], work)
+
+    def add_images_if_unique(self, items: list, threshold: int, scope: str) -> list:
+        if not items:
+            return []
+        watch_keys = sorted({self._scope_key(scope, student_id, record['challenge_id'], record.get('institution_id'))
+                             for student_id, record in items})
+        image_ids = self._new_ids(len(items))
+        scorer = as_scorer(threshold)
+
+        def work(pipe):
+            results, accepted = [], []
+            for image_id, (student_id, record) in zip(image_ids, items):
+                challenge_id, institution_id = record['challenge_id'], record.get('institution_id')
+                match = self._find_duplicate(pipe, record['hash'], scorer, scope, student_id,
+                                             challenge_id, institution_id)
+                # Earlier items of this batch are not in Redis yet. They have
+                # higher ids than stored records, so as in SQLite they only
+                # win when strictly closer, and the earliest among equals
+                for other_id, other_student, other in accepted:
+                    distance = scorer.score(record['hash'], other['hash'])
+                    if (distance is not None and (match is None or distance < match['distance'])
+                            and in_scope(scope, other_student, other, student_id, challenge_id, institution_id)):
+                        match = match_payload(other_student, other, distance, scope)
+                if match is None:
+                    accepted.append((image_id, student_id, record))
+                results.append(match)
+            if not accepted:
+                return results, False
+            pipe.multi()
+            for image_id, student_id, record in accepted:
+                self._queue_insert(pipe, image_id, student_id, record)
+            return results, True
+
+        return self._optimistic(watch_keys, work)
+
+    def student_ids(self) -> list:
+        head, tail = self._key('s', ''), ':ids'
+        return sorted(key[len(head):-len(tail)]
+                      for key in self._redis.scan_iter(match=f"{head}*{tail}", count=1000))
+
+    def replace_contents(self, items: list) -> None:
+        # One MULTI/EXEC: every record key is deleted and the new records are
+        # inserted atomically. The insert counters (v:*) and next_id are kept,
+        # so versions and ids keep increasing across the swap.
+        keep = self._key('v', '')
+        keys = [key for key in self._redis.scan_iter(match=self.prefix + '*', count=1000)
+                if not key.startswith(keep) and key != self._key('next_id')]
+        students = {student_id for student_id, _ in items} | set(self.student_ids())
+        pipe = self._redis.pipeline(transaction=True)
+        if keys:
+            pipe.delete(*keys)
+        for student_id in students:
+            pipe.incr(self._key('v', 'student', student_id))
+        for image_id, (student_id, record) in zip(self._new_ids(len(items)), items):
+            self._queue_insert(pipe, image_id, student_id, record)
+        pipe.set(self._key('h_format'), _PACKED_FORMAT)
+        pipe.execute()
+
+    def close(self) -> None:
+        # The connection pool is shared per URL and outlives the store
+        self._redis.close()
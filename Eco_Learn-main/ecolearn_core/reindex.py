@@ -0,0 +1,304 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from .blob_store import BlobStore, blob_index_path
+from .hash_store import open_hash_store, store_path
+
+# Offline re-hash of every stored upload, for when the hashing pipeline
+# changes (HASH_SCHEMA in image_hash.py) and old records would no longer be
+# comparable with new ones. Run from the server directory, servers stopped:
+#
+#     python -m ecolearn_core.reindex [--workers N] [--robust] [--dry-run]
+#
+#   1. Walk <uploads>/<student_id>/challenge_<challenge_id>/<file>, plus
+#      the uploads kept in the blob store (blob_store.py) under such paths.
+#   2. Hash every file the journal (<store>.reindex.sqlite3) does not have
+#      yet on a spawn-based multiprocessing pool. Files are independent, so
+#      throughput grows with --workers up to the core count. Results are
+#      committed to the journal --chunk files at a time.
+#   3. Merge with the stored records. Their metadata (url, variants,
+#      institution_id, ...) is kept and hash, sha256 and file_size are
+#      replaced. Files without a record get one built from their path;
+#      records whose file is gone keep their old hash and are reported.
+#   4. Swap the merged records in with HashStore.replace_contents (one
+#      atomic step), then delete the journal.
+#
+# An interrupted run (Ctrl-C, crash, kill) resumes from the journal: only
+# the uncommitted chunk is hashed again. A journal made for another hash
+# schema (say, without --robust) is discarded.
+
+# Stored names start with the upload time, as written by build_record
+STORED_NAME = re.compile(r'^(\d{8}_\d{6}_\d{6})_')
+READ_CHUNK = 1024 * 1024
+
+JOURNAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS hashed (
+    path TEXT PRIMARY KEY,  -- relative to the uploads root, '/'-separated
+    hash TEXT,              -- JSON hash dict; NULL when hashing failed
+    sha256 TEXT,
+    file_size INTEGER,
+    error TEXT
+);
+"""
+
+
+def scan_uploads(root: str) -> list:
+    """[(student_id, challenge_id, relative_path)] for every stored upload."""
+    files = []
+    for student_id in sorted(os.listdir(root)):
+        student_dir = os.path.join(root, student_id)
+        if not os.path.isdir(student_dir):
+            continue
+        for challenge_dir in sorted(os.listdir(student_dir)):
+            path = os.path.join(student_dir, challenge_dir)
+            if not challenge_dir.startswith('challenge_') or not os.path.isdir(path):
+                continue
+            for name in sorted(os.listdir(path)):
+                if not name.startswith('.') and os.path.isfile(os.path.join(path, name)):
+                    files.append((student_id, challenge_dir[len('challenge_'):],
+                                  f"{student_id}/{challenge_dir}/{name}"))
+    return files
+
+
+def scan_blobs(blobs: str, storage: str) -> tuple:
+    """Uploads in the blob store: ([(student_id, challenge_id, relative_path)],
+    {relative_path: blob file}); empty when there is no blob index."""
+    if not os.path.exists(blob_index_path(storage)):
+        return [], {}
+    blob_store = BlobStore(blobs, blob_index_path(storage))
+    try:
+        sources = dict(blob_store.paths())
+    finally:
+        blob_store.close()
+    files = []
+    for relative_path in sources:
+        parts = relative_path.split('/')
+        if len(parts) == 3 and parts[1].startswith('challenge_'):
+            files.append((parts[0], parts[1][len('challenge_'):], relative_path))
+    return files, sources
+
+
+def hash_file(task: tuple) -> tuple:
+    """Pool job: (relative_path, absolute_path, robust) ->
+    (relative_path, hash JSON, sha256, file_size, error)."""
+    relative_path, absolute_path, robust = task
+    from .image_hash import compute_combined_hash, compute_robust_hash
+
+    try:
+        digest, size = hashlib.sha256(), 0
+        with open(absolute_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(READ_CHUNK), b''):
+                digest.update(chunk)
+                size += len(chunk)
+        new_hash = (compute_robust_hash if robust else compute_combined_hash)(absolute_path)
+    except Exception as e:
+        return relative_path, None, None, None, f"{type(e).__name__}: {e}"
+    return relative_path, json.dumps(new_hash), digest.hexdigest(), size, None
+
+
+def open_journal(path: str, schema: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    conn.executescript(JOURNAL_SCHEMA)
+    row = conn.execute("SELECT value FROM meta WHERE key = 'schema'").fetchone()
+    if row is None or row[0] != schema:
+        with conn:
+            conn.execute("DELETE FROM hashed")
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schema', ?)", (schema,))
+    return conn
+
+
+class Progress:
+    """Prints "hashed n/total" lines to stderr at most every interval seconds."""
+
+    def __init__(self, total: int, interval: float = 2.0):
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.started = self.last = time.monotonic()
+
+    def update(self, count: int = 1, final: bool = False) -> None:
+        self.done += count
+        now = time.monotonic()
+        if not final and now - self.last < self.interval:
+            return
+        self.last = now
+        rate = self.done / max(now - self.started, 1e-9)
+        eta = (self.total - self.done) / rate if rate else 0
+        print(f"hashed {self.done}/{self.total} ({self.done * 100 // max(self.total, 1)}%), "
+              f"{rate:.1f} files/s, ETA {eta:.0f} s", file=sys.stderr, flush=True)
+
+
+def hash_uploads(uploads: str, todo: list, journal: sqlite3.Connection, robust: bool,
+                 workers: int, chunk: int, sources: dict = None) -> None:
+    """Hash todo (relative paths) into the journal, chunk rows per commit.
+    sources maps relative paths stored outside the uploads tree to their file."""
+    def commit(rows):
+        with journal:
+            journal.executemany("INSERT OR REPLACE INTO hashed (path, hash, sha256, file_size, error) "
+                                "VALUES (?, ?, ?, ?, ?)", rows)
+
+    sources = sources or {}
+    tasks = [(path, sources.get(path) or os.path.join(uploads, *path.split('/')), robust) for path in todo]
+    progress, rows, pool = Progress(len(tasks)), [], None
+    try:
+        if workers > 1:
+            pool = multiprocessing.get_context('spawn').Pool(workers)
+            # Several files per message; small enough to keep every worker busy
+            results = pool.imap_unordered(hash_file, tasks, chunksize=max(1, min(16, len(tasks) // (workers * 8))))
+        else:
+            results = map(hash_file, tasks)
+        for row in results:
+            rows.append(row)
+            if len(rows) >= chunk:
+                commit(rows)
+                progress.update(len(rows))
+                rows = []
+    finally:
+        # Also on Ctrl-C: whatever was hashed is kept for the next run
+        if rows:
+            commit(rows)
+            progress.update(len(rows), final=True)
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+def record_from_path(student_id: str, challenge_id: str, relative_path: str, uploads: str,
+                     sources: dict = None) -> dict:
+    """Record for an upload the store has no entry for."""
+    filename = relative_path.rsplit('/', 1)[1]
+    stamp = STORED_NAME.match(filename)
+    if stamp:
+        uploaded_at = stamp.group(1)
+    else:
+        mtime = os.path.getmtime((sources or {}).get(relative_path)
+                                 or os.path.join(uploads, *relative_path.split('/')))
+        uploaded_at = datetime.utcfromtimestamp(mtime).strftime('%Y%m%d_%H%M%S_%f')
+    return {"challenge_id": challenge_id, "filename": filename, "relative_path": relative_path,
+            "url": f"/uploads/{relative_path}", "uploaded_at": uploaded_at}
+
+
+def merge_records(store, files: list, hashed: dict, uploads: str, sources: dict = None) -> tuple:
+    """(items for replace_contents, counts) from the stored records and the
+    journal's {relative_path: (hash, sha256, file_size)} for files that hashed."""
+    counts = {'rehashed': 0, 'added': 0, 'missing': 0, 'failed': 0}
+    on_disk = {relative_path for _, _, relative_path in files}
+    by_student = {}
+    for student_id, challenge_id, relative_path in files:
+        by_student.setdefault(student_id, []).append((challenge_id, relative_path))
+
+    items = []
+    for student_id in sorted(set(store.student_ids()) | set(by_student)):
+        seen = set()
+        for record in store.list_images(student_id):
+            path = record.get('relative_path') or f"{student_id}/challenge_{record['challenge_id']}/{record['filename']}"
+            seen.add(path)
+            if path in hashed:
+                new_hash, sha256, file_size = hashed[path]
+                record = {**record, "hash": new_hash, "sha256": sha256, "file_size": file_size}
+                counts['rehashed'] += 1
+            else:
+                counts['failed' if path in on_disk else 'missing'] += 1
+            items.append((student_id, record))
+        new_records = []
+        for challenge_id, path in by_student.get(student_id, []):
+            if path in seen or path not in hashed:
+                continue
+            new_hash, sha256, file_size = hashed[path]
+            record = record_from_path(student_id, challenge_id, path, uploads, sources)
+            new_records.append({**record, "file_size": file_size, "sha256": sha256, "hash": new_hash})
+        new_records.sort(key=lambda record: record['uploaded_at'])
+        counts['added'] += len(new_records)
+        counts['failed'] += sum(1 for _, path in by_student.get(student_id, []) if path not in hashed and path not in seen)
+        items.extend((student_id, record) for record in new_records)
+    return items, counts
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m ecolearn_core.reindex',
+        description="Re-hash every stored upload and atomically replace the hash store's records.")
+    parser.add_argument('--uploads', default=os.environ.get('UPLOAD_ROOT', 'uploads'),
+                        help='uploads root (default: $UPLOAD_ROOT or ./uploads)')
+    parser.add_argument('--storage', default=os.environ.get('STORAGE_DIR', 'storage'),
+                        help='storage directory holding the hash store (default: $STORAGE_DIR or ./storage)')
+    parser.add_argument('--blobs', default=os.environ.get('BLOB_ROOT', 'blobs'),
+                        help='blob store root, used when <storage>/blobs.sqlite3 exists (default: $BLOB_ROOT)')
+    parser.add_argument('--store', default=os.environ.get('HASH_STORE', 'sqlite'),
+                        choices=('sqlite', 'log', 'json', 'redis'), help='hash store kind (default: $HASH_STORE)')
+    parser.add_argument('--path', help='store file or Redis URL (default: derived from --store and --storage)')
+    parser.add_argument('--robust', action='store_true', default=os.environ.get('ROBUST_HASH', '0') == '1',
+                        help='hash as ROBUST_HASH=1 does (default: $ROBUST_HASH)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='hashing processes')
+    parser.add_argument('--chunk', type=int, default=256, help='files per journal commit')
+    parser.add_argument('--journal', help='resume journal (default: <store path>.reindex.sqlite3)')
+    parser.add_argument('--dry-run', action='store_true', help='hash and report, but leave the store as it is')
+    args = parser.parse_args(argv)
+
+    from .image_hash import HASH_SCHEMA, ROBUST_HASH_SCHEMA
+
+    schema = ROBUST_HASH_SCHEMA if args.robust else HASH_SCHEMA
+    if args.path is None:
+        args.path = (os.environ.get('REDIS_URL', 'redis://localhost:6379/0') if args.store == 'redis'
+                     else store_path(args.store, args.storage))
+    journal_path = args.journal or (os.path.join(args.storage, 'redis.reindex.sqlite3') if args.store == 'redis'
+                                    else f"{args.path}.reindex.sqlite3")
+    files, sources = scan_blobs(args.blobs, args.storage)
+    if not os.path.isdir(args.uploads) and not files:
+        parser.error(f"uploads root {args.uploads!r} does not exist")
+
+    if os.path.isdir(args.uploads):
+        files += [entry for entry in scan_uploads(args.uploads) if entry[2] not in sources]
+    journal = open_journal(journal_path, schema)
+    done = {row[0] for row in journal.execute("SELECT path FROM hashed WHERE error IS NULL")}
+    todo = [relative_path for _, _, relative_path in files if relative_path not in done]
+    print(f"{len(files)} uploads under {args.uploads}: {len(files) - len(todo)} already hashed "
+          f"(schema {schema}), {len(todo)} to hash with {args.workers} worker(s)", file=sys.stderr, flush=True)
+    start = time.monotonic()
+    try:
+        hash_uploads(args.uploads, todo, journal, args.robust, max(1, args.workers), max(1, args.chunk), sources)
+    except KeyboardInterrupt:
+        journal.close()
+        print(f"Interrupted; progress is saved in {journal_path}. Re-run the same command to resume.",
+              file=sys.stderr)
+        return 130
+    elapsed = time.monotonic() - start
+
+    hashed, errors = {}, []
+    for path, hash_json, sha256, file_size, error in journal.execute("SELECT * FROM hashed"):
+        if error is None:
+            hashed[path] = (json.loads(hash_json), sha256, file_size)
+        else:
+            errors.append((path, error))
+    journal.close()
+    for path, error in errors:
+        print(f"could not hash {path}: {error}", file=sys.stderr)
+
+    store = open_hash_store(args.store, args.path,
+                            legacy_json=os.path.join(args.storage, 'hashes.json') if args.store != 'json' else None)
+    items, counts = merge_records(store, files, hashed, args.uploads, sources)
+    print(f"hashed {len(todo)} files in {elapsed:.1f} s ({len(todo) / max(elapsed, 1e-9):.1f} files/s); "
+          f"records: {counts['rehashed']} re-hashed, {counts['added']} added for files without one, "
+          f"{counts['missing']} kept whose file is missing, {counts['failed']} failed to hash (kept as they were)")
+    if args.dry_run:
+        store.close()
+        print(f"Dry run: {args.path} left unchanged; the journal is kept for the real run.")
+        return 0
+    store.replace_contents(items)
+    store.close()
+    os.remove(journal_path)
+    print(f"Replaced the records of {args.path}: {len(items)} records, schema {schema}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,292 @@
+import os
+from functools import lru_cache
+
+from .hash_bits import popcount
+
+# Duplicate decisions per hash component. A combined hash is aHash + dHash +
+# pHash (3 x 64 bits); comparing it as one 192-bit number lets a single noisy
+# component decide, and a hash whose pHash failed ('' in hash_thumbnail) is
+# 128 bits long, so its aHash lands on the other's dHash. HashScorer splits
+# both hashes into components, measures each one separately, skips
+# components either side lacks, and applies one rule:
+#
+#   combined  sum of the component distances <= threshold (the original
+#             rule: with all three components it is the 192-bit distance)
+#   weighted  weighted mean of the component distances <= threshold
+#   vote      at least `votes` components within their own thresholds
+#
+# Anything taking a duplicate `threshold` (the stores, HashIndex.query,
+# is_duplicate) accepts either an int, meaning the combined rule, or a
+# HashScorer. The reported distance is always the bit distance over the
+# compared components. This module imports NumPy only for scan(), so the
+# stores load without it.
+
+COMPONENTS = ('aHash', 'dHash', 'pHash')
+RULES = ('combined', 'weighted', 'vote')
+_MASK = (1 << 64) - 1
+# Rows per step of scan(); it stops after the first step holding a match
+# when only the existence of a duplicate matters
+SCAN_BLOCK = 16384
+
+
+def has_phash(value) -> bool:
+    """Whether a hash dict, hex string, combined int or split_components
+    tuple includes a pHash. Dicts say so in their pHash field ('' when it
+    failed) and hex strings by their length: 48 digits, against 32 without
+    (stored hashes keep their leading zeros). An int carries no length, so
+    it counts as full only when it needs more than 128 bits; that misreads
+    full hashes whose aHash is 0, e.g. of flat or finely patterned images
+    (aHash = dHash = 0, and pHash has just the DC bit set), so pass the dict
+    or hex string where known.
+    """
+    if isinstance(value, tuple):
+        return value[2] is not None
+    if isinstance(value, dict):
+        if 'aHash' in value:
+            return bool(value.get('pHash'))
+        value = value['combined']
+    if isinstance(value, str):
+        return len(value) > 32
+    return value >> 128 != 0
+
+
+def component_hex(hash_dict: dict) -> str:
+    """Fixed-width hex of a hash dict's components, aHash + dHash + pHash
+    (pHash left out when missing), so that has_phash can tell from the length."""
+    if 'aHash' not in hash_dict:
+        return hash_dict['combined']
+    return hash_dict['aHash'] + hash_dict['dHash'] + (hash_dict.get('pHash') or '')
+
+
+def split_components(value, phash: bool = None) -> tuple:
+    """(aHash, dHash, pHash) ints of a combined hash given as a hash dict,
+    hex string or int; pHash is None when the hash was made without one.
+    phash overrides has_phash(value), for ints whose presence the caller
+    tracked itself. A tuple is taken as already split.
+    """
+    if isinstance(value, tuple):
+        return value
+    if phash is None:
+        phash = has_phash(value)
+    if isinstance(value, dict):
+        value = component_hex(value)
+    if isinstance(value, str):
+        value = int(value, 16)
+    if phash:
+        return value >> 128, (value >> 64) & _MASK, value & _MASK
+    return value >> 64, value & _MASK, None
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:  # pragma: no cover - exercised on minimal installs
+        return None
+    return numpy
+
+
+def pack_components(hashes: list):
+    """Pack hash dicts, hex strings or combined ints for scan(): a pair of
+    (n, 3) arrays, the uint64 components (aHash, dHash, pHash) and whether
+    each is present, when NumPy is installed, else a list of
+    split_components tuples. Whether a pHash is present comes from
+    has_phash, so hex strings must keep their leading zeros.
+    """
+    np = _numpy()
+    if np is None:
+        return [split_components(h) for h in hashes]
+    hashes = [component_hex(h) if isinstance(h, dict) else h for h in hashes]
+    full = np.fromiter((has_phash(h) for h in hashes), dtype=bool, count=len(hashes))
+    if all(isinstance(h, str) for h in hashes):
+        # Stored hex (the stores' scans): one fromhex for the whole column
+        buf = bytes.fromhex(''.join(h.rjust(48, '0') for h in hashes))
+        words = np.frombuffer(buf, dtype='>u8').reshape(-1, 3)[:, ::-1]
+    else:
+        values = [h if isinstance(h, int) else int(h, 16) for h in hashes]
+        words = np.frombuffer(b''.join(v.to_bytes(24, 'little') for v in values), dtype='<u8').reshape(-1, 3)
+    # Words lowest first: (pHash, dHash, aHash), or (dHash, aHash, 0) without a pHash
+    components = np.where(full[:, None], words[:, ::-1], np.column_stack((words[:, 1], words[:, 0], words[:, 2])))
+    present = np.ones((len(words), 3), dtype=bool)
+    present[:, 2] = full
+    return components.astype(np.uint64), present
+
+
+def _popcount_components(np, words):
+    """Bits set in each uint64 of words, as uint8 (at most 64 per component)."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    as_bytes = np.ascontiguousarray(words).view(np.uint8).reshape(words.shape + (8,))
+    return np.unpackbits(as_bytes, axis=-1).sum(axis=-1, dtype=np.uint8)
+
+
+class HashScorer:
+    """Duplicate rule over per-component Hamming distances.
+
+    rule: 'combined', 'weighted' or 'vote' (see above).
+    threshold: bits allowed by the combined rule, or the weighted mean
+    allowed per component by the weighted rule.
+    thresholds: per-component (aHash, dHash, pHash) limits for the vote rule.
+    weights: per-component weights for the weighted rule.
+    votes: components that must agree under the vote rule; when fewer are
+    present on both sides, all present ones must.
+    """
+
+    def __init__(self, rule: str = 'combined', threshold: float = 5, thresholds=(3, 3, 3),
+                 weights=(1, 1, 1), votes: int = 2):
+        if rule not in RULES:
+            raise ValueError(f"rule must be one of {RULES}, got {rule!r}")
+        if len(thresholds) != len(COMPONENTS) or len(weights) != len(COMPONENTS):
+            raise ValueError(f"thresholds and weights need one value per component {COMPONENTS}")
+        if min(weights) <= 0:
+            raise ValueError("weights must be positive")
+        if not 1 <= votes <= len(COMPONENTS):
+            raise ValueError(f"votes must be between 1 and {len(COMPONENTS)}")
+        self.rule = rule
+        self.threshold = threshold
+        self.thresholds = tuple(int(t) for t in thresholds)
+        self.weights = tuple(float(w) for w in weights)
+        self.votes = votes
+        self.indexable = self._band_bound() < 12
+
+    def _band_bound(self) -> float:
+        """Bits an accepted pair can differ by in the components that decided
+        it, relative to their share of the 12 16-bit bands of the combined
+        hash. Below 12, two duplicates always share a band exactly, so the
+        stores' band probes find every match (multi-index hashing)."""
+        if self.rule == 'combined':
+            return self.threshold
+        if self.rule == 'weighted':
+            return self.threshold * sum(self.weights) / min(self.weights)
+        # The loosest `votes` components, scaled to all 12 bands
+        loosest = sorted(self.thresholds)[-self.votes:]
+        return sum(loosest) * len(COMPONENTS) / self.votes
+
+    def __repr__(self):
+        if self.rule == 'combined':
+            return f"HashScorer('combined', threshold={self.threshold})"
+        if self.rule == 'weighted':
+            return f"HashScorer('weighted', threshold={self.threshold}, weights={self.weights})"
+        return f"HashScorer('vote', thresholds={self.thresholds}, votes={self.votes})"
+
+    def probes_bands(self, value) -> bool:
+        """Whether band probes for value (anything has_phash takes) find
+        every duplicate the rule accepts. Hashes without a pHash are banded
+        at other offsets, so they need a scan (as do stored ones, which only
+        scans find)."""
+        return self.indexable and has_phash(value)
+
+    def decide(self, distances) -> int:
+        """Bit distance over the present components of distances (one entry
+        per component, None where missing) if they make a duplicate, else None."""
+        shared = [(i, d) for i, d in enumerate(distances) if d is not None]
+        if not shared:
+            return None
+        total = sum(d for _, d in shared)
+        if self.rule == 'combined':
+            accepted = total <= self.threshold
+        elif self.rule == 'weighted':
+            accepted = (sum(self.weights[i] * d for i, d in shared)
+                        <= self.threshold * sum(self.weights[i] for i, _ in shared))
+        else:
+            agreeing = sum(d <= self.thresholds[i] for i, d in shared)
+            accepted = agreeing >= min(self.votes, len(shared))
+        return total if accepted else None
+
+    def score(self, new_hash, stored_hash) -> int:
+        """decide() for two hashes (dicts, hex strings, combined ints or
+        split_components tuples)."""
+        return self.decide([None if a is None or b is None else popcount(a ^ b)
+                            for a, b in zip(split_components(new_hash), split_components(stored_hash))])
+
+    def scan(self, target, packed, first: bool = False):
+        """(row, distance) of the closest duplicate of target in packed (from
+        pack_components), or None. All components of a block of rows are
+        XORed and popcounted at once; the scan stops at an exact match, or
+        with first=True at the first block holding any match.
+        """
+        if isinstance(packed, list):
+            target = split_components(target)
+            best = None
+            for row, components in enumerate(packed):
+                distance = self.decide([None if a is None or b is None else popcount(a ^ b)
+                                        for a, b in zip(target, components)])
+                if distance is not None and (best is None or distance < best[1]):
+                    best = (row, distance)
+                    if first or distance == 0:
+                        break
+            return best
+        np = _numpy()
+        words, present = packed
+        target = split_components(target)
+        target_words = np.array([c or 0 for c in target], dtype=np.uint64)
+        target_present = np.array([c is not None for c in target], dtype=bool)
+        # Usual case: every component on both sides, so nothing to mask
+        complete = bool(target_present.all() and present.all())
+        best = None
+        for start in range(0, len(words), SCAN_BLOCK):
+            distances = _popcount_components(np, words[start:start + SCAN_BLOCK] ^ target_words)
+            if complete:
+                shared = None
+            else:
+                shared = present[start:start + SCAN_BLOCK] & target_present
+                distances *= shared
+            total = distances.sum(axis=1, dtype=np.int32)
+            if self.rule == 'combined':
+                accepted = total <= self.threshold
+            elif self.rule == 'weighted':
+                weighted = distances @ np.array(self.weights)
+                allowed = self.threshold * (sum(self.weights) if complete else shared @ np.array(self.weights))
+                accepted = weighted <= allowed
+            else:
+                agreeing = distances <= np.array(self.thresholds, dtype=distances.dtype)
+                if complete:
+                    accepted = agreeing.sum(axis=1) >= self.votes
+                else:
+                    accepted = (agreeing & shared).sum(axis=1) >= np.minimum(self.votes, shared.sum(axis=1))
+            if not complete:
+                accepted &= shared.any(axis=1)
+            if not accepted.any():
+                continue
+            rows = np.flatnonzero(accepted)
+            row = int(rows[total[rows].argmin()])
+            if best is None or total[row] < best[1]:
+                best = (start + row, int(total[row]))
+            if first or best[1] == 0:
+                break
+        return best
+
+
+def as_scorer(threshold) -> HashScorer:
+    """HashScorer for a duplicate threshold: an int means the combined rule."""
+    if isinstance(threshold, HashScorer):
+        return threshold
+    return _combined_scorer(threshold)
+
+
+@lru_cache(maxsize=32)
+def _combined_scorer(threshold) -> HashScorer:
+    return HashScorer('combined', threshold)
+
+
+def _triple(text: str, name: str) -> tuple:
+    values = [float(part) for part in text.split(',')]
+    if len(values) != len(COMPONENTS):
+        raise ValueError(f"{name} needs {len(COMPONENTS)} comma-separated values (aHash,dHash,pHash)")
+    return tuple(values)
+
+
+def scorer_from_env(environ=os.environ) -> HashScorer:
+    """The duplicate rule configured by DUPLICATE_RULE (default combined),
+    DUPLICATE_THRESHOLD (5), DUPLICATE_WEIGHTS ("1,1,1"),
+    DUPLICATE_COMPONENT_THRESHOLDS ("3,3,3") and DUPLICATE_VOTES (2)."""
+    try:
+        return HashScorer(
+            rule=environ.get('DUPLICATE_RULE', 'combined'),
+            threshold=float(environ.get('DUPLICATE_THRESHOLD', 5)),
+            thresholds=_triple(environ.get('DUPLICATE_COMPONENT_THRESHOLDS', '3,3,3'),
+                               'DUPLICATE_COMPONENT_THRESHOLDS'),
+            weights=_triple(environ.get('DUPLICATE_WEIGHTS', '1,1,1'), 'DUPLICATE_WEIGHTS'),
+            votes=int(environ.get('DUPLICATE_VOTES', 2)),
+        )
+    except ValueError as e:
+        raise RuntimeError(f"Invalid duplicate scoring settings: {e}") from e
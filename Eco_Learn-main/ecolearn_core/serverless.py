@@ -0,0 +1,122 @@
+# Entry point for the Vercel functions in api/: one lazily opened hash store
+# plus the operations the handlers need. Importing this module loads only the
+# storage and listing code; PIL and NumPy are imported by compute_hash, i.e.
+# on the upload path, so /api/health and listing cold starts stay fast
+# (benchmarks/check_import_budget.py measures this).
+import json
+import os
+
+from .hash_store import DEDUP_SCOPES, find_crop_duplicate, open_hash_store, store_path
+from .listing import list_student_page
+from .scoring import scorer_from_env
+
+# With a Redis URL configured (REDIS_URL, or KV_URL from Vercel KV) every
+# instance shares one persistent store. Otherwise the store lives in /tmp:
+# shared by the functions of one instance, but lost on each cold start.
+REDIS_URL = os.environ.get('REDIS_URL') or os.environ.get('KV_URL')
+STORAGE_DIR = '/tmp'
+HASH_STORE = os.environ.get('HASH_STORE', 'redis' if REDIS_URL else 'sqlite')
+HASH_DB = REDIS_URL if HASH_STORE == 'redis' else store_path(HASH_STORE, STORAGE_DIR)
+# Pre-SQLite format: {"student_<id>": [record, ...]}
+LEGACY_HASH_FILE = os.path.join(STORAGE_DIR, 'hash_storage.json')
+# Which prior uploads a new proof is compared against, as in server/app.py
+DEDUP_SCOPE = os.environ.get('DEDUP_SCOPE', 'student')
+if DEDUP_SCOPE not in DEDUP_SCOPES:
+    raise RuntimeError(f"DEDUP_SCOPE must be one of {DEDUP_SCOPES}, got {DEDUP_SCOPE!r}")
+# Rotation/mirror/crop-robust hashing, as ROBUST_HASH in server/app.py. Must
+# match the server's setting when both share a store.
+ROBUST_HASH = os.environ.get('ROBUST_HASH', '0') == '1'
+ROBUST_CROP_THRESHOLD = int(os.environ.get('ROBUST_CROP_THRESHOLD', 20))
+# Near-duplicate rule (DUPLICATE_RULE, DUPLICATE_THRESHOLD, ...), read the
+# same way as by server/app.py; see ecolearn_core/scoring.py
+DUPLICATE_SCORER = scorer_from_env()
+
+_store = None
+
+
+def get_store():
+    """Open the shared hash store once per warm instance"""
+    global _store
+    if _store is None:
+        is_new = HASH_STORE != 'redis' and not os.path.exists(HASH_DB)
+        _store = open_hash_store(HASH_STORE, HASH_DB)
+        if is_new and os.path.exists(LEGACY_HASH_FILE):
+            migrate_legacy_storage(LEGACY_HASH_FILE, _store)
+    return _store
+
+
+def migrate_legacy_storage(path, store):
+    """Import records from the old hash_storage.json layout"""
+    try:
+        with open(path, 'r') as f:
+            legacy = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return 0
+    items = [
+        (student_key[len('student_'):], record)
+        for student_key, records in legacy.items()
+        for record in records
+    ]
+    store.add_images(items)
+    return len(items)
+
+
+def compute_hash(image, timings=None):
+    """compute_combined_hash (compute_robust_hash with ROBUST_HASH), importing
+    the imaging stack on first use"""
+    from .image_hash import compute_combined_hash, compute_robust_hash
+    return (compute_robust_hash if ROBUST_HASH else compute_combined_hash)(image, timings)
+
+
+def add_student_image(student_id, record):
+    """Add an image record for a student"""
+    return get_store().add_image(student_id, record)
+
+
+def add_student_image_if_unique(student_id, record, threshold=None):
+    """Atomically reject an in-scope duplicate or store the record.
+    threshold defaults to DUPLICATE_SCORER.
+    Returns (match, None) for duplicates, else (None, total images for student).
+    """
+    threshold = DUPLICATE_SCORER if threshold is None else threshold
+    return get_store().add_image_if_unique(student_id, record, threshold, DEDUP_SCOPE)
+
+
+def find_crop_match(student_id, new_hash):
+    """With ROBUST_HASH: a stored image of the student that new_hash is a
+    lightly cropped copy of, or its original; else None"""
+    if not ROBUST_HASH:
+        return None
+    candidates = [(student_id, record) for record in get_store().list_images(student_id)]
+    return find_crop_duplicate(new_hash, candidates, ROBUST_CROP_THRESHOLD, DEDUP_SCOPE)
+
+
+def find_image_by_digest(student_id, challenge_id, digest, institution_id=None):
+    """In-scope record with byte-identical content (sha256), or None"""
+    return get_store().find_by_digest(digest, DEDUP_SCOPE, student_id, challenge_id, institution_id)
+
+
+def get_student_images(student_id):
+    """Get all image records for a student"""
+    return get_store().list_images(student_id)
+
+
+def get_student_images_page(student_id, query):
+    """One page of a student's records for a parsed listing query (listing.py)"""
+    return list_student_page(get_store(), student_id, query)
+
+
+def get_student_image_count(student_id):
+    """How many records a student has, regardless of paging and filters"""
+    return get_store().count_images(student_id)
+
+
+def get_student_version(student_id):
+    """Per-student counter bumped on every insert; used for listing ETags"""
+    return get_store().student_version(student_id)
+
+
+def get_student_hashes(student_id):
+    """Get all hash data for duplicate detection"""
+    images = get_student_images(student_id)
+    return [img.get('hash', {}) for img in images]
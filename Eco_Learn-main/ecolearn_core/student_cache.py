@@ -0,0 +1,202 @@
+import threading
+import time
+from collections import OrderedDict
+
+from .hash_store import HashStore, match_payload
+from .scoring import as_scorer, pack_components
+from .metrics import REGISTRY
+
+# Bounded, in-process LRU cache of each student's records and packed hashes,
+# layered over any HashStore. The default dedup scope compares an upload
+# against one student's images, and listings read the same records, so a hot
+# student is served from memory instead of re-reading and re-parsing rows.
+#
+# Entries are stamped with HashStore.student_version. Every cached read
+# first re-reads that counter (one primary-key lookup), so inserts made by
+# other uvicorn workers or processes invalidate the entry on next use. The
+# version is read before the records, so a racing insert can only make an
+# entry look older than it is, never newer. Successful inserts through this
+# wrapper are written through when the version moved by exactly their count.
+# The insert itself, including the atomic duplicate re-check, always goes to
+# the underlying store.
+#
+# A linear popcount scan over the packed array beats the store's band index
+# only for small sets (about 1k hashes with SQLite), so students above
+# scan_limit records still get their duplicate checks from the store.
+
+CACHE_HITS = REGISTRY.counter(
+    'eco_student_cache_hits_total', 'Student cache lookups served from memory')
+CACHE_MISSES = REGISTRY.counter(
+    'eco_student_cache_misses_total', 'Student cache lookups that reloaded from storage', ('reason',))
+CACHE_EVICTIONS = REGISTRY.counter(
+    'eco_student_cache_evictions_total', 'Students dropped from the cache to stay within its size')
+
+
+class _Entry:
+    __slots__ = ('version', 'records', 'packed', 'loaded_at')
+
+    def __init__(self, version: int, records: list):
+        self.version = version
+        self.records = records
+        self.packed = None  # pack_components(records), built on first duplicate check
+        self.loaded_at = time.monotonic()
+
+    def packed_hashes(self):
+        if self.packed is None:
+            self.packed = pack_components([record['hash'] for record in self.records])
+        return self.packed
+
+
+class CachedHashStore(HashStore):
+    """HashStore wrapper caching up to max_students students for ttl seconds.
+    Anything not answerable from one student's records is delegated.
+    """
+
+    def __init__(self, store: HashStore, max_students: int = 1024, ttl: float = 300.0,
+                 scan_limit: int = 1024):
+        self.store = store
+        self.max_students = max_students
+        self.ttl = ttl
+        self.scan_limit = scan_limit
+        self._entries = OrderedDict()  # student_id -> _Entry, least recent first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _entry(self, student_id: str) -> _Entry:
+        version = self.store.student_version(student_id)
+        with self._lock:
+            entry = self._entries.get(student_id)
+            if entry is not None:
+                if entry.version != version:
+                    reason = 'stale'
+                elif time.monotonic() - entry.loaded_at > self.ttl:
+                    reason = 'expired'
+                else:
+                    self._entries.move_to_end(student_id)
+                    CACHE_HITS.inc()
+                    return entry
+            else:
+                reason = 'absent'
+        CACHE_MISSES.inc(reason=reason)
+        entry = _Entry(version, self.store.list_images(student_id))
+        with self._lock:
+            current = self._entries.get(student_id)
+            if current is None or current.version <= version:
+                self._entries[student_id] = entry
+                self._entries.move_to_end(student_id)
+            while len(self._entries) > self.max_students:
+                self._entries.popitem(last=False)
+                CACHE_EVICTIONS.inc()
+        return entry
+
+    def _write_through(self, student_id: str, records: list) -> None:
+        if not records:
+            return
+        with self._lock:
+            entry = self._entries.get(student_id)
+            if entry is None:
+                return
+        version = self.store.student_version(student_id)
+        with self._lock:
+            if self._entries.get(student_id) is not entry:
+                return
+            if version == entry.version + len(records):
+                entry.records = entry.records + records
+                entry.packed = None
+                entry.version = version
+            else:
+                # Someone else wrote too; reload on next use
+                del self._entries[student_id]
+
+    def invalidate(self, student_id: str = None) -> None:
+        with self._lock:
+            if student_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(student_id, None)
+
+    @staticmethod
+    def _student_scoped(scope: str, institution_id: str = None) -> bool:
+        # Mirrors in_scope: 'institution' without an id falls back to 'student'
+        return scope == 'student' or (scope == 'institution' and not institution_id)
+
+    def list_images(self, student_id: str) -> list:
+        return list(self._entry(student_id).records)
+
+    def count_images(self, student_id: str = None) -> int:
+        return self.store.count_images(student_id)
+
+    def list_images_page(self, student_id, cursor=None, limit=None, challenge_id=None, since=None, until=None):
+        if cursor is not None or limit is not None:
+            # Cursor formats are backend specific; pages come from the store
+            return self.store.list_images_page(student_id, cursor, limit, challenge_id, since, until)
+        records = [
+            record for record in self._entry(student_id).records
+            if (challenge_id is None or record.get('challenge_id') == challenge_id)
+            and (since is None or record.get('uploaded_at', '') >= since)
+            and (until is None or record.get('uploaded_at', '') < until)
+        ]
+        return records, None
+
+    def student_version(self, student_id: str) -> int:
+        return self.store.student_version(student_id)
+
+    def find_duplicate(self, new_hash, threshold, scope, student_id, challenge_id, institution_id=None):
+        if not self._student_scoped(scope, institution_id):
+            return self.store.find_duplicate(new_hash, threshold, scope, student_id, challenge_id, institution_id)
+        entry = self._entry(student_id)
+        if not entry.records:
+            return None
+        if len(entry.records) > self.scan_limit:
+            return self.store.find_duplicate(new_hash, threshold, scope, student_id, challenge_id, institution_id)
+        best = as_scorer(threshold).scan(new_hash, entry.packed_hashes())
+        if best is None:
+            return None
+        row, distance = best
+        return match_payload(student_id, entry.records[row], distance, scope)
+
+    def find_by_digest(self, digest, scope, student_id, challenge_id, institution_id=None):
+        if not self._student_scoped(scope, institution_id):
+            return self.store.find_by_digest(digest, scope, student_id, challenge_id, institution_id)
+        for record in self._entry(student_id).records:
+            if record.get('sha256') == digest:
+                return match_payload(student_id, record, 0, scope)
+        return None
+
+    def add_image(self, student_id: str, record: dict) -> int:
+        count = self.store.add_image(student_id, record)
+        self._write_through(student_id, [record])
+        return count
+
+    def add_images(self, items: list) -> None:
+        self.store.add_images(items)
+        self.invalidate()
+
+    def add_image_if_unique(self, student_id: str, record: dict, threshold: int, scope: str):
+        match, count = self.store.add_image_if_unique(student_id, record, threshold, scope)
+        if match is None:
+            self._write_through(student_id, [record])
+        return match, count
+
+    def add_images_if_unique(self, items: list, threshold: int, scope: str) -> list:
+        matches = self.store.add_images_if_unique(items, threshold, scope)
+        accepted = {}
+        for (student_id, record), match in zip(items, matches):
+            if match is None:
+                accepted.setdefault(student_id, []).append(record)
+        for student_id, records in accepted.items():
+            self._write_through(student_id, records)
+        return matches
+
+    def student_ids(self) -> list:
+        return self.store.student_ids()
+
+    def replace_contents(self, items: list) -> None:
+        self.store.replace_contents(items)
+        self.invalidate()
+
+    def close(self) -> None:
+        self.invalidate()
+        self.store.close()
@@ -0,0 +1,42 @@
+import asyncio
+import hashlib
+import os
+
+# Copies an UploadFile to disk in fixed-size chunks, so reading it back
+# holds at most CHUNK_SIZE in memory. By the time a handler runs, Starlette
+# has already parsed the whole multipart body into the UploadFile's spooled
+# temp file; the request-wide size cap is applied earlier, as the body
+# streams in (LimitUploadBodies in server/app.py), and max_bytes here caps
+# each file. Disk writes run in the default thread pool to keep the event
+# loop free, and a SHA-256 digest of the raw bytes is computed along the way.
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised once more than max_bytes have been received."""
+
+
+async def spool_upload(upload, dest_path: str, max_bytes: int, chunk_size: int = CHUNK_SIZE):
+    """Copy upload into dest_path; returns (size_in_bytes, sha256_hex).
+    dest_path is removed if the upload exceeds max_bytes or copying fails.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    out = await asyncio.to_thread(open, dest_path, 'wb')
+    try:
+        while True:
+            chunk = await upload.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge()
+            digest.update(chunk)
+            await asyncio.to_thread(out.write, chunk)
+    except BaseException:
+        await asyncio.to_thread(out.close)
+        os.remove(dest_path)
+        raise
+    await asyncio.to_thread(out.close)
+    return size, digest.hexdigest()
@@ -1,16 +1,32 @@
+import asyncio
+import mimetypes
 import os
-import json
+import shutil
+import sys
+import time
+import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime
-from fastapi import FastAPI, File, UploadFile, Form
-from fastapi.responses import JSONResponse
+from functools import partial
+from typing import List
+from fastapi import FastAPI, File, HTTPException, UploadFile, Form, Request
+from fastapi.responses import JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-
-# Add server directory to path for local imports
-import sys
-import os
-sys.path.append(os.path.dirname(__file__))
-from utils.image_hash import compute_combined_hash, is_duplicate
+from starlette.datastructures import Headers
+from PIL import Image, UnidentifiedImageError
+from ecolearn_core.image_hash import crop_distance, hash_upload
+from ecolearn_core.blob_store import BlobStore, blob_index_path
+from ecolearn_core.derivatives import DEFAULT_FORMATS, parse_widths, render_derivatives, variant_name
+from ecolearn_core.hash_store import DEDUP_SCOPES, find_crop_duplicate, open_hash_store, scope_key, store_path
+from ecolearn_core.keyed_lock import KeyedLocks
+from ecolearn_core.scoring import scorer_from_env
+from ecolearn_core.student_cache import CachedHashStore
+from ecolearn_core.hash_pool import HashPool, HashPoolSaturated
+from ecolearn_core.job_queue import RetryLater, open_job_queue
+from ecolearn_core.upload_stream import UploadTooLarge, spool_upload
+from ecolearn_core.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, StageTimer
+from ecolearn_core.listing import ListingQueryError, etag_matches, list_student_page, listing_etag, parse_listing_query
 
 # FastAPI application setup
 app = FastAPI(title="Eco Learn Challenge Proof API", version="1.0.0")
@@ -25,30 +41,186 @@ app.add_middleware(
 )
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-STORAGE_DIR = os.path.join(BASE_DIR, 'storage')
-UPLOAD_ROOT = os.path.join(BASE_DIR, 'uploads')
+STORAGE_DIR = os.environ.get('STORAGE_DIR', os.path.join(BASE_DIR, 'storage'))
+UPLOAD_ROOT = os.environ.get('UPLOAD_ROOT', os.path.join(BASE_DIR, 'uploads'))
 HASH_FILE = os.path.join(STORAGE_DIR, 'hashes.json')
+# Uploads are spooled here first, then moved into UPLOAD_ROOT once accepted
+INCOMING_DIR = os.path.join(STORAGE_DIR, 'incoming')
+# Resized WebP/JPEG copies of each upload, served from /variants
+DERIVATIVE_ROOT = os.environ.get('DERIVATIVE_ROOT', os.path.join(BASE_DIR, 'derivatives'))
+# UPLOAD_STORAGE=blobs (default) stores each distinct original once under
+# BLOB_ROOT, keyed by its SHA-256, and serves it at the record's usual
+# /uploads/<relative_path> URL through the index in storage/blobs.sqlite3
+# (see ecolearn_core/blob_store.py). Files already in the uploads tree are
+# still served from there. UPLOAD_STORAGE=tree writes the tree as before.
+UPLOAD_STORAGE = os.environ.get('UPLOAD_STORAGE', 'blobs')
+if UPLOAD_STORAGE not in ('blobs', 'tree'):
+    raise RuntimeError(f"UPLOAD_STORAGE must be 'blobs' or 'tree', got {UPLOAD_STORAGE!r}")
+BLOB_ROOT = os.environ.get('BLOB_ROOT', os.path.join(BASE_DIR, 'blobs'))
+
+# Largest accepted image; enforced while streaming. The request-level check
+# allows some slack for the multipart envelope and form fields.
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 20 * 1024 * 1024))
+# Limits under 1 MiB are reported in bytes; whole megabytes would say "max 0 MB"
+TOO_LARGE_ERROR = (f"File too large (max {MAX_UPLOAD_BYTES / (1024 * 1024):.1f} MB)"
+                   if MAX_UPLOAD_BYTES >= 1024 * 1024 else f"File too large (max {MAX_UPLOAD_BYTES} bytes)")
+MULTIPART_OVERHEAD = 64 * 1024
+# Most files accepted by one /upload-challenge-proofs request
+MAX_BATCH_FILES = int(os.environ.get('MAX_BATCH_FILES', 20))
+
+# Storage backend: 'sqlite' (default), 'log' (append-only JSONL + snapshots),
+# the legacy 'json' file, or 'redis' (the server at REDIS_URL, shared by every
+# instance). New sqlite/log stores are seeded from hashes.json.
+# See ecolearn_core/hash_store.py.
+HASH_STORE = os.environ.get('HASH_STORE', 'sqlite')
+HASH_STORE_PATH = (os.environ.get('REDIS_URL', 'redis://localhost:6379/0') if HASH_STORE == 'redis'
+                   else store_path(HASH_STORE, STORAGE_DIR))
+
+# Which prior uploads a new proof is compared against; see DEDUP_SCOPES.
+DEDUP_SCOPE = os.environ.get('DEDUP_SCOPE', 'student')
+if DEDUP_SCOPE not in DEDUP_SCOPES:
+    raise RuntimeError(f"DEDUP_SCOPE must be one of {DEDUP_SCOPES}, got {DEDUP_SCOPE!r}")
+# Near-duplicate rule: DUPLICATE_RULE is 'combined' (default: at most
+# DUPLICATE_THRESHOLD=5 differing bits over aHash + dHash + pHash),
+# 'weighted' or 'vote', scored per component. See ecolearn_core/scoring.py
+# and benchmarks/eval_scoring.py for the settings and how they compare.
+DUPLICATE_SCORER = scorer_from_env()
+
+# ROBUST_HASH=1 hashes uploads in their canonical orientation (EXIF applied;
+# rotated and mirrored copies hash alike) and also rejects lightly cropped
+# copies of the uploader's own images within ROBUST_CROP_THRESHOLD bits. See
+# compute_robust_hash in ecolearn_core/image_hash.py. Stored records keep the
+# hashes they were created with, so enable it on a fresh store or re-hash.
+ROBUST_HASH = os.environ.get('ROBUST_HASH', '0') == '1'
+ROBUST_CROP_THRESHOLD = int(os.environ.get('ROBUST_CROP_THRESHOLD', 20))
+
+# Per-worker LRU cache of students' records and packed hashes (see
+# ecolearn_core/student_cache.py); STUDENT_CACHE_SIZE=0 turns it off.
+STUDENT_CACHE_SIZE = int(os.environ.get('STUDENT_CACHE_SIZE', 1024))
+STUDENT_CACHE_TTL = float(os.environ.get('STUDENT_CACHE_TTL', 300))
+
+# Widths of the derivatives rendered for every upload ("" disables them).
+# Stored files never change, so variants are cached by clients for a year.
+DERIVATIVE_WIDTHS = parse_widths(os.environ.get('DERIVATIVE_WIDTHS', '320,640'))
+VARIANT_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Worker job on the request path: hashing only; derivatives are rendered by
+# a background job once the record is committed
+process_upload = partial(hash_upload, robust=ROBUST_HASH)
+# What a bad upload raises in the worker (400). Anything else, such as a
+# broken process pool, a pickling error or MemoryError, is a server error
+IMAGE_DECODE_ERRORS = (UnidentifiedImageError, OSError, ValueError, Image.DecompressionBombError)
+
+# Hashing runs off the event loop: HASH_EXECUTOR is 'process' (default),
+# 'thread' or 'inline'. HASH_WORKERS defaults to the CPU count and
+# HASH_MAX_PENDING (queued + running, default 4x workers) bounds the queue;
+# beyond it uploads get 503 + Retry-After instead of piling up.
+hash_pool = HashPool(
+    kind=os.environ.get('HASH_EXECUTOR', 'process'),
+    workers=int(os.environ.get('HASH_WORKERS', 0)) or None,
+    max_pending=int(os.environ.get('HASH_MAX_PENDING', 0)) or None,
+)
 
 os.makedirs(STORAGE_DIR, exist_ok=True)
+os.makedirs(INCOMING_DIR, exist_ok=True)
 os.makedirs(UPLOAD_ROOT, exist_ok=True)
+os.makedirs(DERIVATIVE_ROOT, exist_ok=True)
+blob_store = BlobStore(BLOB_ROOT, blob_index_path(STORAGE_DIR)) if UPLOAD_STORAGE == 'blobs' else None
+
+# Background jobs (see ecolearn_core/job_queue.py) for work that follows an
+# accepted upload, currently rendering its derivatives. JOB_STORE is 'memory'
+# (default; a worker's jobs are lost if it dies) or 'sqlite' (JOB_DB, committed
+# before the upload response, shared by the workers and resumed after a
+# restart). JOB_WORKERS tasks per process run jobs, each tried up to
+# JOB_MAX_ATTEMPTS times; DERIVATIVE_CONCURRENCY caps the render jobs using
+# the hash pool at once (default half of it, leaving room for uploads).
+# Shutdown waits up to JOB_DRAIN_TIMEOUT seconds for running jobs.
+JOB_STORE = os.environ.get('JOB_STORE', 'memory')
+JOB_DB = os.environ.get('JOB_DB', os.path.join(STORAGE_DIR, 'jobs.sqlite3'))
+JOB_DRAIN_TIMEOUT = float(os.environ.get('JOB_DRAIN_TIMEOUT', 30))
+DERIVATIVE_CONCURRENCY = int(os.environ.get('DERIVATIVE_CONCURRENCY', 0)) or max(1, hash_pool.workers // 2)
+job_queue = open_job_queue(JOB_STORE, JOB_DB, workers=int(os.environ.get('JOB_WORKERS', 4)),
+                           max_attempts=int(os.environ.get('JOB_MAX_ATTEMPTS', 3)))
+
+
+class VariantFiles(StaticFiles):
+    """StaticFiles (ETag / If-None-Match -> 304 included) plus long-lived caching."""
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers['Cache-Control'] = VARIANT_CACHE_CONTROL
+        return response
+
+
+class UploadFiles(StaticFiles):
+    """The uploads tree, with paths mapped in the blob store served from their blob."""
+
+    def lookup_path(self, path: str):
+        blob = blob_store.resolve(path) if blob_store else None
+        if blob:
+            try:
+                return blob, os.stat(blob)
+            except FileNotFoundError:
+                pass
+        return super().lookup_path(path)
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        # Blob names have no extension, so the type comes from the URL
+        media_type, _ = mimetypes.guess_type(scope['path'])
+        if media_type and response.status_code != 304:
+            response.headers['content-type'] = media_type
+        return response
+
 
 # Mount uploads as static for direct access (demo only; protect in production)
-app.mount('/uploads', StaticFiles(directory=UPLOAD_ROOT), name='uploads')
+app.mount('/uploads', UploadFiles(directory=UPLOAD_ROOT), name='uploads')
+app.mount('/variants', VariantFiles(directory=DERIVATIVE_ROOT), name='variants')
+
+store = open_hash_store(HASH_STORE, HASH_STORE_PATH, legacy_json=HASH_FILE)
+if STUDENT_CACHE_SIZE > 0:
+    store = CachedHashStore(store, max_students=STUDENT_CACHE_SIZE, ttl=STUDENT_CACHE_TTL)
+
+# Per-worker locks that serialise uploads which could conflict: the same
+# bytes for the same dedup scope (digest_locks, held while hashing), and the
+# duplicate check + file move + insert for one scope (scope_locks). Other
+# workers are excluded by the store itself: SQLite BEGIN IMMEDIATE, the log
+# and json stores' lock file, Redis WATCH/MULTI.
+digest_locks = KeyedLocks()
+scope_locks = KeyedLocks()
 
-# Initialize hash file if missing
-if not os.path.exists(HASH_FILE):
-    with open(HASH_FILE, 'w', encoding='utf-8') as f:
-        json.dump({"students": {}}, f, indent=2)
+DIGEST_LOOKUPS = REGISTRY.counter(
+    'eco_upload_digest_lookups_total', 'Uploads checked against the exact-bytes SHA-256 index')
+DIGEST_SHORT_CIRCUITS = REGISTRY.counter(
+    'eco_upload_digest_short_circuits_total', 'Uploads rejected as exact duplicates without decoding the image')
 
+# Per-stage upload latency. Stages: parse (multipart parsing before the
+# handler runs), spool, lock_wait (queued behind a conflicting upload in this
+# worker), digest_lookup, hash_wait (pool queue + transfer), decode, aHash,
+# dHash, pHash, robust (ROBUST_HASH only; these run in the worker), dedup,
+# file_move, store_write (for HASH_STORE=json: the JSON load/save) and total.
+# Derivatives are rendered afterwards, as jobs (eco_job_seconds).
+UPLOAD_STAGE_SECONDS = REGISTRY.histogram(
+    'eco_upload_stage_seconds', 'Time spent in each stage of handling an upload', ('stage',))
+# Per file: accepted, duplicate, invalid, too_large, busy or error
+UPLOAD_RESULTS = REGISTRY.counter(
+    'eco_upload_results_total', 'Uploaded files by outcome', ('endpoint', 'result'))
+RESULT_BY_STATUS = {200: 'accepted', 409: 'duplicate', 400: 'invalid', 413: 'too_large', 503: 'busy'}
+UPLOAD_ENDPOINTS = {'/upload-challenge-proof': 'single', '/upload-challenge-proofs': 'batch'}
+# SERVER_TIMING=1 adds a Server-Timing header with the stage durations to
+# upload responses (visible in browser dev tools)
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
 
-def load_hash_db():
-    with open(HASH_FILE, 'r', encoding='utf-8') as f:
-        return json.load(f)
 
+def hash_store_bytes() -> int:
+    """On-disk size of the hash store, including its WAL or snapshot."""
+    return sum(os.path.getsize(path) for path in (HASH_STORE_PATH, f"{HASH_STORE_PATH}-wal",
+                                                   f"{HASH_STORE_PATH}.snapshot")
+               if os.path.exists(path))
 
-def save_hash_db(data):
-    with open(HASH_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2)
+
+REGISTRY.gauge('eco_hash_store_images', 'Image records in the hash store', lambda: store.count_images())
+REGISTRY.gauge('eco_hash_store_bytes', 'Size of the hash store files on disk', hash_store_bytes)
+REGISTRY.gauge('eco_jobs_pending', 'Background jobs queued or running', lambda: job_queue.pending())
 
 
 def record_relative_path(rel_dir: str, filename: str) -> str:
@@ -58,68 +230,541 @@ def record_relative_path(rel_dir: str, filename: str) -> str:
 
 @app.post("/upload-challenge-proof")
 async def upload_challenge_proof(
+    request: Request,
     student_id: str = Form(...),
     challenge_id: str = Form(...),
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
+    institution_id: str = Form(None)
 ):
     """Upload endpoint for challenge proof images.
     Process:
-      1. Read bytes, compute perceptual hashes.
-      2. Compare with existing for that student (any challenge) using Hamming distance <= 5.
-      3. If duplicate -> reject.
-      4. Else save file under uploads/<student_id>/challenge_<challenge_id>/timestamp_filename
-      5. Record hash & metadata in hashes.json
+      1. Stream the upload to a staging file in chunks (SHA-256 computed on
+         the way, MAX_UPLOAD_BYTES enforced). Identical bytes already stored in
+         scope are rejected right away; otherwise hash from disk.
+      2. Compare with prior uploads in DEDUP_SCOPE (default: same student, any
+         challenge) via the hash store's band index, Hamming distance <= 5.
+         With ROBUST_HASH, also against crops of the student's own images.
+      3. If duplicate -> reject with the matched record and its distance.
+      4. Else move file to uploads/<student_id>/challenge_<challenge_id>/timestamp_filename
+      5. Record hash & metadata in the hash store; the duplicate check is
+         repeated inside the insert transaction so concurrent uploads of the
+         same image cannot both be accepted, even from other workers. Within
+         this worker, steps 2-5 hold a per-scope lock and identical bytes wait
+         for each other before step 1's digest lookup, so they are hashed once.
+      6. Respond once the record is committed. The DERIVATIVE_WIDTHS
+         thumbnails (record["variants"]) are rendered by a background job,
+         whose id comes back as job_id (GET /jobs/{job_id}).
+    Stage timings go to /metrics (and Server-Timing); see time_uploads.
     """
+    timer = request.state.timer
+    timer.record('parse', timer.elapsed())
     # Basic content-type guard
     if not file.content_type.startswith('image/'):
         return JSONResponse(status_code=400, content={"error": "Only image uploads are allowed"})
 
-    contents = await file.read()
+    staging_path = os.path.join(INCOMING_DIR, f"{uuid.uuid4().hex}.part")
+    try:
+        with timer.stage('spool'):
+            file_size, digest = await spool_upload(file, staging_path, MAX_UPLOAD_BYTES)
+    except UploadTooLarge:
+        return upload_too_large_response()
     try:
-        new_hash = compute_combined_hash(contents)
-    except Exception as e:
-        return JSONResponse(status_code=400, content={"error": f"Invalid image file: {e}"})
+        return await ingest_upload(staging_path, file.filename, file_size, digest,
+                                   student_id, challenge_id, institution_id, timer)
+    finally:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+
 
-    db = load_hash_db()
-    student_entry = db.setdefault('students', {}).setdefault(student_id, {"images": []})
-    existing_hashes = [img['hash'] for img in student_entry['images']]
+async def ingest_upload(staging_path: str, filename: str, file_size: int, digest: str,
+                        student_id: str, challenge_id: str, institution_id: str = None,
+                        timer: StageTimer = None):
+    """Hash a spooled upload and store it unless it is a duplicate."""
+    timer = timer or StageTimer()
+    key = scope_key(DEDUP_SCOPE, student_id, challenge_id, institution_id)
+    # Copies of the same bytes arriving together queue here, so only the
+    # first is hashed; the rest hit the digest index once it is committed
+    async with hold_lock(digest_locks, (key, digest), timer):
+        # Fast path: resubmitting the exact same file needs no decode at all
+        DIGEST_LOOKUPS.inc()
+        with timer.stage('digest_lookup'):
+            match = await asyncio.to_thread(store.find_by_digest, digest, DEDUP_SCOPE,
+                                            student_id, challenge_id, institution_id)
+        if match:
+            DIGEST_SHORT_CIRCUITS.inc()
+            return JSONResponse(status_code=409, content={"error": "Duplicate image detected", "match": match})
 
-    if is_duplicate(new_hash, existing_hashes, threshold=5):
-        return JSONResponse(status_code=409, content={"error": "Duplicate image detected"})
+        try:
+            # Only the path crosses into the worker; PIL reads just what decode needs
+            start = time.perf_counter()
+            new_hash, worker_timings = await hash_pool.run(process_upload, staging_path)
+            record_worker_stages(timer, time.perf_counter() - start, worker_timings)
+        except HashPoolSaturated:
+            return JSONResponse(status_code=503, headers={"Retry-After": "1"},
+                                content={"error": "Server is busy processing other uploads, please retry"})
+        except UnidentifiedImageError:
+            # PIL's message would expose the staging path
+            return JSONResponse(status_code=400, content={"error": "Invalid image file: cannot identify image file"})
+        except IMAGE_DECODE_ERRORS as e:
+            return JSONResponse(status_code=400, content={"error": f"Invalid image file: {e}"})
 
-    # Not duplicate -> persist
+        # Check, move and insert as one step per dedup scope in this
+        # worker; the store's transaction covers the other workers
+        async with hold_lock(scope_locks, key, timer):
+            with timer.stage('dedup'):
+                match = await asyncio.to_thread(find_stored_duplicate, new_hash,
+                                                student_id, challenge_id, institution_id)
+            if match:
+                return JSONResponse(status_code=409, content={"error": "Duplicate image detected", "match": match})
+
+            # Not duplicate -> persist
+            record = await asyncio.to_thread(build_record, student_id, challenge_id, filename, file_size,
+                                             digest, new_hash, institution_id)
+            try:
+                with timer.stage('file_move'):
+                    await asyncio.to_thread(place_upload, staging_path, record)
+                with timer.stage('store_write'):
+                    match, _ = await asyncio.to_thread(store.add_image_if_unique, student_id, record,
+                                                       DUPLICATE_SCORER, DEDUP_SCOPE)
+            except BaseException:
+                await discard_uploads([record])
+                raise
+            if match:
+                await asyncio.to_thread(remove_upload, record)
+                return JSONResponse(status_code=409, content={"error": "Duplicate image detected", "match": match})
+
+    # Committed; everything else happens in the background
+    return accepted_response({"success": True, "record": record}, await enqueue_derivatives(record))
+
+
+def find_stored_duplicate(new_hash: dict, student_id: str, challenge_id: str, institution_id: str = None):
+    """The stored record new_hash duplicates within the dedup scope (or, in
+    robust mode, crops), else None. Blocking: callers run it in a thread."""
+    return (store.find_duplicate(new_hash, DUPLICATE_SCORER, DEDUP_SCOPE, student_id, challenge_id, institution_id)
+            or find_crop_match(student_id, new_hash))
+
+
+def find_crop_match(student_id: str, new_hash: dict):
+    """Robust mode: a stored image of this student that new_hash is a lightly
+    cropped copy of (or the original of), else None. Scans the student's own
+    records, which the student cache usually holds in memory."""
+    if not ROBUST_HASH:
+        return None
+    candidates = [(student_id, record) for record in store.list_images(student_id)]
+    return find_crop_duplicate(new_hash, candidates, ROBUST_CROP_THRESHOLD, DEDUP_SCOPE)
+
+
+@asynccontextmanager
+async def hold_lock(locks: KeyedLocks, key, timer: StageTimer):
+    """Hold locks[key], recording the time spent waiting as lock_wait."""
+    start = time.perf_counter()
+    async with locks.hold(key):
+        timer.record('lock_wait', time.perf_counter() - start)
+        yield
+
+
+def record_worker_stages(timer: StageTimer, round_trip: float, worker_timings: dict) -> None:
+    """Add the stages timed inside the hashing worker, plus the time spent
+    queueing and shipping the job (round trip minus worker time)."""
+    timer.record('hash_wait', max(0.0, round_trip - sum(worker_timings.values())))
+    for name, seconds in worker_timings.items():
+        timer.record(name, seconds)
+
+
+def build_record(student_id: str, challenge_id: str, filename: str, file_size: int, digest: str,
+                 new_hash: dict, institution_id: str = None) -> dict:
+    """Pick the stored path (and public URL) for an accepted upload and the
+    URLs its derivatives will have once rendered. Blocking (it checks the
+    blob index for a free path)."""
     timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S_%f')
-    safe_name = file.filename.replace(' ', '_')
+    safe_name = filename.replace(' ', '_')
     rel_dir = os.path.join(student_id, f"challenge_{challenge_id}")
-    abs_dir = os.path.join(UPLOAD_ROOT, rel_dir)
-    os.makedirs(abs_dir, exist_ok=True)
     stored_filename = f"{timestamp}_{safe_name}"
-    abs_path = os.path.join(abs_dir, stored_filename)
-    with open(abs_path, 'wb') as out:
-        out.write(contents)
+    suffix = 1
+    # same name within one microsecond (batches)
+    while upload_exists(record_relative_path(rel_dir, stored_filename)):
+        stored_filename = f"{timestamp}_{suffix}_{safe_name}"
+        suffix += 1
 
     rel_path_norm = record_relative_path(rel_dir, stored_filename)
     public_url = f"/uploads/{rel_path_norm}"
+    variant_urls = {str(width): {fmt: f"/variants/{variant_name(rel_path_norm, width, fmt)}"
+                                 for fmt in DEFAULT_FORMATS}
+                    for width in DERIVATIVE_WIDTHS}
     record = {
         "challenge_id": challenge_id,
         "filename": stored_filename,
         "relative_path": rel_path_norm,
         "url": public_url,
         "uploaded_at": timestamp,
+        "file_size": file_size,
+        "sha256": digest,
         "hash": new_hash
     }
-    student_entry['images'].append(record)
-    save_hash_db(db)
+    if variant_urls:
+        record["variants"] = variant_urls
+    if institution_id:
+        record["institution_id"] = institution_id
+    return record
+
+
+def upload_path(relative_path: str) -> str:
+    """File holding a stored upload: its blob, or its place in the uploads tree."""
+    blob = blob_store.resolve(relative_path) if blob_store else None
+    return blob or os.path.join(UPLOAD_ROOT, relative_path)
+
+
+def upload_exists(relative_path: str) -> bool:
+    return ((blob_store is not None and blob_store.resolve(relative_path) is not None)
+            or os.path.exists(os.path.join(UPLOAD_ROOT, relative_path)))
+
+
+def place_upload(staging_path: str, record: dict) -> None:
+    """Move a staged upload to where record's URL serves it from."""
+    if blob_store:
+        blob_store.add(staging_path, record['relative_path'], record['sha256'])
+        return
+    dest = os.path.join(UPLOAD_ROOT, record['relative_path'])
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    shutil.move(staging_path, dest)
+
+
+def remove_upload(record: dict) -> None:
+    """Undo place_upload for a record that was not committed."""
+    if blob_store:
+        blob_store.remove(record['relative_path'])
+        return
+    path = os.path.join(UPLOAD_ROOT, record['relative_path'])
+    if os.path.exists(path):
+        os.remove(path)
+
+
+async def discard_uploads(records: list) -> None:
+    """Remove the placed files of records a failed request did not commit;
+    left behind, reindex would adopt them as uploads without a record."""
+    for record in records:
+        try:
+            await asyncio.to_thread(remove_upload, record)
+        except Exception as e:  # the request's own error is what gets raised
+            print(f"Could not remove uncommitted upload {record['relative_path']}: {e}", file=sys.stderr)
+
+
+async def enqueue_derivatives(record: dict):
+    """Queue the job rendering a committed record's variants; returns its
+    id, or None when DERIVATIVE_WIDTHS is empty."""
+    if not DERIVATIVE_WIDTHS:
+        return None
+    source = await asyncio.to_thread(upload_path, record['relative_path'])
+    return await job_queue.enqueue('derivatives', {
+        "source": source,
+        "dest": os.path.join(DERIVATIVE_ROOT, record['relative_path']),
+        "widths": list(DERIVATIVE_WIDTHS),
+        "formats": list(DEFAULT_FORMATS),
+    })
+
 
-    return {"success": True, "record": record}
+def accepted_response(content: dict, job_id: str) -> dict:
+    """Add the id of an upload's background job, for GET /jobs/{id}."""
+    if job_id:
+        content["job_id"] = job_id
+    return content
+
+
+async def render_derivatives_job(payload: dict) -> dict:
+    """Job 'derivatives': write the variants of an accepted upload. Uses the
+    hash pool; when it is saturated the job waits without losing an attempt."""
+    try:
+        variants, _ = await hash_pool.run(render_derivatives, payload['source'], payload['dest'],
+                                          tuple(payload['widths']), tuple(payload['formats']))
+    except HashPoolSaturated:
+        raise RetryLater(1.0)
+    return {"files": sum(len(paths) for paths in variants.values())}
+
+
+job_queue.register('derivatives', render_derivatives_job, concurrency=DERIVATIVE_CONCURRENCY)
+
+
+@app.post("/upload-challenge-proofs")
+async def upload_challenge_proofs(
+    request: Request,
+    student_id: str = Form(...),
+    challenge_id: str = Form(...),
+    files: List[UploadFile] = File(...),
+    institution_id: str = Form(None)
+):
+    """Batch upload of several proof images for one student and challenge.
+    All files are spooled, exact duplicates are dropped by digest, the rest
+    are hashed in parallel on the worker pool, deduplicated against each
+    other and the store in one pass, and every accepted record is committed
+    in a single storage transaction. Returns one result per file, in order:
+    {index, filename, status (200/400/409/413), record | error, match?,
+    job_id?}; as for single uploads, derivatives are rendered afterwards.
+    """
+    timer = request.state.timer
+    timer.record('parse', timer.elapsed())
+    if len(files) > MAX_BATCH_FILES:
+        return JSONResponse(status_code=413,
+                            content={"error": f"Too many files (max {MAX_BATCH_FILES} per batch)"})
+
+    results = [None] * len(files)
+
+    def reject(index: int, status: int, error: str, match: dict = None):
+        results[index] = {"index": index, "filename": files[index].filename, "status": status, "error": error}
+        if match:
+            results[index]["match"] = match
+
+    staged = {}  # file index -> (staging_path, file_size, digest)
+    try:
+        for index, upload in enumerate(files):
+            if not (upload.content_type or '').startswith('image/'):
+                reject(index, 400, "Only image uploads are allowed")
+                continue
+            staging_path = os.path.join(INCOMING_DIR, f"{uuid.uuid4().hex}.part")
+            try:
+                with timer.stage('spool'):
+                    file_size, digest = await spool_upload(upload, staging_path, MAX_UPLOAD_BYTES)
+            except UploadTooLarge:
+                reject(index, 413, TOO_LARGE_ERROR)
+                continue
+            staged[index] = (staging_path, file_size, digest)
+
+        # Exact duplicates: within the batch, then against the digest index
+        to_hash, first_by_digest = [], {}
+        for index, (_, _, digest) in staged.items():
+            if digest in first_by_digest:
+                reject(index, 409, "Duplicate image detected",
+                       {"batch_index": first_by_digest[digest], "distance": 0})
+                continue
+            first_by_digest[digest] = index
+            DIGEST_LOOKUPS.inc()
+            with timer.stage('digest_lookup'):
+                match = await asyncio.to_thread(store.find_by_digest, digest, DEDUP_SCOPE,
+                                                student_id, challenge_id, institution_id)
+            if match:
+                DIGEST_SHORT_CIRCUITS.inc()
+                reject(index, 409, "Duplicate image detected", match)
+                continue
+            to_hash.append(index)
+
+        try:
+            start = time.perf_counter()
+            outputs = await hash_pool.run_many(process_upload, [staged[i][0] for i in to_hash])
+            round_trip = time.perf_counter() - start
+        except HashPoolSaturated:
+            return JSONResponse(status_code=503, headers={"Retry-After": "1"},
+                                content={"error": "Server is busy processing other uploads, please retry"})
+
+        # Perceptual duplicates: within the batch, then against the store.
+        # The check, moves and commit hold the scope lock, as for single uploads
+        async with hold_lock(scope_locks, scope_key(DEDUP_SCOPE, student_id, challenge_id, institution_id),
+                             timer):
+            pending, accepted_hashes = [], []  # (index, record), (index, hash dict)
+            try:
+                for index, output in zip(to_hash, outputs):
+                    if isinstance(output, UnidentifiedImageError):
+                        reject(index, 400, "Invalid image file: cannot identify image file")
+                        continue
+                    if isinstance(output, IMAGE_DECODE_ERRORS):
+                        reject(index, 400, f"Invalid image file: {output}")
+                        continue
+                    if isinstance(output, BaseException):
+                        raise output
+                    new_hash, worker_timings = output
+                    # Files hash in parallel, so each one's wait is the shared round trip
+                    record_worker_stages(timer, round_trip, worker_timings)
+                    near = [(DUPLICATE_SCORER.score(new_hash, other), other_index)
+                            for other_index, other in accepted_hashes]
+                    near = [pair for pair in near if pair[0] is not None]
+                    if ROBUST_HASH and not near:
+                        near = [(crop_distance(new_hash, other), other_index) for other_index, other in accepted_hashes]
+                        near = [pair for pair in near if pair[0] is not None and pair[0] <= ROBUST_CROP_THRESHOLD]
+                    if near:
+                        distance, other_index = min(near)
+                        reject(index, 409, "Duplicate image detected",
+                               {"batch_index": other_index, "distance": distance})
+                        continue
+                    with timer.stage('dedup'):
+                        match = await asyncio.to_thread(find_stored_duplicate, new_hash,
+                                                        student_id, challenge_id, institution_id)
+                    if match:
+                        reject(index, 409, "Duplicate image detected", match)
+                        continue
+                    accepted_hashes.append((index, new_hash))
+                    staging_path, file_size, digest = staged[index]
+                    record = await asyncio.to_thread(build_record, student_id, challenge_id, files[index].filename,
+                                                     file_size, digest, new_hash, institution_id)
+                    pending.append((index, record))  # before the move, so a failed one is undone too
+                    with timer.stage('file_move'):
+                        await asyncio.to_thread(place_upload, staging_path, record)
+
+                # One transaction for the whole batch; it re-checks each record atomically
+                with timer.stage('store_write'):
+                    matches = await asyncio.to_thread(
+                        store.add_images_if_unique, [(student_id, record) for _, record in pending],
+                        DUPLICATE_SCORER, DEDUP_SCOPE) if pending else []
+            except BaseException:
+                # Nothing of this batch was committed
+                await discard_uploads([record for _, record in pending])
+                raise
+            for (index, record), match in zip(pending, matches):
+                if match:
+                    await asyncio.to_thread(remove_upload, record)
+                    reject(index, 409, "Duplicate image detected", match)
+                else:
+                    results[index] = accepted_response(
+                        {"index": index, "filename": files[index].filename, "status": 200, "record": record},
+                        await enqueue_derivatives(record))
+    finally:
+        for staging_path, _, _ in staged.values():
+            if os.path.exists(staging_path):
+                os.remove(staging_path)
+
+    for result in results:
+        UPLOAD_RESULTS.inc(endpoint='batch', result=RESULT_BY_STATUS.get(result["status"], 'error'))
+    accepted = sum(1 for result in results if result["status"] == 200)
+    return {"success": accepted > 0, "accepted": accepted, "rejected": len(results) - accepted,
+            "results": results}
+
+
+def upload_too_large_response():
+    return JSONResponse(status_code=413, content={"error": TOO_LARGE_ERROR})
+
+
+class RequestBodyTooLarge(HTTPException):
+    """Raised by LimitUploadBodies from inside the body stream. FastAPI lets
+    HTTPExceptions out of its body parsing unchanged (anything else becomes
+    a 400), so the handler below turns it into the usual 413."""
+
+    def __init__(self):
+        super().__init__(status_code=413)
+
+
+@app.exception_handler(RequestBodyTooLarge)
+async def request_body_too_large(request: Request, exc: RequestBodyTooLarge):
+    if UPLOAD_ENDPOINTS.get(request.url.path) == 'batch':  # time_uploads counts single uploads
+        UPLOAD_RESULTS.inc(endpoint='batch', result='too_large')
+    return upload_too_large_response()
+
+
+class LimitUploadBodies:
+    """Cap POST bodies while they stream in, before multipart parsing.
+
+    A declared Content-Length over the limit is refused without reading the
+    body. Otherwise the bytes received are counted, and the first read past
+    the limit raises RequestBodyTooLarge. That covers chunked requests,
+    which declare no length, and bodies longer than declared. Starlette
+    spools the whole multipart body before a handler runs, so this is where
+    the cap applies; spool_upload then caps each file.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] != 'POST':
+            return await self.app(scope, receive, send)
+        limit = MAX_UPLOAD_BYTES * (MAX_BATCH_FILES if scope['path'] == '/upload-challenge-proofs' else 1)
+        limit += MULTIPART_OVERHEAD
+        declared = Headers(scope=scope).get('content-length')
+        if declared and declared.isdigit() and int(declared) > limit:
+            if UPLOAD_ENDPOINTS.get(scope['path']) == 'batch':
+                UPLOAD_RESULTS.inc(endpoint='batch', result='too_large')
+            return await upload_too_large_response()(scope, receive, send)
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > limit:
+                    raise RequestBodyTooLarge()
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+# Added before time_uploads, so it runs inside it: time_uploads counts and
+# times its 413s like any other single-upload response, and errors raised
+# here do not cross that middleware's receive wrapper (which would hand
+# FastAPI an ExceptionGroup, turned into a 400)
+app.add_middleware(LimitUploadBodies)
+
+
+@app.middleware("http")
+async def time_uploads(request: Request, call_next):
+    """Give upload handlers a StageTimer (request.state.timer), then record
+    the total, count single-file outcomes and add Server-Timing if enabled."""
+    endpoint = UPLOAD_ENDPOINTS.get(request.url.path)
+    if request.method != 'POST' or endpoint is None:
+        return await call_next(request)
+    timer = request.state.timer = StageTimer(UPLOAD_STAGE_SECONDS)
+    try:
+        response = await call_next(request)
+    except Exception:
+        UPLOAD_RESULTS.inc(endpoint=endpoint, result='error')
+        raise
+    UPLOAD_STAGE_SECONDS.observe(timer.elapsed(), stage='total')
+    if endpoint == 'single':  # batch counts each file itself
+        UPLOAD_RESULTS.inc(endpoint=endpoint, result=RESULT_BY_STATUS.get(response.status_code, 'error'))
+    if SERVER_TIMING:
+        response.headers['Server-Timing'] = timer.server_timing()
+    return response
 
 
 @app.get("/student/{student_id}/images")
-async def list_student_images(student_id: str):
-    """List stored image metadata for a student (no image bytes)."""
-    db = load_hash_db()
-    images = db.get('students', {}).get(student_id, {}).get('images', [])
-    return {"images": images}
+async def list_student_images(student_id: str, request: Request):
+    """List stored image metadata for a student (no image bytes).
+    Supports cursor/limit paging, challenge_id and since/until filters and
+    a fields projection; see ecolearn_core/listing.py. Unchanged listings get 304.
+    """
+    try:
+        query = parse_listing_query(request.query_params)
+    except ListingQueryError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    version = await asyncio.to_thread(store.student_version, student_id)
+    etag = listing_etag(student_id, version, query)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+    page = await asyncio.to_thread(list_student_page, store, student_id, query)
+    return JSONResponse(content=page, headers=headers)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status of a background job: queued, running, succeeded or failed, with
+    attempts, last error and result. Finished jobs are kept for a while."""
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Unknown job"})
+    return job
+
+
+@app.on_event("startup")
+async def start_job_queue():
+    # Durable jobs left queued by a previous run start right away
+    job_queue.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    # Jobs still need the hash pool, so it goes last
+    left = await job_queue.drain(JOB_DRAIN_TIMEOUT)
+    if left:
+        print(f"Shutdown: {left} background job(s) unfinished "
+              f"({'resumed on next start' if JOB_STORE == 'sqlite' else 'lost'})", file=sys.stderr)
+    job_queue.store.close()
+    hash_pool.shutdown()
+    if blob_store:
+        blob_store.close()
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text-format metrics for this worker process. Rendered in a
+    thread: the gauges query the hash and job stores."""
+    return Response(await asyncio.to_thread(REGISTRY.render), media_type=METRICS_CONTENT_TYPE)
 
 
 @app.get("/health")
@@ -0,0 +1,114 @@
+"""Lookup latency and disk savings of the content-addressed upload store
+(ecolearn_core/blob_store.py).
+
+Run from the server directory:
+    python -m benchmarks.bench_blob_store [--scale 200000] [--files 120]
+
+  migrate    an uploads tree where half the files repeat a photo moves into
+             the store: bytes on disk before and after, and the time taken
+  scale      --scale files: stat() and resolve() latency in the fan-out
+             layout against one flat directory, and the size of a leaf
+
+Correctness (refcounts, races, gc, migrate) is covered by
+tests/test_blob_store.py.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_suite import synthetic_image
+from ecolearn_core.blob_store import BlobStore, migrate
+
+
+def disk_bytes(root: str) -> int:
+    return sum(os.path.getsize(os.path.join(directory, name))
+               for directory, _, names in os.walk(root) for name in names if not name.endswith('.sqlite3'))
+
+
+def measure_migrate(root: str, files: int) -> None:
+    uploads = os.path.join(root, 'uploads')
+    rnd = random.Random(25)
+    distinct = [synthetic_image(2600 + i, (800, 600), 'JPEG') for i in range(files // 2)]
+    for i in range(files):
+        data = distinct[i % len(distinct)] if i < len(distinct) else rnd.choice(distinct)
+        path = os.path.join(uploads, f"student{i % 7}", f"challenge_{i % 3}", f"20250301_120000_{i:06d}_p.jpg")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+    before = disk_bytes(uploads)
+    store = BlobStore(os.path.join(root, 'blobs'), os.path.join(root, 'blobs.sqlite3'))
+    start = time.perf_counter()
+    migrate(store, uploads)
+    elapsed = time.perf_counter() - start
+    after = disk_bytes(os.path.join(root, 'blobs')) + disk_bytes(uploads)
+    store.close()
+    print(f"migrate: {files} files, {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB on disk "
+          f"({1 - after / before:.0%} less) in {elapsed:.2f} s")
+
+
+def timed(fn, items: list) -> float:
+    """Median microseconds per call over items."""
+    samples = []
+    for item in items:
+        start = time.perf_counter()
+        fn(item)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1e6
+
+
+def measure_scale(root: str, count: int) -> None:
+    rnd = random.Random(26)
+    digests = [f"{rnd.getrandbits(256):064x}" for _ in range(count)]
+    flat = os.path.join(root, 'flat')
+    os.makedirs(flat)
+    start = time.perf_counter()
+    for digest in digests:
+        open(os.path.join(flat, digest), 'wb').close()
+    flat_write = time.perf_counter() - start
+
+    store = BlobStore(os.path.join(root, 'blobs'), os.path.join(root, 'blobs.sqlite3'))
+    start = time.perf_counter()
+    with store._transaction() as conn:
+        for i, digest in enumerate(digests):
+            path = store.blob_path(digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'wb').close()
+            conn.execute("INSERT INTO blobs (digest, size, refs) VALUES (?, 0, 1)", (digest,))
+            conn.execute("INSERT INTO paths (relative_path, digest, created_at) VALUES (?, ?, 0)",
+                         (f"s{i % 1000}/challenge_1/{i}.jpg", digest))
+    fanout_write = time.perf_counter() - start
+    sample = rnd.sample(range(count), min(count, 5000))
+    flat_stat = timed(os.stat, [os.path.join(flat, digests[i]) for i in sample])
+    fanout_stat = timed(os.stat, [store.blob_path(digests[i]) for i in sample])
+    resolve = timed(lambda i: os.stat(store.resolve(f"s{i % 1000}/challenge_1/{i}.jpg")), sample)
+    flat_list = timed(os.listdir, [flat] * 3)
+    leaf = os.path.dirname(store.blob_path(digests[0]))
+    leaf_list = timed(os.listdir, [leaf] * 50)
+    print(f"scale {count} files: create {flat_write:.1f} s flat, {fanout_write:.1f} s fan-out")
+    print(f"  stat    flat {flat_stat:.1f} µs, fan-out {fanout_stat:.1f} µs, "
+          f"resolve + stat {resolve:.1f} µs")
+    print(f"  listdir flat directory {len(os.listdir(flat))} entries {flat_list / 1e3:.1f} ms, "
+          f"fan-out leaf {len(os.listdir(leaf))} entries {leaf_list:.0f} µs")
+    store.close()
+
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=120, help='uploads in the migrate measurement')
+    parser.add_argument('--scale', type=int, default=200_000, help='files in the lookup measurement (0 skips)')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='eco_blob_migrate_') as root:
+        measure_migrate(root, args.files)
+    if args.scale:
+        with tempfile.TemporaryDirectory(prefix='eco_blob_scale_') as root:
+            measure_scale(root, args.scale)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,69 @@
+"""Query time vs. index size for the MIH near-duplicate index.
+
+Run from the server directory:
+    python -m benchmarks.bench_hash_index            # 1k, 100k, 1M
+    python -m benchmarks.bench_hash_index 1000 50000
+
+Each size reports build time, mean radius-5 query time for near-duplicate
+hits and for misses, and a NumPy linear scan over the same set for reference
+(HashScorer.scan with the combined rule at the same radius).
+"""
+import random
+import sys
+import time
+
+from ecolearn_core.hash_index import HashIndex
+from ecolearn_core.image_hash import np
+from ecolearn_core.scoring import HashScorer, pack_components
+
+RADIUS = 5
+QUERIES = 200
+
+
+def flip_bits(value: int, count: int, rnd: random.Random) -> int:
+    for bit in rnd.sample(range(192), count):
+        value ^= 1 << bit
+    return value
+
+
+def bench(size: int, rnd: random.Random) -> dict:
+    values = [rnd.getrandbits(192) for _ in range(size)]
+    index = HashIndex()
+    start = time.perf_counter()
+    for key, value in enumerate(values):
+        index.insert(key, value)
+    build_s = time.perf_counter() - start
+
+    hits = [flip_bits(rnd.choice(values), RADIUS, rnd) for _ in range(QUERIES)]
+    misses = [rnd.getrandbits(192) for _ in range(QUERIES)]
+
+    def mean_us(queries, fn):
+        start = time.perf_counter()
+        for q in queries:
+            fn(q)
+        return (time.perf_counter() - start) / len(queries) * 1e6
+
+    result = {
+        "size": size,
+        "build_s": build_s,
+        "hit_us": mean_us(hits, lambda q: index.query(q, RADIUS)),
+        "miss_us": mean_us(misses, lambda q: index.query(q, RADIUS)),
+    }
+    if np is not None:
+        packed, scorer = pack_components(values), HashScorer('combined', RADIUS)
+        result["scan_us"] = mean_us(hits[:20], lambda q: scorer.scan(q, packed))
+    return result
+
+
+def main(argv):
+    sizes = [int(arg) for arg in argv] or [1_000, 100_000, 1_000_000]
+    rnd = random.Random(42)
+    print(f"{'size':>10} {'build s':>9} {'hit us':>9} {'miss us':>9} {'scan us':>10}")
+    for size in sizes:
+        r = bench(size, rnd)
+        scan = f"{r['scan_us']:10.1f}" if "scan_us" in r else f"{'n/a':>10}"
+        print(f"{r['size']:>10} {r['build_s']:9.2f} {r['hit_us']:9.1f} {r['miss_us']:9.1f} {scan}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
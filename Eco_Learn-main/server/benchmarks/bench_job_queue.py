@@ -0,0 +1,87 @@
+"""Upload latency with derivatives rendered by a background job.
+
+Run from the server directory:
+    python -m benchmarks.bench_job_queue [--uploads 24]
+
+The app's single-upload latency for full-HD JPEGs now that derivatives are
+rendered by a job (ecolearn_core/job_queue.py), against hashing plus
+rendering inline as before (hash_upload + render_derivatives on the same
+files), and the time until the variants are on disk. Uploads are sequential,
+so each render job has the hashing pool to itself. Exits 1 if a render job
+fails. Queue behaviour is covered by tests/test_job_queue.py.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.bench_suite import RESOLUTIONS, synthetic_image  # (sets scratch dirs)
+from ecolearn_core.derivatives import DEFAULT_FORMATS, DEFAULT_WIDTHS, render_derivatives
+from ecolearn_core.image_hash import hash_upload
+
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summary(values: list) -> str:
+    return f"p50 {statistics.median(values) * 1000:.1f} ms, p95 {percentile(values, 0.95) * 1000:.1f} ms"
+
+
+async def measure_uploads(count: int) -> int:
+    import app as app_module
+
+    payloads = [synthetic_image(2400 + i, RESOLUTIONS['fhd'], 'JPEG') for i in range(count)]
+    inline = []
+    with tempfile.TemporaryDirectory(prefix='eco_inline_') as scratch:
+        for i, data in enumerate(payloads):
+            path = os.path.join(scratch, f'{i}.jpg')
+            with open(path, 'wb') as f:
+                f.write(data)
+            start = time.perf_counter()
+            hash_upload(path)
+            render_derivatives(path, os.path.join(scratch, 'variants', str(i)), DEFAULT_WIDTHS, DEFAULT_FORMATS)
+            inline.append(time.perf_counter() - start)
+
+    transport = httpx.ASGITransport(app=app_module.app)
+    latencies, ready, job_ids = [], [], []
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=120) as client:
+        for i, data in enumerate(payloads):
+            start = time.perf_counter()
+            resp = await client.post('/upload-challenge-proof',
+                                     data={'student_id': f'jobs{i}', 'challenge_id': '1'},
+                                     files={'file': (f'proof{i}.jpg', data, 'image/jpeg')})
+            latencies.append(time.perf_counter() - start)
+            job_id = resp.json()['job_id']
+            job_ids.append(job_id)
+            while (await client.get(f'/jobs/{job_id}')).json()['status'] in ('queued', 'running'):
+                await asyncio.sleep(0.002)
+            ready.append(time.perf_counter() - start)
+        statuses = [(await client.get(f'/jobs/{job_id}')).json()['status'] for job_id in job_ids]
+    await app_module.job_queue.drain(30)
+    app_module.hash_pool.shutdown()
+
+    print(f"upload with inline derivatives (before, hash + render): {summary(inline)}")
+    print(f"upload response, derivatives as a job (after):          {summary(latencies)}")
+    print(f"response until variants on disk:                        {summary(ready)}")
+    failed = count - statuses.count('succeeded')
+    if failed:
+        print(f"{failed}/{count} render jobs did not succeed", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--uploads', type=int, default=24)
+    args = parser.parse_args(argv)
+    return asyncio.run(measure_uploads(args.uploads))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,64 @@
+"""Duplicate-check latency of RedisHashStore against growing hash sets.
+
+Run from the server directory (needs redis; fakeredis when no --url):
+    python -m benchmarks.bench_redis_store                    # in-process fake server
+    python -m benchmarks.bench_redis_store --url redis://localhost:6379/15
+
+Without --url a fakeredis TcpFakeServer is started on a local port, so the
+store talks real RESP over TCP through its connection pool. Keys go under a
+fresh prefix; nothing else on the server is touched. Reports the median
+find_duplicate time for a student-scope check with the combined rule (band
+probes) and a challenge-scope check with a vote rule too loose for band
+probes (a scan of every hash in the scope). Correctness and the
+multi-process race are covered by tests/test_redis_store.py.
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+import uuid
+
+from benchmarks.bench_suite import start_fake_redis
+from ecolearn_core.redis_store import RedisHashStore
+from ecolearn_core.scoring import HashScorer
+
+THRESHOLD = 5
+# Band bound 10 * 3 / 2 * 3 = 45 >= 12, so every check scans the scope
+LOOSE_SCORER = HashScorer('vote', thresholds=(10, 10, 10), votes=2)
+SIZES = (100, 1_000, 10_000)
+
+
+def record(i: int, value: int) -> dict:
+    return {"challenge_id": 'c', "filename": f'f{i}.png', "uploaded_at": '20250101_000000_000000',
+            "hash": {"combined": f"{value:048x}"}, "sha256": f"{value:064x}"[-64:]}
+
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='Redis server to measure (default: in-process fakeredis)')
+    args = parser.parse_args(argv)
+    url = args.url or start_fake_redis()
+
+    rnd = random.Random(9)
+    for size in SIZES:
+        store = RedisHashStore(url, prefix=f'lat:{uuid.uuid4().hex[:8]}:')
+        # In chunks: one 10k-record MULTI outlasts the fake server's socket timeout
+        for chunk in range(0, size, 1000):
+            store.add_images([('s', record(i, rnd.getrandbits(192))) for i in range(chunk, min(size, chunk + 1000))])
+        query = {"combined": f"{rnd.getrandbits(192):048x}"}
+        for label, scope, threshold in (('student, combined', 'student', THRESHOLD),
+                                        ('challenge, vote scan', 'challenge', LOOSE_SCORER)):
+            samples = []
+            for _ in range(30):
+                start = time.perf_counter()
+                store.find_duplicate(query, threshold, scope, 's', 'c')
+                samples.append(time.perf_counter() - start)
+            print(f"find_duplicate(scope={label}), {size:>6} hashes: median "
+                  f"{statistics.median(samples) * 1000:.2f} ms")
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
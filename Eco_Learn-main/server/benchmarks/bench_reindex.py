@@ -0,0 +1,64 @@
+"""Throughput of the offline re-index CLI (python -m ecolearn_core.reindex).
+
+Run from the server directory:
+    python -m benchmarks.bench_reindex [--files 240]
+
+Builds a throwaway uploads tree of synthetic JPEGs under
+student/challenge_<id>/ with an empty SQLite store, so every file is hashed,
+then re-indexes it from scratch once per --workers value (1, 2, the core
+count and 4/8/16 up to it) and reports files/s, process start-up included.
+Resume and result checks are in tests/test_reindex.py.
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_suite import synthetic_image
+from ecolearn_core.hash_store import store_path
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUDENTS = 6
+
+
+def build_tree(root: str, files: int) -> None:
+    rnd = random.Random(22)
+    for i in range(files):
+        path = os.path.join(root, 'uploads', f'student{i % STUDENTS}', f'challenge_{i % 3}',
+                            f'20250301_1200{i // 60 % 60:02d}_{i:06d}_p{i}.jpg')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(synthetic_image(500 + i, (rnd.randrange(320, 900), rnd.randrange(240, 700)), 'JPEG'))
+    os.makedirs(os.path.join(root, 'storage'))
+
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=240)
+    args = parser.parse_args(argv)
+
+    cores = os.cpu_count() or 1
+    counts = sorted({1, 2, cores} | {n for n in (4, 8, 16) if n <= cores})
+    print(f"{cores} core(s) available; more workers than cores cannot go faster")
+    with tempfile.TemporaryDirectory(prefix='eco_reindex_') as root:
+        build_tree(root, args.files)
+        store = store_path('sqlite', os.path.join(root, 'storage'))
+        for workers in counts:
+            for path in (store, f"{store}.reindex.sqlite3"):
+                if os.path.exists(path):
+                    os.remove(path)
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-m', 'ecolearn_core.reindex', '--store', 'sqlite',
+                            '--uploads', os.path.join(root, 'uploads'), '--storage', os.path.join(root, 'storage'),
+                            '--workers', str(workers), '--chunk', '256'],
+                           cwd=SERVER_DIR, check=True, capture_output=True)
+            elapsed = time.perf_counter() - start
+            print(f"{workers} worker(s): {args.files} files in {elapsed:.1f} s, {args.files / elapsed:.1f} files/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
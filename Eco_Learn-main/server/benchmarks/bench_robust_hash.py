@@ -0,0 +1,123 @@
+"""Cost and catch rate of robust mode (ROBUST_HASH) versus the default hash.
+
+Run from the server directory:
+    python -m benchmarks.bench_robust_hash [images]
+
+  cost      per-upload hashing time, compute_combined_hash against
+            compute_robust_hash, per resolution x format of the bench_suite
+            corpus, plus the thumbnail-only part (hash_thumbnail against
+            canonical_hash) that robust mode actually adds
+  catch     for each of `images` synthetic photos, edited copies re-encoded
+            as JPEG q75: the seven other D4 rotations/mirror images, a copy
+            rotated in pixels but displayed upright through its EXIF
+            Orientation tag, and centered crops keeping 97/90/85/80% of each
+            side. A copy is caught when the app would reject it: combined
+            distance <= DUPLICATE_THRESHOLD, or in robust mode crop_distance
+            <= ROBUST_CROP_THRESHOLD
+  distinct  pairs of different photos that either rule would wrongly reject
+
+Robust mode keeps one canonical hash per record, so the indexed lookup
+itself costs the same; the crop check scans only the student's own records.
+"""
+import io
+import random
+import sys
+import time
+from itertools import combinations
+
+from PIL import Image
+
+from benchmarks.bench_suite import FORMATS, RESOLUTIONS, encode, ops_per_second, synthetic_image
+from ecolearn_core.image_hash import (
+    D4_TRANSFORMS, canonical_hash, compute_combined_hash, compute_robust_hash, crop_distance, hamming_distance,
+    hash_thumbnail, load_grayscale_thumbnail,
+)
+
+DUPLICATE_THRESHOLD = 5  # default of the combined rule (ecolearn_core.scoring)
+ROBUST_CROP_THRESHOLD = 20  # app.ROBUST_CROP_THRESHOLD default
+CROPS = (0.97, 0.90, 0.85, 0.80)
+EXIF_ORIENTATION = 0x0112
+
+
+def bench_cost() -> None:
+    print(f"{'input':<16} {'default':>10} {'robust':>10} {'added':>9}")
+    for res_name, size in RESOLUTIONS.items():
+        for fmt in FORMATS:
+            data = synthetic_image(7, size, fmt)
+            default = 1000 / ops_per_second(compute_combined_hash, data)
+            robust = 1000 / ops_per_second(compute_robust_hash, data)
+            print(f"{res_name + ',' + fmt:<16} {default:8.2f}ms {robust:8.2f}ms {robust - default:+7.2f}ms")
+    thumbnail = load_grayscale_thumbnail(synthetic_image(7, RESOLUTIONS['fhd'], 'JPEG'))
+    default = 1000 / ops_per_second(hash_thumbnail, thumbnail)
+    robust = 1000 / ops_per_second(canonical_hash, thumbnail)
+    print(f"{'thumbnail only':<16} {default:8.2f}ms {robust:8.2f}ms {robust - default:+7.2f}ms")
+
+
+def jpeg(image: Image.Image, **options) -> bytes:
+    return encode(image, 'JPEG', quality=75, **options)
+
+
+def edited_copies(original: Image.Image, rnd: random.Random) -> dict:
+    copies = {name: jpeg(original.transpose(method)) for name, method in D4_TRANSFORMS if method is not None}
+    # Stored rotated 90 degrees counter-clockwise; Orientation 6 tells
+    # viewers to turn it back, so it displays exactly like the original
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION] = 6
+    copies['exif_orientation'] = jpeg(original.transpose(Image.Transpose.ROTATE_90), exif=exif)
+    width, height = original.size
+    for keep in CROPS:
+        crop_w, crop_h = int(width * keep), int(height * keep)
+        # Centered, give or take 2% of the side
+        left = min(max(0, (width - crop_w) // 2 + int(width * 0.02 * rnd.uniform(-1, 1))), width - crop_w)
+        top = min(max(0, (height - crop_h) // 2 + int(height * 0.02 * rnd.uniform(-1, 1))), height - crop_h)
+        copies[f'crop{round(keep * 100)}'] = jpeg(original.crop((left, top, left + crop_w, top + crop_h)))
+    return copies
+
+
+def default_rejects(new_hash: dict, stored: dict) -> bool:
+    return hamming_distance(new_hash['combined'], stored['combined']) <= DUPLICATE_THRESHOLD
+
+
+def robust_rejects(new_hash: dict, stored: dict) -> bool:
+    distance = crop_distance(new_hash, stored)
+    return default_rejects(new_hash, stored) or (distance is not None and distance <= ROBUST_CROP_THRESHOLD)
+
+
+def bench_catch(images: int) -> None:
+    rnd = random.Random(21)
+    caught = {}  # edit -> [default caught, robust caught]
+    originals = {'default': [], 'robust': []}
+    for seed in range(images):
+        data = synthetic_image(1000 + seed, (1600, 1200), 'JPEG')
+        original = Image.open(io.BytesIO(data)).convert('RGB')
+        stored_default, stored_robust = compute_combined_hash(data), compute_robust_hash(data)
+        originals['default'].append(stored_default)
+        originals['robust'].append(stored_robust)
+        for name, copy in edited_copies(original, rnd).items():
+            counts = caught.setdefault(name, [0, 0])
+            counts[0] += default_rejects(compute_combined_hash(copy), stored_default)
+            counts[1] += robust_rejects(compute_robust_hash(copy), stored_robust)
+
+    print(f"{'edit':<18} {'default':>8} {'robust':>8}   (copies caught of {images})")
+    for name, (default, robust) in caught.items():
+        print(f"{name:<18} {default:>8} {robust:>8}")
+    pairs = images * (images - 1) // 2
+    false_default = sum(default_rejects(a, b) for a, b in combinations(originals['default'], 2))
+    false_robust = sum(robust_rejects(a, b) for a, b in combinations(originals['robust'], 2))
+    closest = min(crop_distance(a, b) for a, b in combinations(originals['robust'], 2))
+    print(f"{'distinct pairs':<18} {false_default:>8} {false_robust:>8}   (wrongly rejected of {pairs}; "
+          f"closest robust pair at crop_distance {closest})")
+
+
+def main(argv) -> int:
+    images = int(argv[0]) if argv else 60
+    start = time.perf_counter()
+    bench_cost()
+    print()
+    bench_catch(images)
+    print(f"\n({time.perf_counter() - start:.0f} s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,249 @@
+"""Throughput benchmarks for ecolearn_core/image_hash.py and the upload endpoint.
+
+Run from the server directory (needs httpx):
+    python -m benchmarks.bench_suite              # run and print
+    python -m benchmarks.bench_suite --save       # also record benchmarks/baseline.json
+    python -m benchmarks.bench_suite --compare    # exit 1 on a regression vs the baseline
+    python -m benchmarks.bench_suite --quick      # smaller corpus and index sizes
+
+Every result is a throughput in operations per second (higher is better):
+  decode+thumbnail, compute_combined_hash  per resolution x format of a
+                      seeded synthetic corpus (photo-like blobs, not noise)
+  average_hash, difference_hash, perceptual_hash  on the 64x64 grayscale
+                      thumbnail they receive in the upload pipeline
+  hamming_distance    hex strings and ints
+  is_duplicate        at growing index sizes, from stored dicts (packs every
+                      call, as legacy callers do) and from pack_components output
+  upload              end-to-end accepted uploads/s through server/app.py
+                      with an in-process ASGI client (thread hashing pool)
+
+Each figure is the median of REPEATS timed runs, and each run loops for at
+least MIN_RUN_S. Baselines are machine-specific: record one on the machine
+that runs --compare. A metric regresses when it drops more than --tolerance
+(default 25%) below its baseline.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+from PIL import Image, ImageDraw, ImageFilter
+
+os.environ.setdefault('STORAGE_DIR', tempfile.mkdtemp(prefix='eco_bench_storage_'))
+os.environ.setdefault('UPLOAD_ROOT', tempfile.mkdtemp(prefix='eco_bench_uploads_'))
+os.environ.setdefault('DERIVATIVE_ROOT', tempfile.mkdtemp(prefix='eco_bench_derivatives_'))
+os.environ.setdefault('BLOB_ROOT', tempfile.mkdtemp(prefix='eco_bench_blobs_'))
+os.environ.setdefault('MAX_UPLOAD_BYTES', str(64 * 1024 * 1024))
+os.environ.setdefault('HASH_EXECUTOR', 'thread')
+os.environ.setdefault('HASH_MAX_PENDING', '64')  # measure throughput, not 503 backpressure
+
+from ecolearn_core.image_hash import (  # noqa: E402  (env must be set first)
+    DCT_BACKEND, average_hash, compute_combined_hash, difference_hash, hamming_distance,
+    is_duplicate, load_grayscale_thumbnail, perceptual_hash,
+)
+from ecolearn_core.scoring import pack_components  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+REPEATS = 5
+MIN_RUN_S = 0.2
+RESOLUTIONS = {'vga': (640, 480), 'fhd': (1920, 1080), '12mp': (4032, 3024)}
+FORMATS = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'WEBP': 'image/webp'}
+INDEX_SIZES = (100, 1_000, 10_000, 100_000)
+UPLOADS = 48
+UPLOAD_CONCURRENCY = 8
+
+
+def synthetic_image(seed: int, size: tuple, fmt: str) -> bytes:
+    """Deterministic photo-like image: blurred coloured blobs on a gradient."""
+    rnd = random.Random(seed)
+    width, height = size
+    image = Image.linear_gradient('L').resize(size).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for _ in range(24):
+        x, y = rnd.randrange(width), rnd.randrange(height)
+        rx, ry = rnd.randint(width // 30, width // 4), rnd.randint(height // 30, height // 4)
+        draw.ellipse((x - rx, y - ry, x + rx, y + ry), fill=tuple(rnd.randrange(256) for _ in range(3)))
+    image = image.filter(ImageFilter.GaussianBlur(max(1, width // 400)))
+    return encode(image, fmt, **({'quality': 90} if fmt in ('JPEG', 'WEBP') else {}))
+
+
+def encode(image: Image.Image, fmt: str = 'PNG', **options) -> bytes:
+    """image saved as fmt, e.g. encode(image, 'JPEG', quality=75)."""
+    buf = io.BytesIO()
+    image.save(buf, fmt, **options)
+    return buf.getvalue()
+
+
+def start_fake_redis() -> str:
+    """URL of a fakeredis TcpFakeServer on a free local port, so a store
+    talks real RESP over TCP through its connection pool (needs fakeredis)."""
+    from fakeredis import TcpFakeServer
+
+    class FakeServer(TcpFakeServer):
+        def get_request(self):
+            # The fake writes each pipelined reply separately; without
+            # TCP_NODELAY, Nagle plus delayed ACKs add ~40 ms per pipeline,
+            # which a real Redis (one write per batch) does not have.
+            sock, address = super().get_request()
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return sock, address
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    server = FakeServer(('127.0.0.1', port), server_type='redis')
+    server.daemon_threads = True  # set per instance by TcpFakeServer.__init__
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'redis://127.0.0.1:{port}/0'
+
+
+def ops_per_second(fn, *args) -> float:
+    """Median throughput of fn(*args) over REPEATS runs of >= MIN_RUN_S each."""
+    fn(*args)  # warm-up
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn(*args)
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_RUN_S:
+            break
+        loops *= 2 if elapsed <= 0 else max(2, int(MIN_RUN_S / elapsed * 1.2))
+    runs = [elapsed / loops]
+    for _ in range(REPEATS - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn(*args)
+        runs.append((time.perf_counter() - start) / loops)
+    return 1.0 / statistics.median(runs)
+
+
+def bench_functions(quick: bool) -> dict:
+    results = {}
+    resolutions = {'vga': RESOLUTIONS['vga'], 'fhd': RESOLUTIONS['fhd']} if quick else RESOLUTIONS
+    for res_name, size in resolutions.items():
+        for fmt in FORMATS:
+            data = synthetic_image(7, size, fmt)
+            results[f'decode+thumbnail[{res_name},{fmt}]'] = ops_per_second(load_grayscale_thumbnail, data)
+            results[f'compute_combined_hash[{res_name},{fmt}]'] = ops_per_second(compute_combined_hash, data)
+
+    thumbnail = load_grayscale_thumbnail(synthetic_image(7, RESOLUTIONS['fhd'], 'JPEG'))
+    results['average_hash[thumb64]'] = ops_per_second(average_hash, thumbnail)
+    results['difference_hash[thumb64]'] = ops_per_second(difference_hash, thumbnail)
+    results[f'perceptual_hash[thumb64,{DCT_BACKEND}]'] = ops_per_second(perceptual_hash, thumbnail)
+
+    rnd = random.Random(3)
+    a, b = rnd.getrandbits(192), rnd.getrandbits(192)
+    results['hamming_distance[hex]'] = ops_per_second(hamming_distance, f"{a:048x}", f"{b:048x}")
+    results['hamming_distance[int]'] = ops_per_second(hamming_distance, a, b)
+
+    sizes = INDEX_SIZES[:3] if quick else INDEX_SIZES
+    stored = [{"combined": f"{rnd.getrandbits(192):048x}"} for _ in range(max(sizes))]
+    query = {"combined": f"{rnd.getrandbits(192):048x}"}
+    for size in sizes:
+        subset = stored[:size]
+        packed = pack_components(subset)
+        results[f'is_duplicate[dicts,n={size}]'] = ops_per_second(is_duplicate, query, subset, 5)
+        results[f'is_duplicate[packed,n={size}]'] = ops_per_second(is_duplicate, query, packed, 5)
+    return results
+
+
+async def bench_upload(quick: bool) -> dict:
+    import app as app_module
+
+    count = UPLOADS // 2 if quick else UPLOADS
+    payloads = [synthetic_image(1000 + i, RESOLUTIONS['fhd'], 'JPEG') for i in range(count)]
+    transport = httpx.ASGITransport(app=app_module.app)
+    latencies, statuses = [], []
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=120) as client:
+        semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+        async def upload(i: int):
+            async with semaphore:
+                start = time.perf_counter()
+                resp = await client.post(
+                    '/upload-challenge-proof',
+                    data={'student_id': f'bench{i % UPLOAD_CONCURRENCY}', 'challenge_id': str(i)},
+                    files={'file': (f'proof{i}.jpg', payloads[i], 'image/jpeg')},
+                )
+                latencies.append(time.perf_counter() - start)
+                statuses.append(resp.status_code)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(upload(i) for i in range(count)))
+        elapsed = time.perf_counter() - start
+    # Render jobs queued by the uploads still need the pool
+    await app_module.job_queue.drain(120)
+    app_module.hash_pool.shutdown()
+    accepted = statuses.count(200)
+    if accepted != count:
+        print(f"warning: {count - accepted} of {count} uploads were not accepted: {sorted(set(statuses))}")
+    latencies.sort()
+    print(f"upload latency p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms")
+    return {f'upload[fhd,JPEG,c={UPLOAD_CONCURRENCY}]': accepted / elapsed}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for name, value in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        change = value / base - 1
+        marker = ''
+        if change < -tolerance:
+            marker = '  REGRESSION'
+            regressions.append(name)
+        print(f"{name:<44} {base:>12.1f} -> {value:>12.1f} ops/s  {change:+7.1%}{marker}")
+    return regressions
+
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--save', action='store_true', help=f'write results to {BASELINE_PATH}')
+    parser.add_argument('--compare', action='store_true', help='compare with the saved baseline')
+    parser.add_argument('--quick', action='store_true', help='smaller corpus and index sizes')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown (fraction)')
+    parser.add_argument('--skip-upload', action='store_true', help='only the image_hash functions')
+    args = parser.parse_args(argv)
+
+    results = bench_functions(args.quick)
+    if not args.skip_upload:
+        results.update(asyncio.run(bench_upload(args.quick)))
+    for name, value in results.items():
+        print(f"{name:<44} {value:>12.1f} ops/s")
+
+    status = 0
+    if args.compare:
+        with open(BASELINE_PATH, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"\nvs baseline recorded {baseline['recorded_at']} on {baseline['machine']}:")
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+            status = 1
+    if args.save:
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+            json.dump({
+                "recorded_at": time.strftime('%Y-%m-%d'),
+                "machine": f"{platform.machine()} {os.cpu_count()} CPUs, Python {platform.python_version()}",
+                "results": {name: round(value, 1) for name, value in results.items()},
+            }, f, indent=2)
+            f.write('\n')
+        print(f"Saved baseline to {BASELINE_PATH}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
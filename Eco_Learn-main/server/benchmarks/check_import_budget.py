@@ -0,0 +1,70 @@
+"""Cold-start import budget for the Vercel functions in api/.
+
+Run from the server directory:
+    python -m benchmarks.check_import_budget [runs]
+
+Each function is loaded in a fresh interpreter, the way the Vercel runtime
+does (spec_from_file_location with the project root on sys.path), and the
+time spent importing it is measured. The median over runs is checked
+against BUDGET_MS, and none of them may load PIL or NumPy at import time;
+the upload path imports them on first use. Exits 1 when a budget or a lazy-import rule is broken. Budgets leave
+about 1.5x headroom over a 1-CPU container's timings; importing PIL and
+NumPy at load time adds roughly 100 ms on the same machine.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+HEAVY_MODULES = ('PIL', 'numpy')
+
+# function -> import budget in ms
+BUDGET_MS = {
+    'api/health.py': 80,  # http.server alone is ~40 ms
+    'api/student.py': 120,
+    'api/upload-challenge-proof.py': 180,
+    'api/index.py': 800,  # FastAPI itself dominates
+}
+
+PROBE = """
+import importlib.util, json, sys, time
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location('vc_entrypoint', sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+elapsed = time.perf_counter() - start
+print(json.dumps({"ms": elapsed * 1000, "heavy": sorted(m for m in %r if m in sys.modules)}))
+""" % (HEAVY_MODULES,)
+
+
+def measure(path: str) -> dict:
+    # -I would drop the editable install's path entry, so only -B (no .pyc
+    # writes) is used; the project root goes first on sys.path as on Vercel.
+    env = {**os.environ, 'PYTHONPATH': PROJECT_ROOT}
+    out = subprocess.run([sys.executable, '-B', '-c', PROBE, os.path.join(PROJECT_ROOT, path)],
+                         cwd=PROJECT_ROOT, env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv) -> int:
+    runs = int(argv[0]) if argv else 7
+    failures = 0
+    for path, budget in BUDGET_MS.items():
+        samples = [measure(path) for _ in range(runs)]
+        median = statistics.median(sample['ms'] for sample in samples)
+        heavy = samples[-1]['heavy']
+        problems = []
+        if median > budget:
+            problems.append(f"over budget of {budget} ms")
+        if heavy:
+            problems.append(f"imports {', '.join(heavy)} at load time")
+        failures += bool(problems)
+        print(f"{'FAIL' if problems else 'ok  '} {path:<32} {median:7.1f} ms (budget {budget} ms)"
+              f"{'  ' + '; '.join(problems) if problems else ''}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,200 @@
+"""Precision, recall and throughput of the duplicate scoring rules.
+
+Run from the server directory:
+    python -m benchmarks.eval_scoring [--originals 80] [--scan-size 100000]
+
+Labeled corpus, built from seeded synthetic scenes (blurred blobs on a
+gradient, as in bench_suite):
+
+  duplicates   each original against edited copies of itself: JPEG
+               re-encodes at q40/q75, downscaled to 50% and 25%, brightness
+               +15%, contrast +20%, grayscale, blur, sharpen, a 97% crop, a
+               small text overlay, and a copy whose pHash failed (its hash
+               is aHash + dHash only, as hash_thumbnail stores it then)
+  distinct     every copy against every other original, plus a "second
+               shot" of each scene (a quarter of its blobs moved or
+               recoloured) against the original, the case a per-component
+               rule could wrongly merge
+
+Per rule configuration (see ecolearn_core/scoring.py): precision, recall,
+recall per edit, and the scan throughput of HashScorer.scan over packed
+random hashes (misses, so every row is evaluated). Component distances of duplicates and of
+distinct pairs are printed first to show where thresholds can go.
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+
+from PIL import Image, ImageDraw, ImageEnhance, ImageFilter
+
+from benchmarks.bench_suite import encode, ops_per_second
+from ecolearn_core.image_hash import combined_int, compute_combined_hash, hamming_distance
+from ecolearn_core.scoring import COMPONENTS, HashScorer, pack_components, split_components
+
+SIZE = (1200, 900)
+BLOBS = 24
+
+CONFIGS = {
+    'combined 5 (default)': HashScorer('combined', 5),
+    'combined 8': HashScorer('combined', 8),
+    'combined 11': HashScorer('combined', 11),
+    'weighted 2 (1,1,1)': HashScorer('weighted', 2),
+    'weighted 3 (1,1,2)': HashScorer('weighted', 3, weights=(1, 1, 2)),
+    'weighted 3 (1,2,2)': HashScorer('weighted', 3, weights=(1, 2, 2)),
+    'vote 2 of (3,3,3)': HashScorer('vote', thresholds=(3, 3, 3), votes=2),
+    'vote 2 of (4,5,5)': HashScorer('vote', thresholds=(4, 5, 5), votes=2),
+    'vote 2 of (6,6,8)': HashScorer('vote', thresholds=(6, 6, 8), votes=2),
+    'vote 3 of (4,5,6)': HashScorer('vote', thresholds=(4, 5, 6), votes=3),
+}
+
+
+def scene(seed: int, variant: int = None) -> Image.Image:
+    """Blurred blobs on a gradient; variant moves or recolours a quarter of
+    the blobs, like a second photo of the same place."""
+    rnd = random.Random(seed)
+    blobs = []
+    width, height = SIZE
+    for _ in range(BLOBS):
+        x, y = rnd.randrange(width), rnd.randrange(height)
+        rx, ry = rnd.randint(width // 30, width // 4), rnd.randint(height // 30, height // 4)
+        blobs.append([x, y, rx, ry, tuple(rnd.randrange(256) for _ in range(3))])
+    if variant is not None:
+        vrnd = random.Random(variant)
+        for blob in vrnd.sample(blobs, BLOBS // 4):
+            if vrnd.random() < 0.5:
+                blob[0], blob[1] = vrnd.randrange(width), vrnd.randrange(height)
+            else:
+                blob[4] = tuple(vrnd.randrange(256) for _ in range(3))
+    image = Image.linear_gradient('L').resize(SIZE).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for x, y, rx, ry, fill in blobs:
+        draw.ellipse((x - rx, y - ry, x + rx, y + ry), fill=fill)
+    return image.filter(ImageFilter.GaussianBlur(3))
+
+
+def jpeg(image: Image.Image, quality: int = 90) -> bytes:
+    return encode(image.convert('RGB'), 'JPEG', quality=quality)
+
+
+def edits(image: Image.Image) -> dict:
+    width, height = image.size
+    keep_w, keep_h = int(width * 0.97), int(height * 0.97)
+    left, top = (width - keep_w) // 2, (height - keep_h) // 2
+    overlay = image.copy()
+    ImageDraw.Draw(overlay).text((20, height - 40), "eco challenge #12", fill=(255, 255, 255))
+    return {
+        'jpeg q40': jpeg(image, 40),
+        'jpeg q75': jpeg(image, 75),
+        'resize 50%': jpeg(image.resize((width // 2, height // 2), Image.Resampling.LANCZOS)),
+        'resize 25%': jpeg(image.resize((width // 4, height // 4), Image.Resampling.LANCZOS)),
+        'brightness +15%': jpeg(ImageEnhance.Brightness(image).enhance(1.15)),
+        'contrast +20%': jpeg(ImageEnhance.Contrast(image).enhance(1.2)),
+        'grayscale': jpeg(image.convert('L')),
+        'blur r2': jpeg(image.filter(ImageFilter.GaussianBlur(2))),
+        'sharpen': jpeg(image.filter(ImageFilter.SHARPEN)),
+        'crop 97%': jpeg(image.crop((left, top, left + keep_w, top + keep_h))),
+        'text overlay': jpeg(overlay),
+    }
+
+
+def without_phash(hash_dict: dict) -> dict:
+    return {**hash_dict, "pHash": '', "combined": hash_dict['aHash'] + hash_dict['dHash']}
+
+
+def build_corpus(originals: int) -> tuple:
+    """(original hashes, [(original index, edit name, hash)], second-shot hashes)."""
+    stored, copies, second_shots = [], [], []
+    for i in range(originals):
+        image = scene(100 + i)
+        stored.append(compute_combined_hash(jpeg(image)))
+        for name, data in edits(image).items():
+            copies.append((i, name, compute_combined_hash(data)))
+        copies.append((i, 'pHash failed', without_phash(compute_combined_hash(jpeg(image, 85)))))
+        second_shots.append(compute_combined_hash(jpeg(scene(100 + i, variant=i))))
+    return stored, copies, second_shots
+
+
+def component_distances(a: dict, b: dict) -> list:
+    return [None if x is None or y is None else bin(x ^ y).count('1')
+            for x, y in zip(split_components(a), split_components(b))]
+
+
+def describe_distances(stored: list, copies: list, second_shots: list) -> None:
+    groups = {
+        'duplicates': [component_distances(stored[i], h) for i, name, h in copies if name != 'pHash failed'],
+        'second shots': [component_distances(stored[i], h) for i, h in enumerate(second_shots)],
+        'other images': [component_distances(stored[j], h) for i, name, h in copies[::7]
+                         for j in range(len(stored)) if j != i and name != 'pHash failed'],
+    }
+    print(f"{'component distance':<20}" + ''.join(f"{c + ' p50/p95/max':>22}" for c in COMPONENTS))
+    for label, rows in groups.items():
+        cells = []
+        for column in range(len(COMPONENTS)):
+            values = sorted(row[column] for row in rows)
+            cells.append(f"{statistics.median(values):.0f} / {values[int(len(values) * 0.95)]} / {values[-1]}"
+                         if label == 'duplicates' else
+                         f"{values[0]} (min) / {values[int(len(values) * 0.05)]} (p5)")
+        print(f"{label:<20}" + ''.join(f"{cell:>22}" for cell in cells))
+    print()
+
+
+def evaluate(scorer: HashScorer, stored: list, copies: list, second_shots: list) -> dict:
+    true_pos = sum(scorer.score(h, stored[i]) is not None for i, _, h in copies)
+    per_edit = {}
+    for i, name, h in copies:
+        per_edit.setdefault(name, []).append(scorer.score(h, stored[i]) is not None)
+    false_pos = sum(scorer.score(h, other) is not None
+                    for i, _, h in copies for j, other in enumerate(stored) if j != i)
+    false_pos += sum(scorer.score(h, stored[i]) is not None for i, h in enumerate(second_shots))
+    negatives = len(copies) * (len(stored) - 1) + len(second_shots)
+    return {
+        'precision': true_pos / (true_pos + false_pos) if true_pos + false_pos else 1.0,
+        'recall': true_pos / len(copies),
+        'false_pos': false_pos,
+        'negatives': negatives,
+        'per_edit': {name: sum(hits) / len(hits) for name, hits in per_edit.items()},
+    }
+
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--originals', type=int, default=80)
+    parser.add_argument('--scan-size', type=int, default=100_000, help='packed hashes per throughput scan')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    stored, copies, second_shots = build_corpus(args.originals)
+    print(f"corpus: {len(stored)} originals, {len(copies)} duplicate copies, {len(second_shots)} second shots "
+          f"(hashed in {time.perf_counter() - start:.0f} s)\n")
+    describe_distances(stored, copies, second_shots)
+
+    rnd = random.Random(23)
+    values = [rnd.getrandbits(192) for _ in range(args.scan_size)]
+    packed = pack_components(values)
+    query = rnd.getrandbits(192)
+
+    results = {name: evaluate(scorer, stored, copies, second_shots) for name, scorer in CONFIGS.items()}
+    print(f"{'rule':<22} {'precision':>9} {'recall':>7} {'false +':>9} {'indexed':>8} {'scan M/s':>9}")
+    for name, scorer in CONFIGS.items():
+        result = results[name]
+        scan = ops_per_second(scorer.scan, query, packed) * args.scan_size / 1e6
+        print(f"{name:<22} {result['precision']:>9.4f} {result['recall']:>7.3f} "
+              f"{result['false_pos']:>4}/{result['negatives']:<5} {'yes' if scorer.indexable else 'scan':>7} "
+              f"{scan:>9.1f}")
+
+    failed = [(i, h) for i, name, h in copies if name == 'pHash failed']
+    padded = sum(hamming_distance(combined_int(h), combined_int(stored[i])) <= 5 for i, h in failed)
+    print(f"{'before: padded 192-bit':<22} recall on 'pHash failed' copies {padded}/{len(failed)}")
+
+    edits_seen = list(next(iter(results.values()))['per_edit'])
+    print(f"\n{'recall per edit':<18}" + ''.join(f"{name.split(' (')[0][:11]:>12}" for name in CONFIGS))
+    for edit in edits_seen:
+        print(f"{edit:<18}" + ''.join(f"{results[name]['per_edit'][edit]:>12.2f}" for name in CONFIGS))
+    print(f"\n({time.perf_counter() - start:.0f} s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
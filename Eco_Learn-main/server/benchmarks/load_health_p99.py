@@ -0,0 +1,98 @@
+"""/health latency while uploads are being hashed, per HASH_EXECUTOR kind.
+
+Run from the server directory (needs httpx):
+    python -m benchmarks.load_health_p99 [uploaders] [seconds] [JPEG|PNG]
+
+Uploaders post a large JPEG in a loop while a poller hits /health every
+10 ms. With 'inline' hashing the event loop is blocked for the whole decode,
+so /health p99 tracks hashing time (PNG uploads get no draft-mode shortcut); with 'thread'/'process' it should stay
+in the low milliseconds.
+"""
+import asyncio
+import io
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+from PIL import Image, ImageDraw
+
+os.environ.setdefault('STORAGE_DIR', tempfile.mkdtemp(prefix='eco_bench_storage_'))
+os.environ.setdefault('MAX_UPLOAD_BYTES', str(64 * 1024 * 1024))
+os.environ.setdefault('UPLOAD_ROOT', tempfile.mkdtemp(prefix='eco_bench_uploads_'))
+os.environ.setdefault('BLOB_ROOT', tempfile.mkdtemp(prefix='eco_bench_blobs_'))
+
+import app as app_module  # noqa: E402  (env must be set first)
+from ecolearn_core.hash_pool import EXECUTOR_KINDS, HashPool  # noqa: E402
+
+
+def make_image(fmt: str, width: int = 4000, height: int = 3000) -> bytes:
+    image = Image.effect_noise((width, height), 64).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((width // 4, height // 4, width // 2, height // 2), fill=(200, 40, 40))
+    buf = io.BytesIO()
+    image.save(buf, fmt)
+    return buf.getvalue()
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def scenario(kind: str, payload: bytes, mime: str, uploaders: int, seconds: float) -> dict:
+    app_module.hash_pool = HashPool(kind=kind, max_pending=uploaders * 2)
+    transport = httpx.ASGITransport(app=app_module.app)
+    deadline = time.perf_counter() + seconds
+    health_ms, statuses = [], []
+
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=120) as client:
+        await client.get('/health')
+
+        async def upload_loop(worker: int):
+            n = 0
+            while time.perf_counter() < deadline:
+                n += 1
+                resp = await client.post(
+                    '/upload-challenge-proof',
+                    data={'student_id': f'bench{worker}', 'challenge_id': str(n)},
+                    files={'file': ('proof', payload, mime)},
+                )
+                statuses.append(resp.status_code)
+
+        async def health_loop():
+            # Latency is measured from each probe's scheduled time, so time
+            # spent waiting for a blocked event loop is counted too.
+            scheduled = time.perf_counter()
+            while scheduled < deadline:
+                await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+                await client.get('/health')
+                health_ms.append((time.perf_counter() - scheduled) * 1000)
+                scheduled = max(scheduled + 0.01, time.perf_counter())
+
+        await asyncio.gather(health_loop(), *(upload_loop(i) for i in range(uploaders)))
+    app_module.hash_pool.shutdown()
+    return {
+        "kind": kind,
+        "uploads": len(statuses),
+        "p50": percentile(health_ms, 50),
+        "p99": percentile(health_ms, 99),
+        "max": max(health_ms),
+    }
+
+
+def main(argv):
+    uploaders = int(argv[0]) if argv else 4
+    seconds = float(argv[1]) if len(argv) > 1 else 10
+    fmt = argv[2].upper() if len(argv) > 2 else 'PNG'
+    payload = make_image(fmt)
+    print(f"{len(payload) / 1e6:.1f} MB {fmt}, {uploaders} concurrent uploaders, {seconds:.0f}s per executor")
+    print(f"{'executor':>9} {'uploads':>8} {'health p50 ms':>14} {'p99 ms':>8} {'max ms':>8}")
+    for kind in EXECUTOR_KINDS:
+        r = asyncio.run(scenario(kind, payload, f"image/{fmt.lower()}", uploaders, seconds))
+        print(f"{r['kind']:>9} {r['uploads']:>8} {r['p50']:14.1f} {r['p99']:8.1f} {r['max']:8.1f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,44 @@
+import pytest
+
+# Imported first: it points the app's storage at scratch directories and
+# selects thread hashing before any test imports app
+from benchmarks.bench_suite import start_fake_redis
+
+# Correctness tests for the server and ecolearn_core, run from the server
+# directory:
+#     python -m pytest                      # everything
+#     python -m pytest -m "not slow"        # skip server processes and re-index runs
+#     python -m pytest --redis-url redis://localhost:6379/15
+#
+# Redis tests use an in-process fakeredis server unless --redis-url is given,
+# and are skipped when neither redis nor fakeredis is installed. Timings live
+# in benchmarks/.
+
+
+def pytest_addoption(parser):
+    parser.addoption('--redis-url', help='Redis server for the Redis tests (default: in-process fakeredis); '
+                                         'keys go under fresh prefixes')
+    parser.addoption('--stress-workers', type=int, default=2, help='uvicorn workers in test_concurrent_uploads')
+    parser.addoption('--stress-copies', type=int, default=60, help='identical uploads fired at once')
+
+
+@pytest.fixture(scope='session')
+def redis_url(request) -> str:
+    pytest.importorskip('redis')
+    url = request.config.getoption('--redis-url')
+    if url:
+        return url
+    pytest.importorskip('fakeredis')
+    return start_fake_redis()
+
+
+@pytest.fixture(scope='session')
+def app_client():
+    """TestClient over server/app.py, shared by the session: the app's
+    shutdown closes its stores and hashing pool for good. Unhandled errors
+    come back as 500 responses."""
+    from fastapi.testclient import TestClient
+    import app
+
+    with TestClient(app.app, raise_server_exceptions=False) as client:
+        yield client
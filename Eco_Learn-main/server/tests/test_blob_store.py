@@ -0,0 +1,156 @@
+import hashlib
+import multiprocessing
+import os
+import random
+import time
+
+from benchmarks.bench_suite import synthetic_image
+from ecolearn_core.blob_store import BlobStore, file_digest, migrate
+
+# The content-addressed upload store (ecolearn_core/blob_store.py):
+#   app        the same photo accepted for two students is stored once; both
+#              /uploads URLs serve it with its content type, ETag and 304
+#   refcount   a blob is kept while any path maps to it and deleted with the
+#              last one
+#   race       PROCESSES processes add and remove paths over a few shared
+#              digests at once; afterwards every count matches its mappings
+#              and a blob file exists exactly for the referenced digests
+#   gc         mappings without a record go once older than the grace period
+#              (young ones stay); sweep removes stray and temporary files
+#   migrate    an uploads tree with repeated files moves into the store and
+#              every path still resolves to identical bytes
+
+PROCESSES = 4
+RACE_OPS = 300
+RACE_DIGESTS = 5
+MIGRATE_FILES = 120
+
+
+def write(path: str, data: bytes) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def disk_bytes(root: str) -> int:
+    return sum(os.path.getsize(os.path.join(directory, name))
+               for directory, _, names in os.walk(root) for name in names if not name.endswith('.sqlite3'))
+
+
+def open_store(root) -> BlobStore:
+    return BlobStore(os.path.join(root, 'blobs'), os.path.join(root, 'blobs.sqlite3'))
+
+
+def test_app_stores_shared_upload_once(app_client):
+    import app as app_module
+
+    data = synthetic_image(2500, (1024, 768), 'JPEG')
+    records = []
+    for student in ('blob-a', 'blob-b'):
+        resp = app_client.post('/upload-challenge-proof', data={'student_id': student, 'challenge_id': '1'},
+                               files={'file': ('tree.jpg', data, 'image/jpeg')})
+        assert resp.status_code == 200, resp.text
+        records.append(resp.json()['record'])
+    served = [app_client.get(record['url']) for record in records]
+    again = app_client.get(records[0]['url'], headers={'If-None-Match': served[0].headers.get('etag', '')})
+    blob = app_module.blob_store.blob_path(hashlib.sha256(data).hexdigest())
+    mapped = [app_module.blob_store.resolve(record['relative_path']) for record in records]
+    assert mapped == [blob, blob] and os.path.exists(blob)
+    for resp in served:
+        assert resp.status_code == 200 and resp.content == data
+        assert resp.headers['content-type'] == 'image/jpeg'
+    assert again.status_code == 304
+
+
+def test_refcount_keeps_blob_until_last_path(tmp_path):
+    store = open_store(tmp_path)
+    data = b'proof bytes'
+    digest = hashlib.sha256(data).hexdigest()
+    new = [store.add(write(str(tmp_path / 'in' / str(i)), data), f's{i}/challenge_1/p.jpg', digest)
+           for i in range(3)]
+    store.remove('s0/challenge_1/p.jpg')
+    store.remove('s1/challenge_1/p.jpg')
+    kept = os.path.exists(store.blob_path(digest))
+    store.remove('s2/challenge_1/p.jpg')
+    gone = not os.path.exists(store.blob_path(digest))
+    stats = store.stats()
+    store.close()
+    assert new == [True, False, False]
+    assert kept and gone and stats['blobs'] == 0
+    assert not os.listdir(tmp_path / 'in')
+
+
+def race_worker(args) -> None:
+    root, seed = args
+    store = open_store(root)
+    rnd = random.Random(seed)
+    mine = []
+    for op in range(RACE_OPS):
+        if mine and rnd.random() < 0.4:
+            store.remove(mine.pop(rnd.randrange(len(mine))))
+            continue
+        content = f"content {rnd.randrange(RACE_DIGESTS)}".encode()
+        path = f"p{seed}/challenge_1/{op}.jpg"
+        store.add(write(os.path.join(root, 'in', f'{seed}_{op}'), content), path,
+                  hashlib.sha256(content).hexdigest())
+        mine.append(path)
+    store.close()
+
+
+def test_concurrent_processes_keep_counts_consistent(tmp_path):
+    root = str(tmp_path)
+    with multiprocessing.get_context('spawn').Pool(PROCESSES) as pool:
+        pool.map(race_worker, [(root, seed) for seed in range(PROCESSES)])
+    store = open_store(root)
+    with store._lock:
+        refs = dict(store._conn.execute("SELECT digest, refs FROM blobs"))
+        mapped = {}
+        for (digest,) in store._conn.execute("SELECT digest FROM paths"):
+            mapped[digest] = mapped.get(digest, 0) + 1
+    on_disk = {name for _, _, names in os.walk(os.path.join(root, 'blobs')) for name in names}
+    store.close()
+    assert refs == mapped
+    assert on_disk == set(refs)
+
+
+def test_gc_drops_old_unmapped_and_sweeps(tmp_path):
+    store = open_store(tmp_path)
+    for i in range(4):
+        data = f"gc {i}".encode()
+        store.add(write(str(tmp_path / 'in' / str(i)), data), f"s/challenge_1/{i}.jpg",
+                  hashlib.sha256(data).hexdigest())
+    # 0 and 1 have records; 2 lost its record in a crash; 3 is still committing
+    with store._lock:
+        store._conn.execute("UPDATE paths SET created_at = created_at - 7200 WHERE relative_path != ?",
+                            ("s/challenge_1/3.jpg",))
+    leaf = os.path.dirname(store.blob_path('ab' * 32))
+    stray = [write(os.path.join(leaf, 'ab' * 32), b'orphan'), write(os.path.join(leaf, 'ab' * 32 + '.1.tmp'), b'x')]
+    for path in stray:
+        os.utime(path, (time.time() - 7200,) * 2)
+    counts = store.gc({"s/challenge_1/0.jpg", "s/challenge_1/1.jpg"}, grace=3600, sweep=True)
+    left = sorted(path for path, _ in store.paths())
+    store.close()
+    assert counts['unmapped'] == 1 and counts['swept'] == 2
+    assert left == ["s/challenge_1/0.jpg", "s/challenge_1/1.jpg", "s/challenge_1/3.jpg"]
+    assert not any(os.path.exists(path) for path in stray)
+
+
+def test_migrate_dedupes_uploads_tree(tmp_path):
+    uploads = str(tmp_path / 'uploads')
+    rnd = random.Random(25)
+    distinct = [synthetic_image(2600 + i, (800, 600), 'JPEG') for i in range(MIGRATE_FILES // 2)]
+    expected = {}
+    for i in range(MIGRATE_FILES):
+        # Half the files repeat a photo stored elsewhere (other student or challenge)
+        data = distinct[i % len(distinct)] if i < len(distinct) else rnd.choice(distinct)
+        relative_path = f"student{i % 7}/challenge_{i % 3}/20250301_120000_{i:06d}_p.jpg"
+        write(os.path.join(uploads, *relative_path.split('/')), data)
+        expected[relative_path] = hashlib.sha256(data).hexdigest()
+    store = open_store(tmp_path)
+    counts = migrate(store, uploads)
+    resolved = {path: file_digest(store.resolve(path)) for path in expected}
+    store.close()
+    assert resolved == expected
+    assert counts['files'] == MIGRATE_FILES and counts['new_blobs'] == len(distinct)
+    assert disk_bytes(uploads) == 0
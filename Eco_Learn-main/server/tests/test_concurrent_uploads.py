@@ -0,0 +1,159 @@
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from itertools import combinations
+
+import pytest
+from PIL import Image, ImageDraw
+
+from benchmarks.bench_suite import encode
+from ecolearn_core.blob_store import BlobStore, blob_index_path
+from ecolearn_core.hash_store import open_hash_store, store_path
+from ecolearn_core.image_hash import combined_int, compute_combined_hash, hamming_distance
+
+# Concurrent duplicate uploads against a multi-worker uvicorn server (needs
+# httpx and uvicorn). For each hash store a fresh `uvicorn app:app --workers N`
+# (--stress-workers) is started on a free port with its own storage, then:
+#   identical   --stress-copies requests upload the same bytes for one
+#               student at once, some of them through the batch endpoint
+#   near        re-encodes of one photo (different bytes, hashes within the
+#               duplicate threshold of each other) upload at once for another
+#               student, so the perceptual check rather than the digest index
+#               has to catch them
+# Each scenario must end with exactly one 200, only 409s besides, one record
+# in the store and one stored file. The requests spread over every worker, so
+# this covers both the per-worker locks and the store's cross-process
+# transactions / lock files. HASH_STORE=redis runs only with --redis-url.
+
+httpx = pytest.importorskip('httpx')
+pytest.importorskip('uvicorn')
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+THRESHOLD = 5  # default DUPLICATE_THRESHOLD (combined rule)
+BATCH_EVERY = 10  # every tenth identical upload goes through the batch endpoint
+NEAR = 20  # near-duplicate re-encodes fired at once
+
+
+def make_photo(seed: int, size=(1600, 1200)) -> Image.Image:
+    rnd = random.Random(seed)
+    image = Image.new('RGB', size, (90, 140, 70))
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = rnd.randrange(size[0]), rnd.randrange(size[1])
+        r = rnd.randrange(40, 300)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rnd.randrange(256) for _ in range(3)))
+    return image
+
+
+def near_duplicates(image: Image.Image, count: int) -> list:
+    """Distinct JPEG encodings of image whose hashes are all pairwise within
+    THRESHOLD, so exactly one of them may be accepted."""
+    variants = {}
+    for quality in range(60, 100):
+        data = encode(image, 'JPEG', quality=quality)
+        variants.setdefault(data, combined_int(compute_combined_hash(data)))
+    chosen = []
+    for data, hashes in variants.items():
+        if all(hamming_distance(hashes, other) <= THRESHOLD for _, other in chosen):
+            chosen.append((data, hashes))
+    assert all(hamming_distance(a, b) <= THRESHOLD for (_, a), (_, b) in combinations(chosen, 2))
+    return [data for data, _ in chosen][:count]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(store: str, workers: int, root: str, redis_url: str = None):
+    port = free_port()
+    env = {**os.environ,
+           'STORAGE_DIR': os.path.join(root, 'storage'),
+           'UPLOAD_ROOT': os.path.join(root, 'uploads'),
+           'DERIVATIVE_ROOT': os.path.join(root, 'derivatives'),
+           'BLOB_ROOT': os.path.join(root, 'blobs'),
+           'HASH_STORE': store,
+           'HASH_EXECUTOR': 'thread',
+           # enough queue for every copy: this test is about duplicates, not 503s
+           'HASH_MAX_PENDING': '1000'}
+    if redis_url:
+        env['REDIS_URL'] = redis_url
+    proc = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'app:app', '--port', str(port),
+                             '--workers', str(workers), '--log-level', 'warning'],
+                            cwd=SERVER_DIR, env=env)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if httpx.get(f'{base_url}/health', timeout=1).status_code == 200:
+                return proc, base_url
+        except httpx.TransportError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"server for HASH_STORE={store} did not start")
+
+
+async def post_all(base_url: str, student: str, payloads: list) -> list:
+    """Upload every payload at once; returns one status per file."""
+    limits = httpx.Limits(max_connections=len(payloads), max_keepalive_connections=0)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+        async def one(index: int, data: bytes) -> list:
+            form = {'student_id': student, 'challenge_id': str(index % 3)}
+            if index % BATCH_EVERY == BATCH_EVERY - 1:
+                resp = await client.post('/upload-challenge-proofs', data=form,
+                                         files=[('files', (f'b{index}.jpg', data, 'image/jpeg'))])
+                return [result['status'] for result in resp.json()['results']]
+            resp = await client.post('/upload-challenge-proof', data=form,
+                                     files={'file': (f'p{index}.jpg', data, 'image/jpeg')})
+            return [resp.status_code]
+
+        results = await asyncio.gather(*(one(i, data) for i, data in enumerate(payloads)))
+    return [status for statuses in results for status in statuses]
+
+
+@pytest.fixture(scope='module')
+def payloads(request) -> dict:
+    copies = request.config.getoption('--stress-copies')
+    return {'same': [encode(make_photo(seed=1), 'JPEG', quality=90)] * copies,
+            'near': near_duplicates(make_photo(seed=2), NEAR)}
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize('store', ['sqlite', 'log', 'json', 'redis'])
+def test_one_upload_accepted_across_workers(request, tmp_path, payloads, store):
+    redis_url = request.config.getoption('--redis-url')
+    if store == 'redis' and not redis_url:
+        pytest.skip('needs --redis-url: the workers are separate processes')
+    workers = request.config.getoption('--stress-workers')
+    root = str(tmp_path)
+    prefix = f'{store}-{os.getpid()}'
+    proc, base_url = start_server(store, workers, root, redis_url)
+    try:
+        statuses = {scenario: asyncio.run(post_all(base_url, f'{prefix}-{scenario}', files))
+                    for scenario, files in payloads.items()}
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+    path = redis_url if store == 'redis' else store_path(store, os.path.join(root, 'storage'))
+    hash_store = open_hash_store(store, path)
+    blob_store = BlobStore(os.path.join(root, 'blobs'), blob_index_path(os.path.join(root, 'storage')))
+    mapped = [relative_path for relative_path, _ in blob_store.paths()]
+    stored = {}
+    for scenario in payloads:
+        student = f'{prefix}-{scenario}'
+        files = (sum(len(names) for _, _, names in os.walk(os.path.join(root, 'uploads', student)))
+                 + sum(path.startswith(f'{student}/') for path in mapped))
+        stored[scenario] = (hash_store.count_images(student), files)
+    blob_store.close()
+    hash_store.close()
+
+    for scenario, results in statuses.items():
+        assert results.count(200) == 1, f"{scenario}: {sorted(results)}"
+        assert set(results) <= {200, 409}, f"{scenario}: {sorted(set(results))}"
+        assert stored[scenario] == (1, 1), f"{scenario}: (records, files) {stored[scenario]}"
@@ -0,0 +1,92 @@
+import io
+import os
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+from benchmarks.bench_suite import RESOLUTIONS, encode, synthetic_image
+from ecolearn_core.image_hash import (
+    _DCT_TOLERANCE, _low_freq_numpy, _low_freq_python, load_grayscale_thumbnail, perceptual_hash,
+)
+
+# The two pHash DCT backends give bit-identical hashes. perceptual_hash runs
+# with backend='numpy' and backend='python' on a fixed corpus:
+#   - seeded synthetic photos (bench_suite.synthetic_image) in JPEG, PNG and
+#     WebP, at VGA and Full HD;
+#   - images that put many coefficients on the median: flat grey, black and
+#     white, gradients, stripes, a checkerboard, a single dot and noise;
+#   - the sample upload checked into uploads/.
+# Each image is hashed from the production 64x64 thumbnail and from the full
+# frame, at hash_size 8 and 16.
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEEDS = 24  # synthetic photos per format at VGA
+HASH_SIZES = (8, 16)
+HIGHFREQ_FACTOR = 4
+
+
+def edge_cases() -> dict:
+    size = (256, 256)
+    rnd = random.Random(1)
+    images = {
+        'grey': Image.new('L', size, 128),
+        'black': Image.new('L', size, 0),
+        'white': Image.new('L', size, 255),
+        'gradient': Image.linear_gradient('L').resize(size),
+        'gradient_t': Image.linear_gradient('L').resize(size).transpose(Image.Transpose.TRANSPOSE),
+        'radial': Image.radial_gradient('L').resize(size),
+        'noise': Image.frombytes('L', size, bytes(rnd.randrange(256) for _ in range(size[0] * size[1]))),
+    }
+    stripes, checker, dot = (Image.new('L', size, 0) for _ in range(3))
+    draw = ImageDraw.Draw(stripes)
+    for x in range(0, size[0], 32):
+        draw.rectangle((x, 0, x + 15, size[1]), fill=255)
+    draw = ImageDraw.Draw(checker)
+    for x in range(0, size[0], 32):
+        for y in range(0, size[1], 32):
+            if (x + y) // 32 % 2:
+                draw.rectangle((x, y, x + 31, y + 31), fill=255)
+    ImageDraw.Draw(dot).ellipse((120, 120, 136, 136), fill=255)
+    images.update(stripes=stripes, checkerboard=checker, dot=dot)
+    return images
+
+
+@pytest.fixture(scope='module')
+def frames() -> list:
+    """(name, source, image) for every corpus image, as thumbnail and frame."""
+    images = {}
+    for name, size in (('vga', RESOLUTIONS['vga']), ('fhd', RESOLUTIONS['fhd'])):
+        for fmt in ('JPEG', 'PNG', 'WEBP'):
+            for seed in range(SEEDS if name == 'vga' else max(1, SEEDS // 8)):
+                images[f"{name}/{fmt.lower()}/{seed}"] = synthetic_image(3000 + seed, size, fmt)
+    images.update((name, encode(image)) for name, image in edge_cases().items())
+    for directory, _, names in os.walk(os.path.join(SERVER_DIR, 'uploads')):
+        for name in sorted(names):
+            with open(os.path.join(directory, name), 'rb') as f:
+                images[f"uploads/{name}"] = f.read()
+    return [(name, source, frame) for name, data in images.items()
+            for source, frame in (('thumbnail', load_grayscale_thumbnail(data)), ('frame', Image.open(io.BytesIO(data))))]
+
+
+def coefficients(image: Image.Image, hash_size: int, backend) -> list:
+    """The low-frequency block perceptual_hash thresholds, before thresholding."""
+    size = hash_size * HIGHFREQ_FACTOR
+    pixels = list(image.convert('L').resize((size, size), Image.Resampling.LANCZOS).getdata())
+    return backend(pixels, size, hash_size)
+
+
+@pytest.mark.parametrize('hash_size', HASH_SIZES)
+def test_backends_bit_identical(frames, hash_size):
+    mismatches = [f"{name} {source}" for name, source, frame in frames
+                  if perceptual_hash(frame, hash_size, HIGHFREQ_FACTOR, backend='numpy')
+                  != perceptual_hash(frame, hash_size, HIGHFREQ_FACTOR, backend='python')]
+    assert not mismatches, f"{len(mismatches)}/{len(frames)} differ: {mismatches[:10]}"
+
+
+@pytest.mark.parametrize('hash_size', HASH_SIZES)
+def test_backend_noise_below_tolerance(frames, hash_size):
+    max_diff = max(abs(a - b) for _, _, frame in frames
+                   for a, b in zip(coefficients(frame, hash_size, _low_freq_numpy),
+                                   coefficients(frame, hash_size, _low_freq_python)))
+    assert max_diff * 1000 < _DCT_TOLERANCE, f"largest coefficient difference {max_diff:.1e}"
@@ -0,0 +1,139 @@
+import json
+import sqlite3
+
+import pytest
+from PIL import Image
+
+from benchmarks.bench_suite import encode
+from ecolearn_core.hash_index import HashIndex
+from ecolearn_core.hash_store import JsonHashStore, LogHashStore, SqliteHashStore
+from ecolearn_core.image_hash import compute_combined_hash
+from ecolearn_core.scoring import HashScorer, has_phash, pack_components, split_components
+
+# Full hashes with a zero aHash keep their pHash. A flat gray image hashes to
+# aHash = dHash = 0 and a pHash with only the DC bit set, and so do fine
+# low-contrast patterns. As a combined int such a hash fits in 128 bits, like
+# a hash whose pHash failed, so pHash presence has to come from the hash dict
+# or the hex length (scoring.has_phash).
+
+THRESHOLD = 5
+# A dHash of 0x0f0f...: far from 0 in dHash, so a mis-split pair is not a duplicate
+DHASH = '0f' * 8
+FULL = {"aHash": '0' * 16, "dHash": DHASH, "pHash": 'a5' * 8, "combined": '0' * 16 + DHASH + 'a5' * 8}
+PARTIAL = {"aHash": '0' * 16, "dHash": DHASH, "pHash": '', "combined": '0' * 16 + DHASH}
+STORES = {
+    'sqlite': lambda tmp_path, name: SqliteHashStore(str(tmp_path / f'{name}.sqlite3')),
+    'log': lambda tmp_path, name: LogHashStore(str(tmp_path / f'{name}.jsonl')),
+    'json': lambda tmp_path, name: JsonHashStore(str(tmp_path / f'{name}.json')),
+}
+
+
+@pytest.fixture(scope='module')
+def hashes() -> dict:
+    # One-pixel checkerboard of 120/136: averages to flat gray when resized
+    checker = Image.frombytes('L', (640, 480), bytes(120 if (x + y) % 2 else 136
+                                                      for y in range(480) for x in range(640)))
+    images = {'gray': Image.new('RGB', (640, 480), (128, 128, 128)), 'checkerboard': checker}
+    return {name: compute_combined_hash(encode(image)) for name, image in images.items()}
+
+
+@pytest.fixture(params=['sqlite', 'log', 'json', 'redis'])
+def open_store(request, tmp_path):
+    """Opens fresh stores of one kind: open_store(name)."""
+    if request.param == 'redis':
+        from ecolearn_core.redis_store import RedisHashStore
+
+        url = request.getfixturevalue('redis_url')
+        return lambda name: RedisHashStore(url, prefix=f'flat:{tmp_path.name}:{name}:')
+    return lambda name: STORES[request.param](tmp_path, name)
+
+
+def make_record(filename: str, hash_dict: dict) -> dict:
+    return {"challenge_id": "c1", "filename": filename, "uploaded_at": "20250101_000000_000000",
+            "hash": hash_dict}
+
+
+def test_flat_hashes_fit_in_128_bits(hashes):
+    assert all(not int(h['combined'], 16) >> 128 for h in hashes.values())
+    assert all(has_phash(h) for h in hashes.values())
+
+
+@pytest.mark.parametrize('name', ['gray', 'checkerboard'])
+def test_split_keeps_phash(hashes, name):
+    hash_dict = hashes[name]
+    components = split_components(hash_dict)
+    assert components[1] == int(hash_dict['dHash'], 16)
+    assert components[2] == int(hash_dict['pHash'], 16)
+    assert HashScorer('combined', THRESHOLD).probes_bands(hash_dict)
+    _, present = pack_components([hash_dict, hash_dict['combined']])
+    assert present.all()
+
+
+@pytest.mark.parametrize('stored, new', [(PARTIAL, FULL), (FULL, PARTIAL)], ids=['partial-stored', 'full-stored'])
+def test_partial_matches_full_on_every_store(open_store, stored, new):
+    store = open_store('partial')
+    store.add_image('s1', make_record('a.png', stored))
+    match = store.find_duplicate(new, THRESHOLD, 'student', 's1', 'c1')
+    store.close()
+    assert match is not None and match['distance'] == 0
+
+
+def test_flat_reupload_on_every_store(open_store, hashes):
+    store = open_store('reupload')
+    store.add_image('s1', make_record('a.png', hashes['gray']))
+    match = store.find_duplicate(dict(hashes['gray']), THRESHOLD, 'student', 's1', 'c1')
+    store.close()
+    assert match is not None and match['distance'] == 0
+
+
+def test_sqlite_unpadded_hex_migrated(tmp_path, hashes):
+    path = str(tmp_path / 'old.sqlite3')
+    store = SqliteHashStore(path)
+    for name, hash_dict in hashes.items():
+        store.add_image('s1', make_record(f"{name}.png", hash_dict))
+    store.close()
+    with sqlite3.connect(path) as conn:  # as older versions wrote it
+        conn.execute("UPDATE images SET combined = ltrim(combined, '0')")
+        conn.execute("PRAGMA user_version = 0")
+    store = SqliteHashStore(path)
+    with sqlite3.connect(path) as conn:
+        widths = {row[0] for row in conn.execute("SELECT length(combined) FROM images")}
+    match = store.find_duplicate(hashes['gray'], THRESHOLD, 'student', 's1', 'c1')
+    store.close()
+    assert widths == {48}
+    assert match is not None
+
+
+def test_redis_old_entries_rebuilt(redis_url, tmp_path, hashes):
+    from ecolearn_core.redis_store import RedisHashStore
+
+    prefix = f'flatold:{tmp_path.name}:'
+    store = RedisHashStore(redis_url, prefix=prefix)
+    store.add_image('s1', make_record('gray.png', hashes['gray']))
+    client = store._redis
+    # Entries as the previous layout wrote them: '0'-padded, no format key
+    key = store._key('h', 'student', 's1')
+    client.set(key, client.get(key).replace('-', '0'))
+    client.delete(store._key('h_format'))
+    match = RedisHashStore(redis_url, prefix=prefix).find_duplicate(hashes['gray'], THRESHOLD, 'student', 's1', 'c1')
+    assert match is not None and match['distance'] == 0
+    assert client.get(store._key('h_format')) is not None
+
+
+def test_index_keeps_presence_through_compaction_and_save(tmp_path, hashes):
+    index = HashIndex()
+    index.insert('flat', hashes['gray'])
+    index.insert('partial', PARTIAL)
+    for i in range(2100):  # enough deletions to compact
+        index.insert(f"tmp{i}", i << 130)
+        index.delete(f"tmp{i}")
+    path = str(tmp_path / 'index.json')
+    index.save(path)
+    with open(path) as f:
+        widths = sorted(len(value) for _, value in json.load(f)["entries"])
+    loaded = HashIndex.load(path)
+    scorer = HashScorer('combined', THRESHOLD)
+    assert widths == [32, 48]
+    assert loaded.query(hashes['gray'], scorer)[:1] == [('flat', 0)]
+    full = {**PARTIAL, "pHash": 'ff' * 8, "combined": PARTIAL["combined"] + 'ff' * 8}
+    assert ('partial', 0) in loaded.query(full, scorer)
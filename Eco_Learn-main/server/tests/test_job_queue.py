@@ -0,0 +1,215 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+from ecolearn_core.job_queue import JobQueue, MemoryJobStore, RetryLater, SqliteJobStore
+
+# The background job queue (ecolearn_core/job_queue.py), for the memory and
+# sqlite stores. Each test runs its scenario on a fresh event loop.
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_store(request, tmp_path):
+    """make_store(history=1000): a fresh store of the parametrized kind; the
+    sqlite ones share a file, as the processes of one machine do."""
+    def make(history: int = 1000):
+        if request.param == 'memory':
+            return MemoryJobStore(history)
+        return SqliteJobStore(str(tmp_path / 'jobs.sqlite3'), history)
+
+    make.durable = request.param == 'sqlite'
+    return make
+
+
+async def wait_for(queue: JobQueue, job_ids: list, timeout: float = 20) -> list:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        jobs = [queue.get(job_id) for job_id in job_ids]
+        if all(job and job['status'] in ('succeeded', 'failed') for job in jobs):
+            return jobs
+        await asyncio.sleep(0.01)
+    return [queue.get(job_id) for job_id in job_ids]
+
+
+async def noop(payload):
+    return payload
+
+
+def test_retry_with_backoff(make_store):
+    calls = {}
+
+    async def flaky(payload):
+        calls[payload['n']] = calls.get(payload['n'], 0) + 1
+        if calls[payload['n']] <= payload['fail']:
+            raise ValueError(f"failure {calls[payload['n']]}")
+        return {"n": payload['n']}
+
+    async def scenario():
+        queue = JobQueue(make_store(), workers=4, backoff=0.05, poll=0.05)
+        queue.register('flaky', flaky)
+        start = time.perf_counter()
+        retried = await queue.enqueue('flaky', {'n': 1, 'fail': 2})
+        failing = await queue.enqueue('flaky', {'n': 2, 'fail': 9})
+        jobs = await wait_for(queue, [retried, failing])
+        elapsed = time.perf_counter() - start
+        await queue.drain(5)
+        queue.store.close()
+        return jobs, elapsed
+
+    (retried, failing), elapsed = asyncio.run(scenario())
+    assert (retried['status'], retried['attempts'], retried['result']) == ('succeeded', 3, {"n": 1})
+    assert elapsed >= 0.05 + 0.1  # backoff before the second and third attempts
+    assert (failing['status'], failing['attempts'], failing['error']) == ('failed', 3, 'ValueError: failure 3')
+
+
+def test_retry_later_uses_no_attempt(make_store):
+    calls = []
+
+    async def saturated(payload):
+        calls.append(1)
+        if len(calls) <= 3:
+            raise RetryLater(0.01)
+        return "done"
+
+    async def scenario():
+        queue = JobQueue(make_store(), poll=0.05)
+        queue.register('busy', saturated)
+        job, = await wait_for(queue, [await queue.enqueue('busy', {})])
+        await queue.drain(5)
+        queue.store.close()
+        return job
+
+    job = asyncio.run(scenario())
+    assert (job['status'], job['attempts'], len(calls)) == ('succeeded', 1, 4)
+
+
+def test_concurrency_limit(make_store):
+    running, peak = [0], [0]
+
+    async def slow(payload):
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.05)
+        running[0] -= 1
+
+    async def scenario():
+        queue = JobQueue(make_store(), workers=4, poll=0.05)
+        queue.register('slow', slow, concurrency=2)
+        await wait_for(queue, [await queue.enqueue('slow', {}) for _ in range(8)])
+        await queue.drain(5)
+        queue.store.close()
+
+    asyncio.run(scenario())
+    assert peak[0] == 2
+
+
+def test_drain(make_store):
+    async def slow(payload):
+        await asyncio.sleep(0.05)
+
+    async def scenario():
+        queue = JobQueue(make_store(), workers=4, poll=0.05)
+        queue.register('slow', slow, concurrency=2)
+        drained = [await queue.enqueue('slow', {}) for _ in range(6)]
+        await asyncio.sleep(0.01)
+        left = await queue.drain(10)
+        states = [queue.get(job_id)['status'] for job_id in drained]
+        queue.store.close()
+        after = None
+        if make_store.durable:
+            restarted = JobQueue(make_store(), workers=4, poll=0.05)
+            restarted.register('slow', slow, concurrency=2)
+            restarted.start()
+            after = [job['status'] for job in await wait_for(restarted, drained)]
+            await restarted.drain(5)
+            restarted.store.close()
+        return left, states, after
+
+    left, states, after = asyncio.run(scenario())
+    assert left == 0
+    if make_store.durable:
+        # Running jobs finish; queued ones wait in the file for the next start
+        assert 'running' not in states and 'queued' in states
+        assert set(after) == {'succeeded'}
+    else:
+        assert set(states) == {'succeeded'}
+
+
+def test_history_keeps_last_finished(make_store):
+    async def scenario():
+        queue = JobQueue(make_store(history=5), poll=0.05)
+        queue.register('noop', noop)
+        job_ids = [await queue.enqueue('noop', {'n': n}) for n in range(12)]
+        await asyncio.sleep(0.3)
+        kept = [job_id for job_id in job_ids if queue.get(job_id)]
+        await queue.drain(5)
+        queue.store.close()
+        return job_ids, kept
+
+    job_ids, kept = asyncio.run(scenario())
+    assert kept == job_ids[-5:]
+
+
+def test_durable_enqueue_and_lease_recovery(tmp_path):
+    path = str(tmp_path / 'durable.sqlite3')
+    runs = []
+
+    async def record(payload):
+        runs.append(payload['n'])
+
+    async def scenario():
+        # Enqueued by a process without workers: stored, not run
+        producer = JobQueue(SqliteJobStore(path), workers=0)
+        producer.register('record', record)
+        job_id = await producer.enqueue('record', {'n': 1})
+        producer.store.close()
+        other = SqliteJobStore(path)
+        committed = (other.get(job_id) or {}).get('status')
+        # A "dead" process claims it and never finishes
+        claimed = other.claim(['record'], time.time(), 0.2)
+        other.close()
+
+        queue = JobQueue(SqliteJobStore(path), lease=0.2, poll=0.05)
+        queue.register('record', record)
+        queue.start()
+        await asyncio.sleep(0.1)
+        early = queue.get(job_id)['status']
+        job, = await wait_for(queue, [job_id], timeout=5)
+        await queue.drain(5)
+        queue.store.close()
+        return committed, claimed, early, job
+
+    committed, claimed, early, job = asyncio.run(scenario())
+    assert committed == 'queued'  # committed before enqueue() returned
+    assert claimed is not None and early == 'running'
+    assert (job['status'], job['attempts'], runs) == ('succeeded', 2, [1])
+
+
+def test_sqlite_writes_leave_the_loop_running(tmp_path):
+    """While another connection holds the write lock, enqueue() waits in a
+    thread and the event loop keeps running."""
+    path = str(tmp_path / 'offloop.sqlite3')
+
+    async def scenario():
+        queue = JobQueue(SqliteJobStore(path), workers=1, poll=0.05)
+        queue.register('noop', noop)
+        holder = sqlite3.connect(path, isolation_level=None)
+        holder.execute("BEGIN IMMEDIATE")
+        enqueued = asyncio.ensure_future(queue.enqueue('noop', {}))
+        ticks, deadline = 0, time.perf_counter() + 0.3
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+            ticks += 1
+        blocked = not enqueued.done()
+        holder.rollback()
+        holder.close()
+        job, = await wait_for(queue, [await enqueued], timeout=5)
+        await queue.drain(5)
+        queue.store.close()
+        return blocked, ticks, job
+
+    blocked, ticks, job = asyncio.run(scenario())
+    assert blocked and ticks >= 10
+    assert job['status'] == 'succeeded'
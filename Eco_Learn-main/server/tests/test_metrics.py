@@ -0,0 +1,24 @@
+import asyncio
+
+# /metrics (server/app.py): the gauges query the hash and job stores, so the
+# registry is rendered in a thread rather than on the event loop.
+
+
+def test_gauges_read_stores_off_the_event_loop(app_client, monkeypatch):
+    import app as app_module
+
+    loops = []
+
+    def count_images(*args, **kwargs):
+        try:
+            loops.append(asyncio.get_running_loop())
+        except RuntimeError:  # no loop in this thread
+            loops.append(None)
+        return 7
+
+    monkeypatch.setattr(app_module.store, 'count_images', count_images)
+    resp = app_client.get('/metrics')
+    assert resp.status_code == 200
+    assert 'eco_hash_store_images 7\n' in resp.text
+    assert 'eco_jobs_pending ' in resp.text
+    assert loops == [None]
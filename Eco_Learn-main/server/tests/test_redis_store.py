@@ -0,0 +1,154 @@
+import multiprocessing
+import os
+import random
+import time
+import uuid
+
+import pytest
+
+from ecolearn_core.hash_store import DEDUP_SCOPES, SqliteHashStore
+from ecolearn_core.scoring import HashScorer
+
+# RedisHashStore against SqliteHashStore and under concurrent writers:
+#   parity    the same inserts, duplicate checks, digest lookups and listing
+#             pages give identical answers on SQLite and Redis, for every
+#             dedup scope, with band probes (combined rule) and with full
+#             scans (a vote rule too loose for band probes)
+#   backfill  records stored before the per-scope hash sets existed are
+#             found by a scan once a new store object fills the sets in
+#   race      PROCESSES processes each upload near-duplicate variants of the
+#             same GROUPS images at once; add_image_if_unique accepts
+#             exactly one per group
+
+PROCESSES = 6
+GROUPS = 12
+THRESHOLD = 5
+# Band bound 10 * 3 / 2 * 3 = 45 >= 12, so every check scans the scope
+LOOSE_SCORER = HashScorer('vote', thresholds=(10, 10, 10), votes=2)
+SCORERS = {'combined': THRESHOLD, 'vote': LOOSE_SCORER}
+
+
+def hash_dict(value: int) -> dict:
+    return {"combined": f"{value:048x}"}
+
+
+def flip_bits(value: int, rnd: random.Random, count: int) -> int:
+    for bit in rnd.sample(range(192), count):
+        value ^= 1 << bit
+    return value
+
+
+def make_record(challenge_id: str, filename: str, value: int, institution_id: str = None,
+                uploaded_at: str = '20250101_000000_000000') -> dict:
+    record = {"challenge_id": challenge_id, "filename": filename, "uploaded_at": uploaded_at,
+              "hash": hash_dict(value), "sha256": f"{value:064x}"[-64:]}
+    if institution_id:
+        record["institution_id"] = institution_id
+    return record
+
+
+def replay(store, bases: list, threshold, scope: str) -> list:
+    """Every answer of store to a seeded sequence of writes and lookups."""
+    rnd, out = random.Random(5), []
+    for i in range(120):
+        base = bases[rnd.randrange(len(bases))]
+        value = flip_bits(base, rnd, rnd.choice((0, 1, 3, 7, 20)))
+        student, challenge = f's{rnd.randrange(4)}', f'c{rnd.randrange(3)}'
+        institution = rnd.choice((None, 'uni-a', 'uni-b'))
+        record = make_record(challenge, f'f{i}.png', value, institution,
+                             uploaded_at=f'2025010{1 + i % 5}_000000_{i:06d}')
+        if i % 10 == 9:
+            batch = [(student, record)] + [
+                (f's{rnd.randrange(4)}', make_record(challenge, f'f{i}b{j}.png', flip_bits(value, rnd, j)))
+                for j in range(3)]
+            out.append(store.add_images_if_unique(batch, threshold, scope))
+        else:
+            out.append(store.add_image_if_unique(student, record, threshold, scope))
+        out.append(store.find_duplicate(hash_dict(flip_bits(value, rnd, 2)), threshold, scope,
+                                        student, challenge, institution))
+        out.append(store.find_by_digest(record['sha256'], scope, student, challenge, institution))
+    for student in ('s0', 's1', 's2', 's3'):
+        out.append((store.list_images(student), store.count_images(student), store.student_version(student)))
+        cursor, pages = None, []
+        while True:
+            page, cursor = store.list_images_page(student, cursor, 7, since='20250102', until='20250105')
+            pages.append(page)
+            if cursor is None:
+                break
+        # Positional cursors (Redis, log/json stores) may end on an empty
+        # page that SQLite's id cursor skips
+        while len(pages) > 1 and not pages[-1]:
+            pages.pop()
+        out.append(pages)
+        out.append(store.list_images_page(student, challenge_id='c1'))
+    out.append(store.count_images())
+    return out
+
+
+@pytest.mark.parametrize('rule', list(SCORERS))
+@pytest.mark.parametrize('scope', DEDUP_SCOPES)
+def test_parity_with_sqlite(redis_url, tmp_path, scope, rule):
+    from ecolearn_core.redis_store import RedisHashStore
+
+    rnd = random.Random(11)
+    bases = [rnd.getrandbits(192) for _ in range(20)]
+    outputs = []
+    for store in (SqliteHashStore(str(tmp_path / 'parity.sqlite3')),
+                  RedisHashStore(redis_url, prefix=f'check:{uuid.uuid4().hex[:8]}:')):
+        outputs.append(replay(store, bases, SCORERS[rule], scope))
+        store.close()
+    assert outputs[0] == outputs[1]
+
+
+def test_backfill_finds_old_records(redis_url):
+    from ecolearn_core.redis_store import RedisHashStore
+
+    rnd = random.Random(13)
+    prefix = f'backfill:{uuid.uuid4().hex[:8]}:'
+    store = RedisHashStore(redis_url, prefix=prefix)
+    values = [rnd.getrandbits(192) for _ in range(50)]
+    store.add_images([(f's{i % 5}', make_record(f'c{i % 2}', f'f{i}.png', value)) for i, value in enumerate(values)])
+    # As written before the h:* sets existed
+    store._redis.delete(*store._redis.keys(prefix + 'h:*'))
+    store.close()
+    store = RedisHashStore(redis_url, prefix=prefix)
+    found = [store.find_duplicate(hash_dict(flip_bits(value, rnd, 3)), LOOSE_SCORER, 'challenge', 'other', f'c{i % 2}')
+             for i, value in enumerate(values)]
+    store.close()
+    assert [match and match['filename'] for match in found] == [f'f{i}.png' for i in range(len(values))]
+
+
+def race_worker(url, prefix, values, start_at, queue):
+    from ecolearn_core.redis_store import RedisHashStore
+
+    store = RedisHashStore(url, prefix=prefix)
+    rnd = random.Random(os.getpid())
+    accepted = 0
+    while time.time() < start_at:
+        time.sleep(0.001)
+    for group, value in enumerate(values):
+        record = make_record('c1', f'{os.getpid()}_{group}.png', flip_bits(value, rnd, rnd.randint(0, 2)))
+        record['sha256'] = None  # near-duplicates, not byte-identical
+        match, _ = store.add_image_if_unique('racer', record, THRESHOLD, 'student')
+        accepted += match is None
+    queue.put(accepted)
+
+
+def test_concurrent_processes_accept_one_per_group(redis_url):
+    from ecolearn_core.redis_store import RedisHashStore
+
+    rnd = random.Random(3)
+    values = [rnd.getrandbits(192) for _ in range(GROUPS)]
+    prefix = f'race:{uuid.uuid4().hex[:8]}:'
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    start_at = time.time() + 2.0  # let every process import and connect first
+    procs = [ctx.Process(target=race_worker, args=(redis_url, prefix, values, start_at, queue))
+             for _ in range(PROCESSES)]
+    for proc in procs:
+        proc.start()
+    accepted = sum(queue.get(timeout=120) for _ in procs)
+    for proc in procs:
+        proc.join()
+    assert accepted == GROUPS
+    assert RedisHashStore(redis_url, prefix=prefix).count_images('racer') == GROUPS
@@ -0,0 +1,118 @@
+import os
+import random
+import signal
+import sqlite3
+import subprocess
+import sys
+import time
+
+import pytest
+
+from benchmarks.bench_suite import synthetic_image
+from ecolearn_core.hash_store import open_hash_store, store_path
+from ecolearn_core.image_hash import HASH_SCHEMA, compute_combined_hash
+
+# The offline re-index CLI (python -m ecolearn_core.reindex). For each store
+# kind a throwaway uploads tree of synthetic JPEGs is built under
+# student/challenge_<id>/, plus a store whose records carry stale pre-schema
+# hashes and metadata (url, variants, institution_id) that must survive. Two
+# records point at deleted files and a few files have no record. The CLI is
+# interrupted with SIGINT once its journal holds some results, then re-run.
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FILES = 200
+STUDENTS = 6
+ORPHANS = 5
+MISSING = 2
+WORKERS = 2
+
+
+def build_tree(root: str, kind: str, files: int) -> dict:
+    """Uploads tree and legacy store; returns {relative_path: expected hash}."""
+    uploads, storage = os.path.join(root, 'uploads'), os.path.join(root, 'storage')
+    os.makedirs(storage)
+    rnd = random.Random(22)
+    store = open_hash_store(kind, store_path(kind, storage))
+    expected, items = {}, []
+    for i in range(files + MISSING):
+        student, challenge = f'student{i % STUDENTS}', str(i % 3)
+        name = f'20250301_1200{i // 60 % 60:02d}_{i:06d}_p{i}.jpg'
+        relative_path = f'{student}/challenge_{challenge}/{name}'
+        data = synthetic_image(500 + i, (rnd.randrange(320, 900), rnd.randrange(240, 700)), 'JPEG')
+        stale = compute_combined_hash(data)
+        stale.pop('schema')
+        stale['combined'] = f"{int(stale['combined'], 16) ^ rnd.getrandbits(192):048x}"
+        record = {"challenge_id": challenge, "filename": name, "relative_path": relative_path,
+                  "url": f"/uploads/{relative_path}", "uploaded_at": name[:22], "file_size": len(data),
+                  "sha256": None, "hash": stale, "institution_id": f'uni{i % 2}',
+                  "variants": {"thumb": f"/derivatives/{relative_path}.thumb.webp"}}
+        if i >= files:  # record whose file was deleted
+            items.append((student, record))
+            continue
+        os.makedirs(os.path.dirname(os.path.join(uploads, relative_path)), exist_ok=True)
+        with open(os.path.join(uploads, relative_path), 'wb') as f:
+            f.write(data)
+        expected[relative_path] = compute_combined_hash(data)
+        if i >= ORPHANS:
+            items.append((student, record))
+    store.add_images(items)
+    store.close()
+    return expected
+
+
+def reindex_cmd(root: str, kind: str, workers: int, chunk: int) -> list:
+    return [sys.executable, '-m', 'ecolearn_core.reindex', '--store', kind,
+            '--uploads', os.path.join(root, 'uploads'), '--storage', os.path.join(root, 'storage'),
+            '--workers', str(workers), '--chunk', str(chunk)]
+
+
+def interrupt_midway(cmd: list, journal: str, min_rows: int) -> tuple:
+    """Start cmd, SIGINT it once the journal has min_rows; (exit code, rows)."""
+    proc = subprocess.Popen(cmd, cwd=SERVER_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    rows, deadline = 0, time.time() + 300
+    while proc.poll() is None and time.time() < deadline:
+        time.sleep(0.05)
+        try:
+            with sqlite3.connect(journal) as conn:
+                rows = conn.execute("SELECT COUNT(*) FROM hashed").fetchone()[0]
+        except sqlite3.Error:
+            continue
+        if rows >= min_rows:
+            proc.send_signal(signal.SIGINT)
+            break
+    proc.communicate(timeout=120)
+    with sqlite3.connect(journal) as conn:
+        rows = conn.execute("SELECT COUNT(*) FROM hashed").fetchone()[0]
+    return proc.returncode, rows
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize('kind', ['sqlite', 'log', 'json'])
+def test_interrupted_reindex_resumes(tmp_path, kind):
+    root = str(tmp_path)
+    expected = build_tree(root, kind, FILES)
+    path = store_path(kind, os.path.join(root, 'storage'))
+    journal = f"{path}.reindex.sqlite3"
+
+    code, rows = interrupt_midway(reindex_cmd(root, kind, WORKERS, 16), journal, FILES // 3)
+    assert code == 130 and 0 < rows < FILES, f"exit {code}, {rows}/{FILES} hashed"
+
+    resumed = subprocess.run(reindex_cmd(root, kind, WORKERS, 16), cwd=SERVER_DIR, capture_output=True, text=True)
+    assert resumed.returncode == 0, resumed.stderr
+    assert f"{rows} already hashed" in resumed.stderr and f"{FILES - rows} to hash" in resumed.stderr
+    assert not os.path.exists(journal)
+
+    store = open_hash_store(kind, path)
+    records = {record['relative_path']: record
+               for student_id in store.student_ids() for record in store.list_images(student_id)}
+    store.close()
+    rehashed = [records[p] for p in expected if p in records]
+    missing = [record for p, record in records.items() if p not in expected]
+    # Every file has a record with the current hash
+    assert len(rehashed) == FILES
+    assert all(records[p]['hash'] == h for p, h in expected.items())
+    assert all(r['hash'].get('schema') == HASH_SCHEMA for r in rehashed)
+    # Metadata kept, orphan files added, records of deleted files kept as they were
+    assert sum('variants' in r for r in rehashed) == FILES - ORPHANS
+    assert all(r['sha256'] and r['file_size'] for r in rehashed)
+    assert len(missing) == MISSING and all('schema' not in r['hash'] for r in missing)
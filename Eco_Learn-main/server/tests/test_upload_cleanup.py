@@ -0,0 +1,60 @@
+import os
+import sqlite3
+
+import pytest
+
+from benchmarks.bench_suite import synthetic_image
+
+# Uploads that fail after their files were placed (server/app.py): the store
+# write raises (contention, "database is locked") or, in a batch, a later
+# file's hashing fails once earlier ones were moved. Each request must answer
+# 500 and leave no file and no blob mapping for the student, since reindex
+# would otherwise adopt them as uploads without a record.
+
+
+def stored_files(app_module, student: str) -> int:
+    mapped = [path for path, _ in app_module.blob_store.paths()] if app_module.blob_store else []
+    return (sum(len(names) for _, _, names in os.walk(os.path.join(app_module.UPLOAD_ROOT, student)))
+            + sum(path.startswith(f'{student}/') for path in mapped))
+
+
+def locked(*args, **kwargs):
+    raise sqlite3.OperationalError("database is locked")
+
+
+def proof(seed: int) -> tuple:
+    return (f'p{seed}.jpg', synthetic_image(seed, (800, 600), 'JPEG'), 'image/jpeg')
+
+
+@pytest.mark.parametrize('endpoint', ['single', 'batch'])
+def test_failed_store_write_leaves_no_files(app_client, monkeypatch, endpoint):
+    import app as app_module
+
+    student = f'cleanup-{endpoint}'
+    form = {'student_id': student, 'challenge_id': '1'}
+    monkeypatch.setattr(app_module.store, 'add_image_if_unique', locked)
+    monkeypatch.setattr(app_module.store, 'add_images_if_unique', locked)
+    if endpoint == 'single':
+        resp = app_client.post('/upload-challenge-proof', data=form, files={'file': proof(2700)})
+    else:
+        resp = app_client.post('/upload-challenge-proofs', data=form,
+                               files=[('files', proof(seed)) for seed in (2701, 2702, 2703)])
+    assert resp.status_code == 500
+    assert stored_files(app_module, student) == 0
+
+
+def test_failed_batch_file_undoes_earlier_moves(app_client, monkeypatch):
+    import app as app_module
+
+    run_many = app_module.hash_pool.run_many
+
+    async def last_fails(fn, paths):
+        outputs = await run_many(fn, paths)
+        outputs[-1] = RuntimeError("hashing worker died")
+        return outputs
+
+    monkeypatch.setattr(app_module.hash_pool, 'run_many', last_fails)
+    resp = app_client.post('/upload-challenge-proofs', data={'student_id': 'cleanup-hash', 'challenge_id': '1'},
+                           files=[('files', proof(seed)) for seed in (2704, 2705, 2706)])
+    assert resp.status_code == 500
+    assert stored_files(app_module, 'cleanup-hash') == 0
@@ -0,0 +1,146 @@
+import hashlib
+import http.client
+import importlib.util
+import json
+import os
+import random
+import threading
+import tracemalloc
+import uuid
+from http.server import ThreadingHTTPServer
+
+import pytest
+from PIL import Image, ImageDraw
+
+from benchmarks.bench_suite import encode
+
+# End-to-end streaming multipart parsing in api/upload-challenge-proof.py: the
+# handler is served from a local ThreadingHTTPServer and gets multi-megabyte
+# PNG and JPEG proofs plus edge cases (file bytes ending in CRLF or holding
+# the boundary prefix, truncated bodies, oversized files). Writes to the
+# handler's /tmp hash store under a fresh student id per run.
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'api')
+MEGAPIXELS = 4
+MAX_UPLOAD_BYTES = 16 * 1024 * 1024  # above the proofs, small enough to exceed quickly
+
+
+def make_image(fmt: str, megapixels: float, seed: int) -> bytes:
+    rnd = random.Random(seed)
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = width * 3 // 4
+    image = Image.effect_noise((width, height), 48).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rnd.randrange(width), rnd.randrange(height)
+        draw.ellipse((x, y, x + width // 5, y + height // 5), fill=tuple(rnd.randrange(256) for _ in range(3)))
+    return encode(image, fmt, **({'quality': 95} if fmt == 'JPEG' else {}))
+
+
+def encode_form(fields: dict, filename: str, data: bytes, boundary: str) -> bytes:
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n'.encode())
+    parts.append(data)
+    parts.append(f'\r\n--{boundary}--\r\n'.encode())
+    return b''.join(parts)
+
+
+@pytest.fixture(scope='module')
+def handler_module():
+    spec = importlib.util.spec_from_file_location('upload_challenge_proof',
+                                                  os.path.join(API_DIR, 'upload-challenge-proof.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.MAX_UPLOAD_BYTES = MAX_UPLOAD_BYTES
+    return module
+
+
+@pytest.fixture(scope='module')
+def upload(handler_module):
+    """post(fields, filename, data) or post(body=..., content_length=...)
+    against the served handler; returns (status, JSON payload or None)."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler_module.handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    boundary = f'----eco{uuid.uuid4().hex}'
+    student = f'mp-{uuid.uuid4().hex[:8]}'
+
+    def post(fields=None, filename=None, data=None, body=None, content_length=None):
+        if body is None:
+            body = encode_form({'student_id': student, **fields}, filename, data, boundary)
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=120)
+        conn.putrequest('POST', '/api/upload-challenge-proof')
+        conn.putheader('Content-Type', f'multipart/form-data; boundary={boundary}')
+        conn.putheader('Content-Length', str(len(body) if content_length is None else content_length))
+        conn.endheaders()
+        try:
+            try:
+                conn.send(body)
+                if content_length is not None and content_length > len(body):
+                    conn.sock.shutdown(1)  # truncated: half-close so the server sees EOF
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            resp = conn.getresponse()
+            payload = resp.read()
+            return resp.status, json.loads(payload) if payload else None
+        finally:
+            conn.close()
+
+    post.boundary = boundary
+    post.student = student
+    yield post
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize('fmt, filename', [('PNG', 'proof.png'), ('JPEG', 'proof.jpg')])
+def test_large_proof_round_trips(upload, fmt, filename):
+    data = make_image(fmt, MEGAPIXELS, seed=len(fmt))
+    status, payload = upload({'challenge_id': fmt}, filename, data)
+    assert status == 200
+    assert payload['record']['sha256'] == hashlib.sha256(data).hexdigest()
+    assert payload['record']['file_size'] == len(data)
+
+
+def test_file_ending_in_crlf_and_boundary_prefix_kept(upload):
+    # The old split()-based parser truncated or split these
+    tricky = make_image('JPEG', 1, seed=7) + f'--{upload.boundary[:-1]}\r\n'.encode()
+    status, payload = upload({'challenge_id': 'edge'}, 'edge.jpg', tricky)
+    assert status == 200
+    assert payload['record']['sha256'] == hashlib.sha256(tricky).hexdigest()
+
+
+def test_truncated_body_rejected(upload):
+    body = encode_form({'student_id': upload.student, 'challenge_id': 'cut'}, 'cut.jpg',
+                       make_image('JPEG', 1, seed=8), upload.boundary)
+    assert upload(body=body[:len(body) // 2], content_length=len(body))[0] == 400
+    assert upload(body=body[:-len(f'--{upload.boundary}--\r\n')])[0] == 400
+
+
+def test_oversized_content_length_rejected_before_reading(upload, handler_module):
+    status, _ = upload(body=b'', content_length=MAX_UPLOAD_BYTES + handler_module.MULTIPART_OVERHEAD + 1)
+    assert status == 413
+
+
+def test_file_part_over_limit_rejected(upload):
+    status, _ = upload({'challenge_id': 'big'}, 'big.jpg', os.urandom(MAX_UPLOAD_BYTES + 1))
+    assert status == 413
+
+
+def test_streaming_parse_peak_below_file_size(tmp_path, handler_module):
+    data = make_image('PNG', MEGAPIXELS, seed=0)
+    boundary = f'----eco{uuid.uuid4().hex}'
+    body = encode_form({'student_id': 's', 'challenge_id': 'm'}, 'proof.png', data, boundary)
+    path = tmp_path / 'body'
+    path.write_bytes(body)
+    with open(path, 'rb') as f:
+        tracemalloc.start()
+        try:
+            _, parsed = handler_module.parse_multipart(f, len(body), boundary.encode())
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        parsed.close()
+    assert peak <= len(data), f"peak {peak / 1e6:.2f} MB for a {len(data) / 1e6:.1f} MB file"